@@ -51,6 +51,7 @@ from bpy.props import (CollectionProperty,
                        BoolProperty,
                        EnumProperty,
                        FloatProperty,
+                       IntProperty,
                        )
 from bpy_extras.io_utils import (ImportHelper,
                                  ExportHelper,
@@ -74,6 +75,30 @@ class ImportPLY(bpy.types.Operator, ImportHelper):
     filename_ext = ".ply"
     filter_glob = StringProperty(default="*.ply", options={'HIDDEN'})
 
+    decimate = EnumProperty(
+            name="Decimate Points",
+            description="Thin out files containing only vertices "
+                        "(point clouds) while loading them",
+            items=(('NONE', "None", "Load all the points"),
+                   ('STRIDE', "Stride", "Keep one point out of N"),
+                   ('VOXEL', "Voxel Grid",
+                    "Keep one point per cell of a regular grid"),
+                   ),
+            default='NONE',
+            )
+    decimate_stride = IntProperty(
+            name="Stride",
+            description="Keep one point out of this many",
+            min=2, max=1000,
+            default=2,
+            )
+    voxel_size = FloatProperty(
+            name="Voxel Size",
+            description="Size of the grid cells",
+            min=0.0001, max=1000.0,
+            default=0.01,
+            )
+
     def execute(self, context):
         paths = [os.path.join(self.directory, name.name)
                  for name in self.files]
@@ -83,7 +108,11 @@ class ImportPLY(bpy.types.Operator, ImportHelper):
         from . import import_ply
 
         for path in paths:
-            import_ply.load(self, context, path)
+            import_ply.load(self, context, path,
+                            decimate=self.decimate,
+                            decimate_stride=self.decimate_stride,
+                            voxel_size=self.voxel_size,
+                            )
 
         return {'FINISHED'}
 
@@ -20,6 +20,11 @@
 
 import re
 import struct
+import itertools
+from array import array
+
+# number of rows decoded per struct call by element_spec.load_all
+BINARY_CHUNK = 4096
 
 
 class element_spec(object):
@@ -38,6 +43,101 @@ class element_spec(object):
             stream = re.split(b'\s+', stream.readline())
         return [x.load(format, stream) for x in self.properties]
 
+    def load_all(self, format, stream):
+        """
+        Read all the rows of the element from a binary stream at once.
+
+        The whole element is read with one readinto and decoded with a
+        compound struct layout, lists are expected to have the same length
+        as in the first row (all-triangles or all-quads faces).
+
+        Returns None with the stream left untouched when the element can't
+        be read this way (strings, lists of varying length).
+        """
+        if not self.count:
+            return []
+
+        properties = self.properties
+        if any(p.numeric_type == 's' or p.list_type == 's' for p in properties):
+            return None
+
+        start = stream.tell()
+
+        # The first row gives the length of the lists, fields holds the
+        # (first field, list length or None) of each property.
+        row = ''
+        fields = []
+        for p in properties:
+            if p.list_type is not None:
+                fmt = format + p.list_type
+                data = stream.read(struct.calcsize(fmt))
+                if len(data) != struct.calcsize(fmt):
+                    stream.seek(start)
+                    return None
+                count = int(struct.unpack(fmt, data)[0])
+                stream.seek(count * struct.calcsize(format + p.numeric_type), 1)
+                fields.append((len(row), count))
+                row += p.list_type + p.numeric_type * count
+            else:
+                stream.seek(struct.calcsize(format + p.numeric_type), 1)
+                fields.append((len(row), None))
+                row += p.numeric_type
+        stream.seek(start)
+
+        data = bytearray(struct.calcsize(format + row) * self.count)
+        if stream.readinto(data) != len(data):
+            stream.seek(start)
+            return None
+
+        stride = len(row)
+        rows = []
+        offset = 0
+        for first in range(0, self.count, BINARY_CHUNK):
+            nbr = min(BINARY_CHUNK, self.count - first)
+            unpack = struct.Struct(format + row * nbr)
+            flat = unpack.unpack_from(data, offset)
+            offset += unpack.size
+
+            columns = []
+            for i, count in fields:
+                if count is None:
+                    columns.append(flat[i::stride])
+                elif flat[i::stride].count(count) != nbr:
+                    # lists of varying length, use the generic loader
+                    stream.seek(start)
+                    return None
+                elif count:
+                    columns.append(zip(*[flat[i + 1 + j::stride] for j in range(count)]))
+                else:
+                    columns.append(itertools.repeat((), nbr))
+
+            rows.extend(zip(*columns))
+
+        return rows
+
+    def iter_chunks(self, format, stream, chunk_size):
+        """
+        Iterate over the rows of an element made of scalar properties,
+        *chunk_size* rows at a time, each chunk being a list of columns
+        (one sequence of values per property).
+        """
+        if format == b'ascii':
+            for first in range(0, self.count, chunk_size):
+                nbr = min(chunk_size, self.count - first)
+                yield list(zip(*[self.load(format, stream) for j in range(nbr)]))
+            return
+
+        row = ''.join(p.numeric_type for p in self.properties)
+        stride = len(row)
+        unpack = struct.Struct(format + row * chunk_size)
+
+        for first in range(0, self.count, chunk_size):
+            nbr = min(chunk_size, self.count - first)
+            if nbr != chunk_size:
+                unpack = struct.Struct(format + row * nbr)
+            flat = unpack.unpack(stream.read(unpack.size))
+            yield [flat[i::stride] for i in range(stride)]
+
     def index(self, name):
         for i, p in enumerate(self.properties):
             if p.name == name:
@@ -109,7 +209,15 @@ class object_spec(object):
         self.specs = []
 
     def load(self, format, stream):
-        return dict([(i.name, [i.load(format, stream) for j in range(i.count)]) for i in self.specs])
+        answer = {}
+        for i in self.specs:
+            rows = None
+            if format != b'ascii':
+                rows = i.load_all(format, stream)
+            if rows is None:
+                rows = [i.load(format, stream) for j in range(i.count)]
+            answer[i.name] = rows
+        return answer
 
         '''
         # Longhand for above LC
@@ -124,7 +232,14 @@ class object_spec(object):
             '''
 
 
-def read(filepath):
+def read_header(plyf):
+    """
+    Parse the header of an opened PLY file, leaving the stream at the
+    start of the data.
+
+    Returns (obj_spec, format, texture), format being the struct byte
+    order or b'ascii', or (None, None, None) for an invalid header.
+    """
     format = b''
     texture = b''
     version = b'1.0'
@@ -150,62 +265,70 @@ def read(filepath):
     obj_spec = object_spec()
     invalid_ply = (None, None, None)
 
-    with open(filepath, 'rb') as plyf:
-        signature = plyf.readline()
+    signature = plyf.readline()
 
-        if not signature.startswith(b'ply'):
-            print('Signature line was invalid')
-            return invalid_ply
+    if not signature.startswith(b'ply'):
+        print('Signature line was invalid')
+        return invalid_ply
 
-        valid_header = False
-        for line in plyf:
-            tokens = re.split(br'[ \r\n]+', line)
+    valid_header = False
+    for line in plyf:
+        tokens = re.split(br'[ \r\n]+', line)
 
-            if len(tokens) == 0:
-                continue
-            if tokens[0] == b'end_header':
-                valid_header = True
-                break
-            elif tokens[0] == b'comment':
-                if len(tokens) < 2:
-                    continue
-                elif tokens[1] == b'TextureFile':
-                    if len(tokens) < 4:
-                        print('Invalid texture line')
-                    else:
-                        texture = tokens[2]
-                continue
-            elif tokens[0] == b'obj_info':
+        if len(tokens) == 0:
+            continue
+        if tokens[0] == b'end_header':
+            valid_header = True
+            break
+        elif tokens[0] == b'comment':
+            if len(tokens) < 2:
                 continue
-            elif tokens[0] == b'format':
-                if len(tokens) < 3:
-                    print('Invalid format line')
-                    return invalid_ply
-                if tokens[1] not in format_specs:
-                    print('Unknown format', tokens[1])
-                    return invalid_ply
-                if tokens[2] != version:
-                    print('Unknown version', tokens[2])
-                    return invalid_ply
-                format = tokens[1]
-            elif tokens[0] == b'element':
-                if len(tokens) < 3:
-                    print(b'Invalid element line')
-                    return invalid_ply
-                obj_spec.specs.append(element_spec(tokens[1], int(tokens[2])))
-            elif tokens[0] == b'property':
-                if not len(obj_spec.specs):
-                    print('Property without element')
-                    return invalid_ply
-                if tokens[1] == b'list':
-                    obj_spec.specs[-1].properties.append(property_spec(tokens[4], type_specs[tokens[2]], type_specs[tokens[3]]))
+            elif tokens[1] == b'TextureFile':
+                if len(tokens) < 4:
+                    print('Invalid texture line')
                 else:
-                    obj_spec.specs[-1].properties.append(property_spec(tokens[2], None, type_specs[tokens[1]]))
-        if not valid_header:
-            print("Invalid header ('end_header' line not found!)")
-            return invalid_ply
+                    texture = tokens[2]
+            continue
+        elif tokens[0] == b'obj_info':
+            continue
+        elif tokens[0] == b'format':
+            if len(tokens) < 3:
+                print('Invalid format line')
+                return invalid_ply
+            if tokens[1] not in format_specs:
+                print('Unknown format', tokens[1])
+                return invalid_ply
+            if tokens[2] != version:
+                print('Unknown version', tokens[2])
+                return invalid_ply
+            format = tokens[1]
+        elif tokens[0] == b'element':
+            if len(tokens) < 3:
+                print(b'Invalid element line')
+                return invalid_ply
+            obj_spec.specs.append(element_spec(tokens[1], int(tokens[2])))
+        elif tokens[0] == b'property':
+            if not len(obj_spec.specs):
+                print('Property without element')
+                return invalid_ply
+            if tokens[1] == b'list':
+                obj_spec.specs[-1].properties.append(property_spec(tokens[4], type_specs[tokens[2]], type_specs[tokens[3]]))
+            else:
+                obj_spec.specs[-1].properties.append(property_spec(tokens[2], None, type_specs[tokens[1]]))
+    if not valid_header:
+        print("Invalid header ('end_header' line not found!)")
+        return invalid_ply
 
-        obj = obj_spec.load(format_specs[format], plyf)
+    return obj_spec, format_specs[format], texture
+
+
+def read(filepath):
+    with open(filepath, 'rb') as plyf:
+        obj_spec, format, texture = read_header(plyf)
+        if obj_spec is None:
+            return None, None, None
+
+        obj = obj_spec.load(format, plyf)
 
     return obj_spec, obj, texture
 
@@ -353,13 +476,141 @@ def load_ply_mesh(filepath, ply_name):
     return mesh
 
 
-def load_ply(filepath):
+def is_point_cloud(obj_spec):
+    """
+    Return True when the only element with data is the vertex element
+    made of scalar properties (laser scans and such).
+    """
+    elements = [el for el in obj_spec.specs if el.count]
+    return (len(elements) == 1 and
+            elements[0].name == b'vertex' and
+            -1 not in (elements[0].index(b'x'),
+                       elements[0].index(b'y'),
+                       elements[0].index(b'z')) and
+            all(p.list_type is None and p.numeric_type != 's'
+                for p in elements[0].properties))
+
+
+def load_ply_points(filepath, ply_name,
+                    decimate='NONE',
+                    decimate_stride=2,
+                    voxel_size=0.01,
+                    chunk_size=65536,
+                    progress=None,
+                    ):
+    """
+    Load a vertex only PLY file as a mesh without faces.
+
+    Vertices are read *chunk_size* at a time into flat arrays instead of
+    one list per vertex, they can be decimated while loading:
+
+    decimate
+        'NONE', 'STRIDE' to keep one vertex out of *decimate_stride* or
+        'VOXEL' to keep the first vertex of each cell of a grid of
+        *voxel_size*.
+
+    progress
+        Optional callable, given the fraction of vertices read.
+
+    Colors are stored packed as 0xRRGGBB integers in the "ply_color"
+    custom property of the mesh, one per vertex.
+    """
+    from math import floor
+
+    with open(filepath, 'rb') as plyf:
+        obj_spec, format, texture = read_header(plyf)
+        if obj_spec is None:
+            print('Invalid file')
+            return
+
+        # skip the empty elements declared before the vertices
+        el = [el for el in obj_spec.specs if el.count][0]
+        vindices = el.index(b'x'), el.index(b'y'), el.index(b'z')
+        colindices = el.index(b'red'), el.index(b'green'), el.index(b'blue')
+        if -1 in colindices:
+            colindices = None
+        else:  # if not a float assume uchar
+            colmultiply = [255.0 if el.properties[i].numeric_type in {'f', 'd'} else 1.0 for i in colindices]
+
+        coords = array('f')
+        colors = array('i')
+        voxels = set()
+        index = 0
+
+        for columns in el.iter_chunks(format, plyf, chunk_size):
+            nbr = len(columns[0])
+
+            if decimate == 'STRIDE':
+                # keep the stride steady across chunks
+                first = -index % decimate_stride
+                columns = [col[first::decimate_stride] for col in columns]
+            elif decimate == 'VOXEL':
+                x, y, z = (columns[i] for i in vindices)
+                inv = 1.0 / voxel_size
+                keep = [cell not in voxels and not voxels.add(cell) for cell in
+                        zip([floor(a * inv) for a in x],
+                            [floor(a * inv) for a in y],
+                            [floor(a * inv) for a in z])]
+                columns = [list(itertools.compress(col, keep)) for col in columns]
+
+            index += nbr
+
+            chunk = array('f', bytes(len(columns[0]) * 3 * 4))
+            for i, vindex in enumerate(vindices):
+                chunk[i::3] = array('f', columns[vindex])
+            coords.extend(chunk)
+
+            if colindices:
+                r, g, b = ([min(255, int(c * m)) for c in columns[i]]
+                           for i, m in zip(colindices, colmultiply))
+                colors.extend([(cr << 16) | (cg << 8) | cb
+                               for cr, cg, cb in zip(r, g, b)])
+
+            if progress:
+                progress(index / el.count)
+
+    mesh = bpy.data.meshes.new(name=ply_name)
+
+    mesh.vertices.add(len(coords) // 3)
+    mesh.vertices.foreach_set("co", coords)
+    del coords
+
+    if colindices:
+        mesh["ply_color"] = colors
+
+    mesh.validate()
+    mesh.update()
+
+    return mesh
+
+
+def load_ply(filepath,
+             decimate='NONE',
+             decimate_stride=2,
+             voxel_size=0.01,
+             ):
     import time
 
     t = time.time()
     ply_name = bpy.path.display_name_from_filepath(filepath)
 
-    mesh = load_ply_mesh(filepath, ply_name)
+    with open(filepath, 'rb') as plyf:
+        obj_spec = read_header(plyf)[0]
+
+    if obj_spec is not None and is_point_cloud(obj_spec):
+        wm = bpy.context.window_manager
+        wm.progress_begin(0, 100)
+        try:
+            mesh = load_ply_points(filepath, ply_name,
+                                   decimate=decimate,
+                                   decimate_stride=decimate_stride,
+                                   voxel_size=voxel_size,
+                                   progress=lambda f: wm.progress_update(int(f * 100)),
+                                   )
+        finally:
+            wm.progress_end()
+    else:
+        mesh = load_ply_mesh(filepath, ply_name)
     if not mesh:
         return {'CANCELLED'}
 
@@ -374,5 +625,13 @@ def load_ply(filepath):
     return {'FINISHED'}
 
 
-def load(operator, context, filepath=""):
-    return load_ply(filepath)
+def load(operator, context, filepath="",
+         decimate='NONE',
+         decimate_stride=2,
+         voxel_size=0.01,
+         ):
+    return load_ply(filepath,
+                    decimate=decimate,
+                    decimate_stride=decimate_stride,
+                    voxel_size=voxel_size,
+                    )
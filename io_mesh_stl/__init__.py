@@ -109,7 +109,7 @@ class ImportSTL(Operator, ImportHelper):
 
         for path in paths:
             objName = bpy.path.display_name(os.path.basename(path))
-            tris, pts = stl_utils.read_stl(path)
+            tris, pts = stl_utils.read_stl_arrays(path)
             blender_utils.create_and_link_mesh(objName, tris, pts)
 
         return {'FINISHED'}
@@ -172,11 +172,11 @@ class ExportSTL(Operator, ExportHelper):
                                         to_up=self.axis_up,
                                         ).to_4x4() * Matrix.Scale(self.global_scale, 4)
 
-        faces = itertools.chain.from_iterable(
-            blender_utils.faces_from_mesh(ob, global_matrix, self.use_mesh_modifiers)
+        chunks = itertools.chain.from_iterable(
+            blender_utils.triangles_from_mesh(ob, global_matrix, self.use_mesh_modifiers)
             for ob in context.selected_objects)
 
-        stl_utils.write_stl(self.filepath, faces, self.ascii)
+        stl_utils.write_stl_arrays(self.filepath, chunks, self.ascii)
 
         return {'FINISHED'}
 
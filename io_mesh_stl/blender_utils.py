@@ -19,16 +19,38 @@
 # <pep8 compliant>
 
 import bpy
+import itertools
+from array import array
 
 
 def create_and_link_mesh(name, faces, points):
     """
     Create a blender mesh and object called name from a list of
     *points* and *faces* and link it in the current scene.
+
+    *faces* and *points* can also be the flat arrays returned by
+    stl_utils.read_stl_arrays, they are then given as is to foreach_set.
     """
 
     mesh = bpy.data.meshes.new(name)
-    mesh.from_pydata(points, [], faces)
+
+    if isinstance(faces, array):
+        nbr_tris = len(faces) // 3
+
+        mesh.vertices.add(len(points) // 3)
+        mesh.vertices.foreach_set("co", points)
+
+        mesh.loops.add(len(faces))
+        mesh.loops.foreach_set("vertex_index", faces)
+
+        mesh.polygons.add(nbr_tris)
+        mesh.polygons.foreach_set("loop_start",
+                                  array('i', range(0, nbr_tris * 3, 3)))
+        mesh.polygons.foreach_set("loop_total", array('i', (3,)) * nbr_tris)
+
+        mesh.update(calc_edges=True)
+    else:
+        mesh.from_pydata(points, [], faces)
 
     # update mesh to allow proper display
     mesh.validate()
@@ -88,3 +110,66 @@ def faces_from_mesh(ob, global_matrix, use_mesh_modifiers=False, triangulate=Tru
         yield [vertices[index].co.copy() for index in indexes]
 
     bpy.data.meshes.remove(mesh)
+
+
+def triangles_from_mesh(ob, global_matrix, use_mesh_modifiers=False,
+                        chunk_size=65536):
+    """
+    From an object, return a generator over chunks of triangles.
+
+    Each chunk is a flat array('f') of 9 coordinates (3 vertex) per
+    triangle, quads being split into two triangles, which is what
+    stl_utils.write_stl_arrays expects.
+
+    Coordinates and tessellated faces are fetched in bulk with
+    foreach_get, only *chunk_size* faces are expanded at once.
+
+    use_mesh_modifiers
+        Apply the preview modifier to the returned triangles
+    """
+
+    # get the editmode data
+    ob.update_from_editmode()
+
+    # get the modifiers
+    try:
+        mesh = ob.to_mesh(bpy.context.scene, use_mesh_modifiers, "PREVIEW")
+    except RuntimeError:
+        return
+
+    mesh.transform(global_matrix * ob.matrix_world)
+
+    co = array('f', bytes(len(mesh.vertices) * 3 * 4))
+    mesh.vertices.foreach_get("co", co)
+    # packed bytes of each vertex, so triangles are built with one join
+    co = co.tobytes()
+    verts = [co[i:i + 12] for i in range(0, len(co), 12)]
+    del co
+
+    faces = array('i', bytes(len(mesh.tessfaces) * 4 * 4))
+    mesh.tessfaces.foreach_get("vertices_raw", faces)
+
+    bpy.data.meshes.remove(mesh)
+
+    compress = itertools.compress
+
+    for start in range(0, len(faces), chunk_size * 4):
+        raw = faces[start:start + chunk_size * 4]
+        v1, v2, v3, v4 = raw[0::4], raw[1::4], raw[2::4], raw[3::4]
+
+        # the 4th index of a triangle is always 0 (eekadoodle)
+        nbr_tris = len(v1)
+        nbr_quads = len(v4) - v4.count(0)
+
+        tris = array('i', bytes((nbr_tris + nbr_quads) * 3 * 4))
+        tris[0:nbr_tris * 3:3] = v1
+        tris[1:nbr_tris * 3:3] = v2
+        tris[2:nbr_tris * 3:3] = v3
+        if nbr_quads:
+            tris[nbr_tris * 3 + 0::3] = array('i', compress(v3, v4))
+            tris[nbr_tris * 3 + 1::3] = array('i', compress(v4, v4))
+            tris[nbr_tris * 3 + 2::3] = array('i', compress(v1, v4))
+
+        chunk = array('f')
+        chunk.frombytes(b''.join(map(verts.__getitem__, tris)))
+        yield chunk
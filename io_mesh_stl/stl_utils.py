@@ -30,6 +30,8 @@ import struct
 import mmap
 import contextlib
 import itertools
+import sys
+from array import array
 
 # TODO: endien
 
@@ -85,6 +87,9 @@ class ListDict(dict):
 BINARY_HEADER = 80
 BINARY_STRIDE = 12 * 4 + 2
 
+# number of triangles decoded per struct call by the bulk reader
+BINARY_CHUNK = 4096
+
 
 def _header_version():
     import bpy
@@ -128,6 +133,52 @@ def _binary_read(data):
         yield pt[:3], pt[3:6], pt[6:]
 
 
+def _binary_read_keys(data):
+    # Same layout as _binary_read, but each vertex is returned as its
+    # packed 12 bytes (3 little endian floats), the normal and the
+    # attribute bytes being skipped by the struct format itself.
+    # Decoding a whole chunk of triangles per unpack call keeps the loop
+    # out of python.
+    size = struct.unpack_from('<I', data, BINARY_HEADER)[0]
+    offset = BINARY_HEADER + 4
+    record = '12x12s12s12s2x'
+
+    unpack = struct.Struct('<' + record * BINARY_CHUNK).unpack_from
+    keys = []
+
+    for i in range(size // BINARY_CHUNK):
+        keys.extend(unpack(data, offset))
+        offset += BINARY_STRIDE * BINARY_CHUNK
+
+    rest = size % BINARY_CHUNK
+    if rest:
+        keys.extend(struct.unpack_from('<' + record * rest, data, offset))
+
+    return keys
+
+
+def _weld_keys(keys):
+    """
+    Remove the doubles of a list of packed points.
+
+    Points are compared by their packed bytes, the unique ones are sorted
+    and each key is replaced by the index of its unique point.
+
+    - returns a tuple(indices, coords) of flat arrays, see read_stl_arrays.
+    """
+    unique = sorted(set(keys))
+    index = dict(zip(unique, range(len(unique))))
+
+    indices = array('i', map(index.__getitem__, keys))
+
+    coords = array('f')
+    coords.frombytes(b''.join(unique))
+    if sys.byteorder != 'little':
+        coords.byteswap()
+
+    return indices, coords
+
+
 def _ascii_read(data):
     # an stl ascii file is like
     # HEADER: solid some name
@@ -156,40 +207,115 @@ def _ascii_read(data):
                    for l_item in (l, data.readline(), data.readline())]
 
 
-def _binary_write(filename, faces):
+def _normals(coords):
+    """
+    Return the unit normals of a flat array of triangle coordinates
+    (9 floats per triangle) as a flat array of 3 floats per triangle.
+
+    The computation is done per component over whole columns.
+    """
+    from math import sqrt
+    from operator import sub, mul
+
+    ax, ay, az = coords[0::9], coords[1::9], coords[2::9]
+    ux = list(map(sub, coords[3::9], ax))
+    uy = list(map(sub, coords[4::9], ay))
+    uz = list(map(sub, coords[5::9], az))
+    vx = list(map(sub, coords[6::9], ax))
+    vy = list(map(sub, coords[7::9], ay))
+    vz = list(map(sub, coords[8::9], az))
+
+    nx = list(map(sub, map(mul, uy, vz), map(mul, uz, vy)))
+    ny = list(map(sub, map(mul, uz, vx), map(mul, ux, vz)))
+    nz = list(map(sub, map(mul, ux, vy), map(mul, uy, vx)))
+
+    # degenerated triangles get a null normal
+    inv = [1.0 / l if l else 0.0 for l in
+           map(sqrt, map(sum, zip(map(mul, nx, nx),
+                                  map(mul, ny, ny),
+                                  map(mul, nz, nz))))]
+
+    normals = array('f', bytes(len(inv) * 12))
+    normals[0::3] = array('f', map(mul, nx, inv))
+    normals[1::3] = array('f', map(mul, ny, inv))
+    normals[2::3] = array('f', map(mul, nz, inv))
+    return normals
+
+
+def _chunks_from_faces(faces):
+    """
+    Group an iterable of faces (tuple of 3 vertex, vertex being a tuple
+    of 3 coordinates) into flat arrays of BINARY_CHUNK triangles, as
+    expected by write_stl_arrays.
+    """
+    chain = itertools.chain.from_iterable
+    faces = iter(faces)
+
+    while True:
+        chunk = array('f', chain(chain(
+            itertools.islice(faces, BINARY_CHUNK))))
+        if not chunk:
+            break
+        yield chunk
+
+
+def _binary_write(filename, chunks):
     with open(filename, 'wb') as data:
         # header
         # we write padding at header beginning to avoid to
         # call len(list(faces)) which may be expensive
         data.write(struct.calcsize('<80sI') * b'\0')
 
-        # 3 vertex == 9f
-        pack = struct.Struct('<9f').pack
-        # pad is to remove normal, we do use them
-        pad = b'\0' * struct.calcsize('<3f')
-
         nb = 0
-        for verts in faces:
-            # write pad as normal + vertexes + pad as attributes
-            data.write(pad + pack(*itertools.chain.from_iterable(verts)))
-            data.write(b'\0\0')
-            nb += 1
+        for coords in chunks:
+            size = len(coords) // 9
+
+            normals = _normals(coords)
+            if sys.byteorder != 'little':
+                coords = array('f', coords)
+                coords.byteswap()
+                normals.byteswap()
+            coords = coords.tobytes()
+            normals = normals.tobytes()
+
+            # Interleave the normals and the coordinates into the records
+            # with one strided copy per byte of the record, the 2 bytes of
+            # attributes stay at 0.
+            records = bytearray(BINARY_STRIDE * size)
+            for i in range(12):
+                records[i::BINARY_STRIDE] = normals[i::12]
+            for i in range(36):
+                records[12 + i::BINARY_STRIDE] = coords[i::36]
+
+            data.write(records)
+            nb += size
 
         # header, with correct value now
         data.seek(0)
         data.write(struct.pack('<80sI', _header_version().encode('ascii'), nb))
 
 
-def _ascii_write(filename, faces):
+def _ascii_write(filename, chunks):
+    facet = ('facet normal %f %f %f\nouter loop\n' +
+             'vertex %f %f %f\n' * 3 +
+             'endloop\nendfacet\n')
+
     with open(filename, 'w') as data:
         header = _header_version()
         data.write('solid %s\n' % header)
 
-        for face in faces:
-            data.write('''facet normal 0 0 0\nouter loop\n''')
-            for vert in face:
-                data.write('vertex %f %f %f\n' % vert[:])
-            data.write('endloop\nendfacet\n')
+        for coords in chunks:
+            size = len(coords) // 9
+            normals = _normals(coords)
+
+            # 12 values per facet: the normal then the 3 vertices
+            values = array('f', bytes(size * 12 * 4))
+            for i in range(3):
+                values[i::12] = normals[i::3]
+            for i in range(9):
+                values[3 + i::12] = coords[i::9]
+
+            data.write((facet * size) % tuple(values))
 
         data.write('endsolid %s\n' % header)
 
@@ -207,7 +333,24 @@ def write_stl(filename, faces, ascii=False):
     ascii
        save the file in ascii format (very huge)
     """
-    (_ascii_write if ascii else _binary_write)(filename, faces)
+    write_stl_arrays(filename, _chunks_from_faces(faces), ascii)
+
+
+def write_stl_arrays(filename, chunks, ascii=False):
+    """
+    Write a stl file from chunks of triangles,
+
+    filename
+       output filename
+
+    chunks
+       iterable of flat array('f'), 9 coordinates (3 vertex) per triangle,
+       each chunk is written at once. See blender_utils.triangles_from_mesh.
+
+    ascii
+       save the file in ascii format (very huge)
+    """
+    (_ascii_write if ascii else _binary_write)(filename, chunks)
 
 
 def read_stl(filename):
@@ -252,6 +395,39 @@ def read_stl(filename):
     return tris, pts.list
 
 
+def read_stl_arrays(filename):
+    """
+    Return the triangles and points of an stl file as flat arrays.
+
+    Same as read_stl, but the binary triangle block is decoded in bulk and
+    the points are welded with a sort/unique pass over their packed bytes,
+    which is much faster and lighter on huge files.
+
+    Please note that points are merged only when they are bitwise equal,
+    so 0.0 and -0.0 are kept as two distinct points.
+
+    - returns a tuple(indices, coords).
+
+      indices
+          An array('i') of 3 point indices per triangle.
+
+      coords
+          An array('f') of 3 floats (xyz) per point.
+
+    Both can be given directly to foreach_set, see
+    blender_utils.create_and_link_mesh.
+    """
+
+    with mmap_file(filename) as data:
+        if _is_ascii_file(data):
+            pack = struct.Struct('<3f').pack
+            keys = [pack(*pt) for tri in _ascii_read(data) for pt in tri]
+        else:
+            keys = _binary_read_keys(data)
+
+    return _weld_keys(keys)
+
+
 if __name__ == '__main__':
     import sys
     import bpy
@@ -261,6 +437,6 @@ if __name__ == '__main__':
 
     for filename in filenames:
         objName = bpy.path.display_name(filename)
-        tris, pts = read_stl(filename)
+        tris, pts = read_stl_arrays(filename)
 
         blender_utils.create_and_link_mesh(objName, tris, pts)
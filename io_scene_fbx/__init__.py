@@ -168,6 +168,18 @@ class ExportFBX(bpy.types.Operator, ExportHelper):
             soft_min=1, soft_max=16,
             default=6.0,
             )
+    anim_optimize_method = EnumProperty(
+            name="Optimize Method",
+            items=(('LINEAR', "Linear", "Remove keys on the line between "
+                                        "their neighbours"),
+                   ('RDP', "Douglas-Peucker", "Keep the keys furthest from the "
+                                              "line between kept keys, fewer keys "
+                                              "on noisy curves"),
+                   ('CONSTANT', "Constant", "Only remove keys inside runs of "
+                                            "the same value"),
+                   ),
+            default='LINEAR',
+            )
     path_mode = path_reference_mode
     use_rotate_workaround = BoolProperty(
             name="XNA Rotate Animation Hack",
@@ -24,9 +24,12 @@
 import os
 import time
 import math  # math.pi
+from array import array
+from itertools import accumulate
 
 import bpy
 from mathutils import Vector, Matrix
+from keyframe_utils import reduce_keys, reduce_linear
 
 # I guess FBX uses degrees instead of radians (Arystan).
 # Call this function just before writing to FBX.
@@ -135,6 +138,70 @@ def mat4x4str(mat):
             tuple([f for v in mat.transposed() for f in v]))
 
 
+# Number of rows joined into a single write, large meshes are written in
+# blocks of formatted rows rather than one fw() call per value.
+FBX_ROWS_PER_WRITE = 1024
+
+
+def fbx_write_rows(fw, values, fmt, row_ends, sep):
+    """ Writes the flat sequence of numbers *values*, comma separated.
+    *fmt* formats one item (it may take several values, e.g. '%.6f,%.6f,%.6f'),
+    a new row is started with *sep* at every offset (in values) of *row_ends*.
+    """
+    sep += ","
+    stride = fmt.count('%')
+    row_fmts = {}
+    rows = []
+    start = 0
+    first = True
+
+    for end in row_ends:
+        size = end - start
+        row_fmt = row_fmts.get(size)
+        if row_fmt is None:
+            row_fmt = row_fmts[size] = ",".join((fmt,) * (size // stride))
+
+        rows.append(row_fmt % tuple(values[start:end]))
+        start = end
+
+        if len(rows) == FBX_ROWS_PER_WRITE:
+            fw(sep.join(rows) if first else sep + sep.join(rows))
+            rows.clear()
+            first = False
+
+    if rows:
+        fw(sep.join(rows) if first else sep + sep.join(rows))
+
+
+def fbx_write_array(fw, values, fmt, per_row, sep):
+    """ Writes *values* with *per_row* items of *fmt* per row, see fbx_write_rows.
+    """
+    tot = len(values)
+    step = per_row * fmt.count('%')
+    row_ends = list(range(step, tot, step))
+    if tot:
+        row_ends.append(tot)
+
+    fbx_write_rows(fw, values, fmt, row_ends, sep)
+
+
+def fbx_face_corners(values, stride, face_sizes):
+    """ Takes a flat array of per face values for 4 corners (*stride* values per corner),
+    returns the values of the corners used by each face (3 for triangles).
+    """
+    if all(size == 4 for size in face_sizes):
+        return values
+
+    per_face = stride * 4
+    corners = []
+    corners_extend = corners.extend
+    for i, size in enumerate(face_sizes):
+        start = i * per_face
+        corners_extend(values[start:start + size * stride])
+
+    return corners
+
+
 def action_bone_names(obj, action):
     from bpy.types import PoseBone
 
@@ -219,6 +286,7 @@ def save_single(operator, scene, filepath="",
         use_anim=True,
         use_anim_optimize=True,
         anim_optimize_precision=6,
+        anim_optimize_method='LINEAR',
         use_anim_action_all=False,
         use_metadata=True,
         path_mode='AUTO',
@@ -340,6 +408,11 @@ def save_single(operator, scene, filepath="",
         def getAnimParRelMatrixRot(self, frame):
             return self.getAnimParRelMatrix(frame)
 
+        # both of the above, computed once
+        def getAnimParRelMatrices(self, frame):
+            matrix = self.getAnimParRelMatrix(frame)
+            return matrix, matrix
+
         def flushAnimData(self):
             self.__anim_poselist.clear()
 
@@ -396,11 +469,16 @@ def save_single(operator, scene, filepath="",
                 return global_matrix * self.__anim_poselist[frame]
 
         def getAnimParRelMatrixRot(self, frame):
+            return self.rotFromParRelMatrix(self.getAnimParRelMatrix(frame))
+
+        # both of the above, computed once
+        def getAnimParRelMatrices(self, frame):
+            matrix = self.getAnimParRelMatrix(frame)
+            return matrix, self.rotFromParRelMatrix(matrix)
+
+        def rotFromParRelMatrix(self, matrix):
             obj_type = self.blenObject.type
-            if self.fbxParent:
-                matrix_rot = ((global_matrix * self.fbxParent.__anim_poselist[frame]).inverted() * (global_matrix * self.__anim_poselist[frame])).to_3x3()
-            else:
-                matrix_rot = (global_matrix * self.__anim_poselist[frame]).to_3x3()
+            matrix_rot = matrix.to_3x3()
 
             # Lamps need to be rotated
             if obj_type == 'LAMP':
@@ -411,6 +489,9 @@ def save_single(operator, scene, filepath="",
 
             return matrix_rot
 
+        def flushAnimData(self):
+            self.__anim_poselist.clear()
+
     # ----------------------------------------------
 
     print('\nFBX export starting... %r' % filepath)
@@ -1364,10 +1445,22 @@ def save_single(operator, scene, filepath="",
         fw('\n\tModel: "Model::%s", "Mesh" {' % my_mesh.fbxName)
         fw('\n\t\tVersion: 232')  # newline is added in write_object_props
 
-        # convert into lists once.
-        me_vertices = me.vertices[:]
-        me_edges = me.edges[:] if use_mesh_edges else ()
-        me_faces = me.tessfaces[:]
+        # read the mesh layers once, into flat arrays.
+        tot_verts = len(me.vertices)
+        tot_edges = len(me.edges) if use_mesh_edges else 0
+        tot_faces = len(me.tessfaces)
+
+        me_verts_co = array('f', [0.0]) * (tot_verts * 3)
+        me.vertices.foreach_get("co", me_verts_co)
+
+        me_edges_verts = array('i', [0]) * (tot_edges * 2)
+        if tot_edges:
+            me.edges.foreach_get("vertices", me_edges_verts)
+
+        # 4 indices per face, the 4th is 0 for triangles
+        me_faces_verts = array('i', [0]) * (tot_faces * 4)
+        me.tessfaces.foreach_get("vertices_raw", me_faces_verts)
+        me_faces_sizes = [4 if v4 else 3 for v4 in me_faces_verts[3::4]]
 
         poseMatrix = write_object_props(my_mesh.blenObject, None, my_mesh.parRelMatrix())[3]
 
@@ -1390,69 +1483,35 @@ def save_single(operator, scene, filepath="",
 
         # Write the Real Mesh data here
         fw('\n\t\tVertices: ')
-        i = -1
+        fbx_write_array(fw, me_verts_co, '%.6f,%.6f,%.6f', 7, '\n\t\t')
 
-        for v in me_vertices:
-            if i == -1:
-                fw('%.6f,%.6f,%.6f' % v.co[:])
-                i = 0
-            else:
-                if i == 7:
-                    fw('\n\t\t')
-                    i = 0
-                fw(',%.6f,%.6f,%.6f' % v.co[:])
-            i += 1
+        # last index XORd w. -1 indicates end of face
+        poly_verts = array('i', fbx_face_corners(me_faces_verts, 1, me_faces_sizes))
+        poly_ends = list(accumulate(me_faces_sizes))
 
-        fw('\n\t\tPolygonVertexIndex: ')
-        i = -1
-        for f in me_faces:
-            fi = f.vertices[:]
+        # write loose edges as faces.
+        if tot_edges:
+            me_edges_loose = [False] * tot_edges
+            me.edges.foreach_get("is_loose", me_edges_loose)
 
-            # last index XORd w. -1 indicates end of face
-            if i == -1:
-                if len(fi) == 3:
-                    fw('%i,%i,%i' % (fi[0], fi[1], fi[2] ^ -1))
-                else:
-                    fw('%i,%i,%i,%i' % (fi[0], fi[1], fi[2], fi[3] ^ -1))
-                i = 0
-            else:
-                if i == 13:
-                    fw('\n\t\t')
-                    i = 0
-                if len(fi) == 3:
-                    fw(',%i,%i,%i' % (fi[0], fi[1], fi[2] ^ -1))
-                else:
-                    fw(',%i,%i,%i,%i' % (fi[0], fi[1], fi[2], fi[3] ^ -1))
-            i += 1
+            for j, is_loose in enumerate(me_edges_loose):
+                if is_loose:
+                    poly_verts.extend(me_edges_verts[j * 2:j * 2 + 2])
+                    poly_ends.append(len(poly_verts))
 
-        # write loose edges as faces.
-        for ed in me_edges:
-            if ed.is_loose:
-                ed_val = ed.vertices[:]
-                ed_val = ed_val[0], ed_val[-1] ^ -1
+        for end in poly_ends:
+            poly_verts[end - 1] ^= -1
 
-                if i == -1:
-                    fw('%i,%i' % ed_val)
-                    i = 0
-                else:
-                    if i == 13:
-                        fw('\n\t\t')
-                        i = 0
-                    fw(',%i,%i' % ed_val)
-            i += 1
+        # 13 faces per row
+        row_ends = poly_ends[12::13]
+        if poly_ends and poly_ends[-1] not in row_ends[-1:]:
+            row_ends.append(poly_ends[-1])
+
+        fw('\n\t\tPolygonVertexIndex: ')
+        fbx_write_rows(fw, poly_verts, '%i', row_ends, '\n\t\t')
 
         fw('\n\t\tEdges: ')
-        i = -1
-        for ed in me_edges:
-            if i == -1:
-                fw('%i,%i' % (ed.vertices[0], ed.vertices[1]))
-                i = 0
-            else:
-                if i == 13:
-                    fw('\n\t\t')
-                    i = 0
-                fw(',%i,%i' % (ed.vertices[0], ed.vertices[1]))
-            i += 1
+        fbx_write_array(fw, me_edges_verts, '%i,%i', 13, '\n\t\t')
 
         fw('\n\t\tGeometryVersion: 124')
 
@@ -1464,17 +1523,9 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "Direct"
 			Normals: ''')
 
-        i = -1
-        for v in me_vertices:
-            if i == -1:
-                fw('%.15f,%.15f,%.15f' % v.normal[:])
-                i = 0
-            else:
-                if i == 2:
-                    fw('\n\t\t\t ')
-                    i = 0
-                fw(',%.15f,%.15f,%.15f' % v.normal[:])
-            i += 1
+        me_verts_no = array('f', [0.0]) * (tot_verts * 3)
+        me.vertices.foreach_get("normal", me_verts_no)
+        fbx_write_array(fw, me_verts_no, '%.15f,%.15f,%.15f', 2, '\n\t\t\t ')
         fw('\n\t\t}')
 
         # Write Face Smoothing
@@ -1487,17 +1538,9 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "Direct"
 			Smoothing: ''')
 
-            i = -1
-            for f in me_faces:
-                if i == -1:
-                    fw('%i' % f.use_smooth)
-                    i = 0
-                else:
-                    if i == 54:
-                        fw('\n\t\t\t ')
-                        i = 0
-                    fw(',%i' % f.use_smooth)
-                i += 1
+            me_faces_smooth = [False] * tot_faces
+            me.tessfaces.foreach_get("use_smooth", me_faces_smooth)
+            fbx_write_array(fw, me_faces_smooth, '%i', 54, '\n\t\t\t ')
 
             fw('\n\t\t}')
 
@@ -1511,17 +1554,10 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "Direct"
 			Smoothing: ''')
 
-            i = -1
-            for ed in me_edges:
-                if i == -1:
-                    fw('%i' % (ed.use_edge_sharp))
-                    i = 0
-                else:
-                    if i == 54:
-                        fw('\n\t\t\t ')
-                        i = 0
-                    fw(',%i' % ed.use_edge_sharp)
-                i += 1
+            me_edges_sharp = [False] * tot_edges
+            if tot_edges:
+                me.edges.foreach_get("use_edge_sharp", me_edges_sharp)
+            fbx_write_array(fw, me_edges_sharp, '%i', 54, '\n\t\t\t ')
 
             fw('\n\t\t}')
         elif mesh_smooth_type == 'OFF':
@@ -1544,39 +1580,19 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "IndexToDirect"
 			Colors: ''')
 
-                i = -1
-                ii = 0  # Count how many Colors we write
-                print(len(me_faces), len(collayer.data))
-                for fi, cf in enumerate(collayer.data):
-                    if len(me_faces[fi].vertices) == 4:
-                        colors = cf.color1[:], cf.color2[:], cf.color3[:], cf.color4[:]
-                    else:
-                        colors = cf.color1[:], cf.color2[:], cf.color3[:]
+                # corners of all faces, 12 values per face
+                colors = [0.0] * (tot_faces * 12)
+                color = array('f', [0.0]) * (tot_faces * 3)
+                for j, attr in enumerate(("color1", "color2", "color3", "color4")):
+                    collayer.data.foreach_get(attr, color)
+                    for k in range(3):
+                        colors[j * 3 + k::12] = color[k::3]
 
-                    for col in colors:
-                        if i == -1:
-                            fw('%.4f,%.4f,%.4f,1' % col)
-                            i = 0
-                        else:
-                            if i == 7:
-                                fw('\n\t\t\t\t')
-                                i = 0
-                            fw(',%.4f,%.4f,%.4f,1' % col)
-                        i += 1
-                        ii += 1  # One more Color
+                colors = fbx_face_corners(colors, 3, me_faces_sizes)
+                fbx_write_array(fw, colors, '%.4f,%.4f,%.4f,1', 7, '\n\t\t\t\t')
 
                 fw('\n\t\t\tColorIndex: ')
-                i = -1
-                for j in range(ii):
-                    if i == -1:
-                        fw('%i' % j)
-                        i = 0
-                    else:
-                        if i == 55:
-                            fw('\n\t\t\t\t')
-                            i = 0
-                        fw(',%i' % j)
-                    i += 1
+                fbx_write_array(fw, range(len(colors) // 3), '%i', 55, '\n\t\t\t\t')
 
                 fw('\n\t\t}')
 
@@ -1594,35 +1610,13 @@ def save_single(operator, scene, filepath="",
 			ReferenceInformationType: "IndexToDirect"
 			UV: ''')
 
-                i = -1
-                ii = 0  # Count how many UVs we write
-
-                for uf in uvlayer.data:
-                    # workaround, since uf.uv iteration is wrong atm
-                    for uv in uf.uv:
-                        if i == -1:
-                            fw('%.6f,%.6f' % uv[:])
-                            i = 0
-                        else:
-                            if i == 7:
-                                fw('\n\t\t\t ')
-                                i = 0
-                            fw(',%.6f,%.6f' % uv[:])
-                        i += 1
-                        ii += 1  # One more UV
+                uvs = array('f', [0.0]) * (tot_faces * 8)
+                uvlayer.data.foreach_get("uv_raw", uvs)
+                uvs = fbx_face_corners(uvs, 2, me_faces_sizes)
+                fbx_write_array(fw, uvs, '%.6f,%.6f', 7, '\n\t\t\t ')
 
                 fw('\n\t\t\tUVIndex: ')
-                i = -1
-                for j in range(ii):
-                    if i == -1:
-                        fw('%i' % j)
-                        i = 0
-                    else:
-                        if i == 55:
-                            fw('\n\t\t\t\t')
-                            i = 0
-                        fw(',%i' % j)
-                    i += 1
+                fbx_write_array(fw, range(len(uvs) // 2), '%i', 55, '\n\t\t\t\t')
 
                 fw('\n\t\t}')
 
@@ -1652,20 +1646,8 @@ def save_single(operator, scene, filepath="",
                                 texture_mapping_local[tex] = i
                                 i += 1
 
-                        i = -1
-                        for f in uvlayer.data:
-                            img_key = f.image
-
-                            if i == -1:
-                                i = 0
-                                fw('%s' % texture_mapping_local[img_key])
-                            else:
-                                if i == 55:
-                                    fw('\n			 ')
-                                    i = 0
-
-                                fw(',%s' % texture_mapping_local[img_key])
-                            i += 1
+                        texture_ids = [texture_mapping_local[f.image] for f in uvlayer.data]
+                        fbx_write_array(fw, texture_ids, '%i', 55, '\n\t\t\t ')
 
                 else:
                     fw('''
@@ -1704,33 +1686,19 @@ def save_single(operator, scene, filepath="",
 
                 mats = my_mesh.blenMaterialList
 
-                if me.tessface_uv_textures.active:
-                    uv_faces = me.tessface_uv_textures.active.data
+                if do_uvs:
+                    # WARNING - MULTI UV LAYER IMAGES NOT SUPPORTED :/
+                    uv_images = [uf.image for uf in me.tessface_uv_textures.active.data]
                 else:
-                    uv_faces = [None] * len(me_faces)
-
-                i = -1
-                for f, uf in zip(me_faces, uv_faces):
-                    try:
-                        mat = mats[f.material_index]
-                    except:
-                        mat = None
-
-                    if do_uvs:
-                        tex = uf.image  # WARNING - MULTI UV LAYER IMAGES NOT SUPPORTED :/
-                    else:
-                        tex = None
+                    uv_images = [None] * tot_faces
 
-                    if i == -1:
-                        i = 0
-                        fw('%s' % material_mapping_local[mat, tex])  # None for mat or tex is ok
-                    else:
-                        if i == 55:
-                            fw('\n\t\t\t\t')
-                            i = 0
+                me_faces_mat = array('i', [0]) * tot_faces
+                me.tessfaces.foreach_get("material_index", me_faces_mat)
 
-                        fw(',%s' % material_mapping_local[mat, tex])
-                    i += 1
+                tot_mats = len(mats)
+                material_ids = [material_mapping_local[mats[mat_index] if mat_index < tot_mats else None, tex]
+                                for mat_index, tex in zip(me_faces_mat, uv_images)]  # None for mat or tex is ok
+                fbx_write_array(fw, material_ids, '%i', 55, '\n\t\t\t\t')
 
             fw('\n\t\t}')
 
@@ -1825,51 +1793,29 @@ def save_single(operator, scene, filepath="",
 
         if do_shapekeys:
             key_blocks = my_mesh.blenObject.data.shape_keys.key_blocks[:]
+
+            basis_verts_co = array('f', [0.0]) * (tot_verts * 3)
+            key_blocks[0].data.foreach_get("co", basis_verts_co)
+            kb_co = array('f', [0.0]) * (tot_verts * 3)
+
             for kb in key_blocks[1:]:
 
                 fw('\n\t\tShape: "%s" {' % kb.name)
                 fw('\n\t\t\tIndexes: ')
 
-                basis_verts = key_blocks[0].data
-                range_verts = []
-                delta_verts = []
-                i = -1
-                for j, kv in enumerate(kb.data):
-                    delta = kv.co - basis_verts[j].co
-                    if delta.length > 0.000001:
-                        if i == -1:
-                            fw('%d' % j)
-                        else:
-                            if i == 7:
-                                fw('\n\t\t\t')
-                                i = 0
-                            fw(',%d' % j)
-                        delta_verts.append(delta[:])
-                        i += 1
+                kb.data.foreach_get("co", kb_co)
+                deltas = [co - basis_co for co, basis_co in zip(kb_co, basis_verts_co)]
+                delta_indices = [j for j, (x, y, z) in enumerate(zip(deltas[0::3], deltas[1::3], deltas[2::3]))
+                                 if x * x + y * y + z * z > 0.000001 * 0.000001]
+                fbx_write_array(fw, delta_indices, '%d', 8, '\n\t\t\t')
 
                 fw('\n\t\t\tVertices: ')
-                i = -1
-                for dv in delta_verts:
-                    if i == -1:
-                        fw("%.6f,%.6f,%.6f" % dv)
-                    else:
-                        if i == 4:
-                            fw('\n\t\t\t')
-                            i = 0
-                        fw(",%.6f,%.6f,%.6f" % dv)
-                    i += 1
+                delta_verts = [d for j in delta_indices for d in deltas[j * 3:j * 3 + 3]]
+                fbx_write_array(fw, delta_verts, '%.6f,%.6f,%.6f', 5, '\n\t\t\t')
 
                 # all zero, why? - campbell
                 fw('\n\t\t\tNormals: ')
-                for j in range(len(delta_verts)):
-                    if i == -1:
-                        fw("0,0,0")
-                    else:
-                        if i == 4:
-                            fw('\n\t\t\t')
-                            i = 0
-                        fw(",0,0,0")
-                    i += 1
+                fbx_write_array(fw, [0] * len(delta_verts), '%i,%i,%i', 5, '\n\t\t\t')
                 fw('\n\t\t}')
 
         fw('\n\t}')
@@ -2645,6 +2591,77 @@ Connections:  {''')
         if use_default_take:
             tmp_actions.insert(0, None)  # None is the default action
 
+        # Samples of the animation of a take, {my_ob: (T, R, S)}, each channel being
+        # one array of values per axis (frames act_start to act_end).
+        # Takes evaluating the same actions over the same frames reuse the samples,
+        # only those of the last take and of the default take are kept (the default
+        # take until the take of the current action reuses them).
+        anim_samples_cache = {}
+        anim_samples_default = set()
+
+        def sample_anim(act_start, act_end, is_default):
+            key = (tuple([my_arm.blenObject.animation_data.action if my_arm.blenObject.animation_data else None for my_arm in ob_arms]),
+                   act_start, act_end)
+
+            for key_other in list(anim_samples_cache.keys()):
+                if key_other != key and key_other not in anim_samples_default:
+                    del anim_samples_cache[key_other]
+
+            anim_samples = anim_samples_cache.get(key)
+            if anim_samples is not None:
+                anim_samples_default.discard(key)
+                return anim_samples
+
+            if is_default:
+                anim_samples_default.add(key)
+
+            frames = range(act_start, act_end + 1)
+
+            # evaluate each frame once for all objects and bones
+            for frame in frames:
+                scene.frame_set(frame)
+                for ob_generic in ob_anim_lists:
+                    for my_ob in ob_generic:
+                        #Blender.Window.RedrawAll()
+                        if ob_generic == ob_meshes and my_ob.fbxArm:
+                            # We cant animate armature meshes!
+                            my_ob.setPoseFrame(frame, fake=True)
+                        else:
+                            my_ob.setPoseFrame(frame)
+
+            anim_samples = {}
+            for ob_generic in ob_anim_lists:
+                for my_ob in ob_generic:
+                    if ob_generic == ob_meshes and my_ob.fbxArm:
+                        continue
+
+                    channels = tuple([(array('d'), array('d'), array('d')) for TX_CHAN in 'TRS'])
+
+                    # we need to use the previous euler for compatible conversion.
+                    prev_eul = None
+                    for frame in frames:
+                        mtx, mtx_rot = my_ob.getAnimParRelMatrices(frame)
+
+                        if prev_eul:
+                            prev_eul = mtx_rot.to_euler('XYZ', prev_eul)
+                        else:
+                            prev_eul = mtx_rot.to_euler()
+
+                        for axis_values, vec in zip(channels, (mtx.to_translation(), tuple_rad_to_deg(prev_eul), mtx.to_scale())):
+                            axis_values[0].append(vec[0])
+                            axis_values[1].append(vec[1])
+                            axis_values[2].append(vec[2])
+
+                    anim_samples[my_ob] = channels
+
+            # the matrices are only needed for sampling
+            for ob_generic in ob_anim_lists:
+                for my_ob in ob_generic:
+                    my_ob.flushAnimData()
+
+            anim_samples_cache[key] = anim_samples
+            return anim_samples
+
         fw('''
 ;Takes and animation section
 ;----------------------------------------------------
@@ -2696,25 +2713,9 @@ Takes:  {''')
 		;Models animation
 		;----------------------------------------------------''')
 
-            # set pose data for all bones
+            # sample pose data for all objects and bones
             # do this here in case the action changes
-            '''
-            for my_bone in ob_bones:
-                my_bone.flushAnimData()
-            '''
-            i = act_start
-            while i <= act_end:
-                scene.frame_set(i)
-                for ob_generic in ob_anim_lists:
-                    for my_ob in ob_generic:
-                        #Blender.Window.RedrawAll()
-                        if ob_generic == ob_meshes and my_ob.fbxArm:
-                            # We cant animate armature meshes!
-                            my_ob.setPoseFrame(i, fake=True)
-                        else:
-                            my_ob.setPoseFrame(i)
-
-                i += 1
+            anim_samples = sample_anim(act_start, act_end, blenAction is None)
 
             #for bonename, bone, obname, me, armob in ob_bones:
             for ob_generic in (ob_bones, ob_meshes, ob_null, ob_cameras, ob_lights, ob_arms):
@@ -2730,36 +2731,20 @@ Takes:  {''')
                         fw('\n\t\t\tVersion: 1.1')
                         fw('\n\t\t\tChannel: "Transform" {')
 
-                        context_bone_anim_mats = [(my_ob.getAnimParRelMatrix(frame), my_ob.getAnimParRelMatrixRot(frame)) for frame in range(act_start, act_end + 1)]
-
                         # ----------------
                         # ----------------
                         for TX_LAYER, TX_CHAN in enumerate('TRS'):  # transform, rotate, scale
 
-                            if TX_CHAN == 'T':
-                                context_bone_anim_vecs = [mtx[0].to_translation() for mtx in context_bone_anim_mats]
-                            elif	TX_CHAN == 'S':
-                                context_bone_anim_vecs = [mtx[0].to_scale() for mtx in context_bone_anim_mats]
-                            elif	TX_CHAN == 'R':
-                                # Was....
-                                # elif 	TX_CHAN=='R':	context_bone_anim_vecs = [mtx[1].to_euler()			for mtx in context_bone_anim_mats]
-                                #
-                                # ...but we need to use the previous euler for compatible conversion.
-                                context_bone_anim_vecs = []
-                                prev_eul = None
-                                for mtx in context_bone_anim_mats:
-                                    if prev_eul:
-                                        prev_eul = mtx[1].to_euler('XYZ', prev_eul)
-                                    else:
-                                        prev_eul = mtx[1].to_euler()
-                                    context_bone_anim_vecs.append(tuple_rad_to_deg(prev_eul))
+                            context_bone_anim_axes = anim_samples[my_ob][TX_LAYER]
 
                             fw('\n\t\t\t\tChannel: "%s" {' % TX_CHAN)  # translation
 
                             for i in range(3):
+                                context_bone_anim_values = context_bone_anim_axes[i]
+
                                 # Loop on each axis of the bone
                                 fw('\n\t\t\t\t\tChannel: "%s" {' % ('XYZ'[i]))  # translation
-                                fw('\n\t\t\t\t\t\tDefault: %.15f' % context_bone_anim_vecs[0][i])
+                                fw('\n\t\t\t\t\t\tDefault: %.15f' % context_bone_anim_values[0])
                                 fw('\n\t\t\t\t\t\tKeyVer: 4005')
 
                                 if not use_anim_optimize:
@@ -2773,40 +2758,17 @@ Takes:  {''')
 
                                         # Curve types are 'C,n' for constant, 'L' for linear
                                         # C,n is for bezier? - linear is best for now so we can do simple keyframe removal
-                                        fw('\n\t\t\t\t\t\t\t%i,%.15f,L' % (fbx_time(frame - 1), context_bone_anim_vecs[frame - act_start][i]))
+                                        fw('\n\t\t\t\t\t\t\t%i,%.15f,L' % (fbx_time(frame - 1), context_bone_anim_values[frame - act_start]))
                                         frame += 1
                                 else:
                                     # remove unneeded keys, j is the frame, needed when some frames are removed.
-                                    context_bone_anim_keys = [(vec[i], j) for j, vec in enumerate(context_bone_anim_vecs)]
-
-                                    # last frame to fisrt frame, missing 1 frame on either side.
-                                    # removeing in a backwards loop is faster
-                                    #for j in xrange( (act_end-act_start)-1, 0, -1 ):
-                                    # j = (act_end-act_start)-1
-                                    j = len(context_bone_anim_keys) - 2
-                                    while j > 0 and len(context_bone_anim_keys) > 2:
-                                        # print j, len(context_bone_anim_keys)
-                                        # Is this key the same as the ones next to it?
-
-                                        # co-linear horizontal...
-                                        if		abs(context_bone_anim_keys[j][0] - context_bone_anim_keys[j - 1][0]) < ANIM_OPTIMIZE_PRECISSION_FLOAT and \
-                                                abs(context_bone_anim_keys[j][0] - context_bone_anim_keys[j + 1][0]) < ANIM_OPTIMIZE_PRECISSION_FLOAT:
-
-                                            del context_bone_anim_keys[j]
-
-                                        else:
-                                            frame_range = float(context_bone_anim_keys[j + 1][1] - context_bone_anim_keys[j - 1][1])
-                                            frame_range_fac1 = (context_bone_anim_keys[j + 1][1] - context_bone_anim_keys[j][1]) / frame_range
-                                            frame_range_fac2 = 1.0 - frame_range_fac1
-
-                                            if abs(((context_bone_anim_keys[j - 1][0] * frame_range_fac1 + context_bone_anim_keys[j + 1][0] * frame_range_fac2)) - context_bone_anim_keys[j][0]) < ANIM_OPTIMIZE_PRECISSION_FLOAT:
-                                                del context_bone_anim_keys[j]
-                                            else:
-                                                j -= 1
+                                    # plain linear reduction keeps the keys of earlier versions
+                                    if anim_optimize_method == 'LINEAR':
+                                        context_bone_anim_frames = reduce_linear(context_bone_anim_values, ANIM_OPTIMIZE_PRECISSION_FLOAT)
+                                    else:
+                                        context_bone_anim_frames = reduce_keys(context_bone_anim_values, ANIM_OPTIMIZE_PRECISSION_FLOAT, anim_optimize_method)
 
-                                        # keep the index below the list length
-                                        if j > len(context_bone_anim_keys) - 2:
-                                            j = len(context_bone_anim_keys) - 2
+                                    context_bone_anim_keys = [(context_bone_anim_values[j], j) for j in context_bone_anim_frames]
 
                                     if len(context_bone_anim_keys) == 2 and context_bone_anim_keys[0][0] == context_bone_anim_keys[1][0]:
 
@@ -2846,6 +2808,9 @@ Takes:  {''')
             # end the take
             fw('\n\t}')
 
+            # the cache decides which samples are still needed
+            del anim_samples
+
             # end action loop. set original actions
             # do this after every loop in case actions effect eachother.
             for my_arm in ob_arms:
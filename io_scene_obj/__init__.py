@@ -38,6 +38,10 @@ if "bpy" in locals():
         imp.reload(import_obj)
     if "export_obj" in locals():
         imp.reload(export_obj)
+    if "parse_obj" in locals():
+        imp.reload(parse_obj)
+    if "format_obj" in locals():
+        imp.reload(format_obj)
 
 
 import bpy
@@ -105,6 +109,12 @@ class ImportOBJ(bpy.types.Operator, ImportHelper):
             default=True,
             )
 
+    use_parallel = BoolProperty(
+            name="Parallel Parsing",
+            description="Parse big files using several processes",
+            default=False,
+            )
+
     split_mode = EnumProperty(
             name="Split",
             items=(('ON', "Split", "Split geometry, omits unused verts"),
@@ -197,6 +207,7 @@ class ImportOBJ(bpy.types.Operator, ImportHelper):
         layout.prop(self, "axis_up")
 
         layout.prop(self, "use_image_search")
+        layout.prop(self, "use_parallel")
 
 
 class ExportOBJ(bpy.types.Operator, ExportHelper):
@@ -291,6 +302,14 @@ class ExportOBJ(bpy.types.Operator, ExportHelper):
             default=False,
             )
 
+    use_bulk = BoolProperty(
+            name="Bulk Export",
+            description="Write objects in parallel using several processes, "
+                        "normals are only shared within an object "
+                        "(ignored with Polygroups)",
+            default=False,
+            )
+
     axis_forward = EnumProperty(
             name="Forward",
             items=(('X', "X Forward", ""),
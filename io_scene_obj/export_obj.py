@@ -165,6 +165,39 @@ def write_mtl(scene, filepath, path_mode, copy_set, mtl_dict):
     file.close()
 
 
+def mtl_data_get(key, material, image, mtl_dict, mtl_rev_dict):
+    """
+    Return the (mtl_name, material, image) of a (material name, image name)
+    key, adding it to mtl_dict the first time.
+    """
+    mat_data = mtl_dict.get(key)
+    if not mat_data:
+        # First add to global dict so we can export to mtl
+        # Then write mtl
+
+        # Make a new names from the mat and image name,
+        # converting any spaces to underscores with name_compat.
+
+        # If none image dont bother adding it to the name
+        # Try to avoid as much as possible adding texname (or other things)
+        # to the mtl name (see [#32102])...
+        mtl_name = "%s" % name_compat(key[0])
+        if mtl_rev_dict.get(mtl_name, None) not in {key, None}:
+            if key[1] is None:
+                tmp_ext = "_NONE"
+            else:
+                tmp_ext = "_%s" % name_compat(key[1])
+            i = 0
+            while mtl_rev_dict.get(mtl_name + tmp_ext, None) not in {key, None}:
+                i += 1
+                tmp_ext = "_%3d" % i
+            mtl_name += tmp_ext
+        mat_data = mtl_dict[key] = mtl_name, material, image
+        mtl_rev_dict[mtl_name] = key
+
+    return mat_data
+
+
 def test_nurbs_compat(ob):
     if ob.type != 'CURVE':
         return False
@@ -242,6 +275,65 @@ def write_nurb(fw, ob, ob_mat):
     return tot_verts
 
 
+def export_meshes(objects, scene, apply_modifiers, global_matrix, triangulate, curve_as_nurbs):
+    """
+    Iterate over the objects to export and their dupli children, yielding
+    (ob, ob_mat, me): me is the mesh of the object, already transformed by
+    global_matrix * ob_mat and removed once the caller is done with it, or
+    None for curves to write as NURBS, ob_mat then including global_matrix.
+    """
+    for ob_main in objects:
+
+        # ignore dupli children
+        if ob_main.parent and ob_main.parent.dupli_type in {'VERTS', 'FACES'}:
+            # XXX
+            print(ob_main.name, 'is a dupli child - ignoring')
+            continue
+
+        obs = []
+        if ob_main.dupli_type != 'NONE':
+            # XXX
+            print('creating dupli_list on', ob_main.name)
+            ob_main.dupli_list_create(scene)
+
+            obs = [(dob.object, dob.matrix) for dob in ob_main.dupli_list]
+
+            # XXX debug print
+            print(ob_main.name, 'has', len(obs), 'dupli children')
+        else:
+            obs = [(ob_main, ob_main.matrix_world)]
+
+        for ob, ob_mat in obs:
+
+            # Nurbs curve support
+            if curve_as_nurbs and test_nurbs_compat(ob):
+                yield ob, global_matrix * ob_mat, None
+                continue
+            # END NURBS
+
+            try:
+                me = ob.to_mesh(scene, apply_modifiers, 'PREVIEW', calc_tessface=False)
+            except RuntimeError:
+                me = None
+
+            if me is None:
+                continue
+
+            me.transform(global_matrix * ob_mat)
+
+            if triangulate:
+                # _must_ do this first since it re-allocs arrays
+                mesh_triangulate(me)
+
+            yield ob, ob_mat, me
+
+            # clean up
+            bpy.data.meshes.remove(me)
+
+        if ob_main.dupli_type != 'NONE':
+            ob_main.dupli_list_clear()
+
+
 def write_file(filepath, objects, scene,
                EXPORT_TRI=False,
                EXPORT_EDGES=False,
@@ -328,79 +420,379 @@ def write_file(filepath, objects, scene,
     copy_set = set()
 
     # Get all meshes
-    for ob_main in objects:
+    for ob, ob_mat, me in export_meshes(objects, scene, EXPORT_APPLY_MODIFIERS, EXPORT_GLOBAL_MATRIX,
+                                        EXPORT_TRI, EXPORT_CURVE_AS_NURBS):
 
-        # ignore dupli children
-        if ob_main.parent and ob_main.parent.dupli_type in {'VERTS', 'FACES'}:
-            # XXX
-            print(ob_main.name, 'is a dupli child - ignoring')
+        # Nurbs curve support
+        if me is None:
+            totverts += write_nurb(fw, ob, ob_mat)
             continue
 
-        obs = []
-        if ob_main.dupli_type != 'NONE':
-            # XXX
-            print('creating dupli_list on', ob_main.name)
-            ob_main.dupli_list_create(scene)
+        if EXPORT_UV:
+            faceuv = len(me.uv_textures) > 0
+            if faceuv:
+                uv_texture = me.uv_textures.active.data[:]
+                uv_layer = me.uv_layers.active.data[:]
+        else:
+            faceuv = False
 
-            obs = [(dob.object, dob.matrix) for dob in ob_main.dupli_list]
+        me_verts = me.vertices[:]
 
-            # XXX debug print
-            print(ob_main.name, 'has', len(obs), 'dupli children')
+        # Make our own list so it can be sorted to reduce context switching
+        face_index_pairs = [(face, index) for index, face in enumerate(me.polygons)]
+        # faces = [ f for f in me.tessfaces ]
+
+        if EXPORT_EDGES:
+            edges = me.edges
         else:
-            obs = [(ob_main, ob_main.matrix_world)]
+            edges = []
+
+        if not (len(face_index_pairs) + len(edges) + len(me.vertices)):  # Make sure there is somthing to write
+            continue  # dont bother with this mesh.
+
+        if EXPORT_NORMALS and face_index_pairs:
+            me.calc_normals()
+
+        materials = me.materials[:]
+        material_names = [m.name if m else None for m in materials]
+
+        # avoid bad index errors
+        if not materials:
+            materials = [None]
+            material_names = [name_compat(None)]
+
+        # Sort by Material, then images
+        # so we dont over context switch in the obj file.
+        if EXPORT_KEEP_VERT_ORDER:
+            pass
+        elif faceuv:
+            face_index_pairs.sort(key=lambda a: (a[0].material_index, hash(uv_texture[a[1]].image), a[0].use_smooth))
+        elif len(materials) > 1:
+            face_index_pairs.sort(key=lambda a: (a[0].material_index, a[0].use_smooth))
+        else:
+            # no materials
+            face_index_pairs.sort(key=lambda a: a[0].use_smooth)
+
+        # Set the default mat to no material and no image.
+        contextMat = 0, 0  # Can never be this, so we will label a new material the first chance we get.
+        contextSmooth = None  # Will either be true or false,  set bad to force initialization switch.
+
+        if EXPORT_BLEN_OBS or EXPORT_GROUP_BY_OB:
+            name1 = ob.name
+            name2 = ob.data.name
+            if name1 == name2:
+                obnamestring = name_compat(name1)
+            else:
+                obnamestring = '%s_%s' % (name_compat(name1), name_compat(name2))
 
-        for ob, ob_mat in obs:
+            if EXPORT_BLEN_OBS:
+                fw('o %s\n' % obnamestring)  # Write Object name
+            else:  # if EXPORT_GROUP_BY_OB:
+                fw('g %s\n' % obnamestring)
 
-            # Nurbs curve support
-            if EXPORT_CURVE_AS_NURBS and test_nurbs_compat(ob):
-                ob_mat = EXPORT_GLOBAL_MATRIX * ob_mat
-                totverts += write_nurb(fw, ob, ob_mat)
-                continue
-            # END NURBS
+        # Vert
+        for v in me_verts:
+            fw('v %.6f %.6f %.6f\n' % v.co[:])
 
-            try:
-                me = ob.to_mesh(scene, EXPORT_APPLY_MODIFIERS, 'PREVIEW', calc_tessface=False)
-            except RuntimeError:
-                me = None
+        # UV
+        if faceuv:
+            # in case removing some of these dont get defined.
+            uv = uvkey = uv_dict = f_index = uv_index = None
 
-            if me is None:
-                continue
+            uv_face_mapping = [None] * len(face_index_pairs)
 
-            me.transform(EXPORT_GLOBAL_MATRIX * ob_mat)
+            uv_dict = {}  # could use a set() here
+            for f, f_index in face_index_pairs:
+                uv_ls = uv_face_mapping[f_index] = []
+                for uv_index, l_index in enumerate(f.loop_indices):
+                    uv = uv_layer[l_index].uv
 
-            if EXPORT_TRI:
-                # _must_ do this first since it re-allocs arrays
-                mesh_triangulate(me)
+                    uvkey = veckey2d(uv)
+                    try:
+                        uv_k = uv_dict[uvkey]
+                    except:
+                        uv_k = uv_dict[uvkey] = len(uv_dict)
+                        fw('vt %.6f %.6f\n' % uv[:])
+                    uv_ls.append(uv_k)
 
-            if EXPORT_UV:
-                faceuv = len(me.uv_textures) > 0
-                if faceuv:
-                    uv_texture = me.uv_textures.active.data[:]
-                    uv_layer = me.uv_layers.active.data[:]
-            else:
-                faceuv = False
+            uv_unique_count = len(uv_dict)
+
+            del uv, uvkey, uv_dict, f_index, uv_index, uv_ls, uv_k
+            # Only need uv_unique_count and uv_face_mapping
+
+        # NORMAL, Smooth/Non smoothed.
+        if EXPORT_NORMALS:
+            for f, f_index in face_index_pairs:
+                if f.use_smooth:
+                    for v_idx in f.vertices:
+                        v = me_verts[v_idx]
+                        noKey = veckey3d(v.normal)
+                        if noKey not in globalNormals:
+                            globalNormals[noKey] = totno
+                            totno += 1
+                            fw('vn %.6f %.6f %.6f\n' % noKey)
+                else:
+                    # Hard, 1 normal from the face.
+                    noKey = veckey3d(f.normal)
+                    if noKey not in globalNormals:
+                        globalNormals[noKey] = totno
+                        totno += 1
+                        fw('vn %.6f %.6f %.6f\n' % noKey)
+
+        if not faceuv:
+            f_image = None
+
+        # XXX
+        if EXPORT_POLYGROUPS:
+            # Retrieve the list of vertex groups
+            vertGroupNames = ob.vertex_groups.keys()
+            if vertGroupNames:
+                currentVGroup = ''
+                # Create a dictionary keyed by face id and listing, for each vertex, the vertex groups it belongs to
+                vgroupsMap = [[] for _i in range(len(me_verts))]
+                for v_idx, v_ls in enumerate(vgroupsMap):
+                    v_ls[:] = [(vertGroupNames[g.group], g.weight) for g in me_verts[v_idx].groups]
+
+        for f, f_index in face_index_pairs:
+            f_smooth = f.use_smooth
+            f_mat = min(f.material_index, len(materials) - 1)
 
-            me_verts = me.vertices[:]
+            if faceuv:
+                tface = uv_texture[f_index]
+                f_image = tface.image
 
-            # Make our own list so it can be sorted to reduce context switching
-            face_index_pairs = [(face, index) for index, face in enumerate(me.polygons)]
-            # faces = [ f for f in me.tessfaces ]
+            # MAKE KEY
+            if faceuv and f_image:  # Object is always true.
+                key = material_names[f_mat], f_image.name
+            else:
+                key = material_names[f_mat], None  # No image, use None instead.
 
-            if EXPORT_EDGES:
-                edges = me.edges
+            # Write the vertex group
+            if EXPORT_POLYGROUPS:
+                if vertGroupNames:
+                    # find what vertext group the face belongs to
+                    vgroup_of_face = findVertexGroupName(f, vgroupsMap)
+                    if vgroup_of_face != currentVGroup:
+                        currentVGroup = vgroup_of_face
+                        fw('g %s\n' % vgroup_of_face)
+
+            # CHECK FOR CONTEXT SWITCH
+            if key == contextMat:
+                pass  # Context already switched, dont do anything
             else:
-                edges = []
+                if key[0] is None and key[1] is None:
+                    # Write a null material, since we know the context has changed.
+                    if EXPORT_GROUP_BY_MAT:
+                        # can be mat_image or (null)
+                        fw("g %s_%s\n" % (name_compat(ob.name), name_compat(ob.data.name)))  # can be mat_image or (null)
+                    if EXPORT_MTL:
+                        fw("usemtl (null)\n")  # mat, image
 
-            if not (len(face_index_pairs) + len(edges) + len(me.vertices)):  # Make sure there is somthing to write
+                else:
+                    mat_data = mtl_data_get(key, materials[f_mat], f_image, mtl_dict, mtl_rev_dict)
+
+                    if EXPORT_GROUP_BY_MAT:
+                        fw("g %s_%s_%s\n" % (name_compat(ob.name), name_compat(ob.data.name), mat_data[0]))  # can be mat_image or (null)
+                    if EXPORT_MTL:
+                        fw("usemtl %s\n" % mat_data[0])  # can be mat_image or (null)
+
+            contextMat = key
+            if f_smooth != contextSmooth:
+                if f_smooth:  # on now off
+                    fw('s 1\n')
+                    contextSmooth = f_smooth
+                else:  # was off now on
+                    fw('s off\n')
+                    contextSmooth = f_smooth
+
+            f_v = [(vi, me_verts[v_idx]) for vi, v_idx in enumerate(f.vertices)]
+
+            fw('f')
+            if faceuv:
+                if EXPORT_NORMALS:
+                    if f_smooth:  # Smoothed, use vertex normals
+                        for vi, v in f_v:
+                            fw(" %d/%d/%d" %
+                                       (v.index + totverts,
+                                        totuvco + uv_face_mapping[f_index][vi],
+                                        globalNormals[veckey3d(v.normal)],
+                                        ))  # vert, uv, normal
+
+                    else:  # No smoothing, face normals
+                        no = globalNormals[veckey3d(f.normal)]
+                        for vi, v in f_v:
+                            fw(" %d/%d/%d" %
+                                       (v.index + totverts,
+                                        totuvco + uv_face_mapping[f_index][vi],
+                                        no,
+                                        ))  # vert, uv, normal
+                else:  # No Normals
+                    for vi, v in f_v:
+                        fw(" %d/%d" % (
+                                   v.index + totverts,
+                                   totuvco + uv_face_mapping[f_index][vi],
+                                   ))  # vert, uv
+
+                face_vert_index += len(f_v)
+
+            else:  # No UV's
+                if EXPORT_NORMALS:
+                    if f_smooth:  # Smoothed, use vertex normals
+                        for vi, v in f_v:
+                            fw(" %d//%d" % (
+                                       v.index + totverts,
+                                       globalNormals[veckey3d(v.normal)],
+                                       ))
+                    else:  # No smoothing, face normals
+                        no = globalNormals[veckey3d(f.normal)]
+                        for vi, v in f_v:
+                            fw(" %d//%d" % (v.index + totverts, no))
+                else:  # No Normals
+                    for vi, v in f_v:
+                        fw(" %d" % (v.index + totverts))
 
-                # clean up
-                bpy.data.meshes.remove(me)
+            fw('\n')
 
+        # Write edges.
+        if EXPORT_EDGES:
+            for ed in edges:
+                if ed.is_loose:
+                    fw('f %d %d\n' % (ed.vertices[0] + totverts, ed.vertices[1] + totverts))
+
+        # Make the indices global rather then per mesh
+        totverts += len(me_verts)
+        if faceuv:
+            totuvco += uv_unique_count
+
+    file.close()
+
+    # Now we have all our materials, save them
+    if EXPORT_MTL:
+        write_mtl(scene, mtlfilepath, EXPORT_PATH_MODE, copy_set, mtl_dict)
+
+    # copy all collected files.
+    bpy_extras.io_utils.path_reference_copy(copy_set)
+
+    print("OBJ Export time: %.2f" % (time.time() - time1))
+
+
+def write_file_bulk(filepath, objects, scene,
+                    EXPORT_TRI=False,
+                    EXPORT_EDGES=False,
+                    EXPORT_NORMALS=False,
+                    EXPORT_UV=True,
+                    EXPORT_MTL=True,
+                    EXPORT_APPLY_MODIFIERS=True,
+                    EXPORT_BLEN_OBS=True,
+                    EXPORT_GROUP_BY_OB=False,
+                    EXPORT_GROUP_BY_MAT=False,
+                    EXPORT_KEEP_VERT_ORDER=False,
+                    EXPORT_CURVE_AS_NURBS=True,
+                    EXPORT_GLOBAL_MATRIX=None,
+                    EXPORT_PATH_MODE='AUTO',
+                    EXPORT_JOBS=None,
+                    ):
+    """
+    Same as write_file (without vertex groups), but the mesh data is read
+    with foreach_get, texture coordinates and normals are deduplicated with
+    one sort/unique pass per object, and the objects are formatted by a
+    pool of processes into temporary files (see format_obj).
+
+    Normals are only deduplicated per object.
+    """
+    import io
+    import itertools
+    import multiprocessing
+    from array import array
+    from . import format_obj
+
+    if EXPORT_GLOBAL_MATRIX is None:
+        EXPORT_GLOBAL_MATRIX = mathutils.Matrix()
+
+    if EXPORT_JOBS is None:
+        EXPORT_JOBS = multiprocessing.cpu_count()
+
+    print('OBJ Export path: %r' % filepath)
+
+    time1 = time.time()
+
+    file = open(filepath, "w", encoding="utf8", newline="\n")
+    fw = file.write
+
+    # Write Header
+    fw('# Blender v%s OBJ File: %r\n' % (bpy.app.version_string, os.path.basename(bpy.data.filepath)))
+    fw('# www.blender.org\n')
+
+    # Tell the obj file what material file to use.
+    if EXPORT_MTL:
+        mtlfilepath = os.path.splitext(filepath)[0] + ".mtl"
+        fw('mtllib %s\n' % repr(os.path.basename(mtlfilepath))[1:-1])  # filepath can contain non utf8 chars, use repr
+
+    # Initialize totals, these are updated each object
+    totverts = totuvco = totno = 1
+
+    mtl_dict = {}
+    mtl_rev_dict = {}
+
+    copy_set = set()
+
+    # segments waiting to be formatted, written a batch at a time
+    segments = []
+    writer = format_obj.SegmentWriter(filepath, EXPORT_JOBS)
+
+    def flush_segments():
+        format_obj.append_segments(file, writer.write(segments))
+        segments[:] = []
+
+    try:
+        for ob, ob_mat, me in export_meshes(objects, scene, EXPORT_APPLY_MODIFIERS, EXPORT_GLOBAL_MATRIX,
+                                            EXPORT_TRI, EXPORT_CURVE_AS_NURBS):
+            segment = format_obj.ObjSegment()
+            segment.offsets = totverts, totuvco, totno
+
+            # Nurbs curve support
+            if me is None:
+                nurb = io.StringIO()
+                totverts += write_nurb(nurb.write, ob, ob_mat)
+                segment.header = nurb.getvalue()
+                segments.append(segment)
+                continue
+
+            tot_verts = len(me.vertices)
+            tot_polys = len(me.polygons)
+            tot_loops = len(me.loops)
+
+            if EXPORT_EDGES:
+                edges = array('i', bytes(len(me.edges) * 2 * 4))
+                me.edges.foreach_get("vertices", edges)
+                edges_loose = [False] * len(me.edges)
+                me.edges.foreach_get("is_loose", edges_loose)
+                segment.edges = array('i', itertools.chain.from_iterable(
+                    itertools.compress(zip(edges[0::2], edges[1::2]), edges_loose)))
+                del edges, edges_loose
+
+            if not (tot_polys + len(segment.edges) + tot_verts):  # Make sure there is somthing to write
                 continue  # dont bother with this mesh.
 
-            if EXPORT_NORMALS and face_index_pairs:
+            faceuv = EXPORT_UV and len(me.uv_textures) > 0
+
+            if EXPORT_NORMALS and tot_polys:
                 me.calc_normals()
 
+            segment.verts_co = array('f', bytes(tot_verts * 3 * 4))
+            me.vertices.foreach_get("co", segment.verts_co)
+
+            loop_starts = array('i', bytes(tot_polys * 4))
+            loop_totals = array('i', bytes(tot_polys * 4))
+            face_mats = array('i', bytes(tot_polys * 4))
+            face_smooth = [False] * tot_polys
+            loop_verts = array('i', bytes(tot_loops * 4))
+            me.polygons.foreach_get("loop_start", loop_starts)
+            me.polygons.foreach_get("loop_total", loop_totals)
+            me.polygons.foreach_get("material_index", face_mats)
+            me.polygons.foreach_get("use_smooth", face_smooth)
+            me.loops.foreach_get("vertex_index", loop_verts)
+
             materials = me.materials[:]
             material_names = [m.name if m else None for m in materials]
 
@@ -409,21 +801,66 @@ def write_file(filepath, objects, scene,
                 materials = [None]
                 material_names = [name_compat(None)]
 
+            face_mats = [min(mat, len(materials) - 1) for mat in face_mats]
+
+            if faceuv:
+                face_images = [tface.image for tface in me.uv_textures.active.data]
+            else:
+                face_images = [None] * tot_polys
+            face_image_names = [image.name if image else None for image in face_images]
+
             # Sort by Material, then images
             # so we dont over context switch in the obj file.
             if EXPORT_KEEP_VERT_ORDER:
-                pass
-            elif faceuv:
-                face_index_pairs.sort(key=lambda a: (a[0].material_index, hash(uv_texture[a[1]].image), a[0].use_smooth))
-            elif len(materials) > 1:
-                face_index_pairs.sort(key=lambda a: (a[0].material_index, a[0].use_smooth))
+                face_order = range(tot_polys)
             else:
-                # no materials
-                face_index_pairs.sort(key=lambda a: a[0].use_smooth)
+                face_keys = list(zip(face_mats, [name or '' for name in face_image_names], face_smooth))
+                face_order = sorted(range(tot_polys), key=face_keys.__getitem__)
+                del face_keys
 
-            # Set the default mat to no material and no image.
-            contextMat = 0, 0  # Can never be this, so we will label a new material the first chance we get.
-            contextSmooth = None  # Will either be true or false,  set bad to force initialization switch.
+            # Loops of the faces in file order.
+            loop_order = list(itertools.chain.from_iterable(
+                map(range,
+                    map(loop_starts.__getitem__, face_order),
+                    [loop_starts[f] + loop_totals[f] for f in face_order])))
+
+            segment.face_totals = array('i', map(loop_totals.__getitem__, face_order))
+            segment.loop_verts = array('i', map(loop_verts.__getitem__, loop_order))
+
+            # UV
+            if faceuv:
+                uvs = array('f', bytes(tot_loops * 2 * 4))
+                me.uv_layers.active.data.foreach_get("uv", uvs)
+                uv_unique, segment.loop_uvs = format_obj.unique_lines(
+                    format_obj.format_floats('%.6f %.6f\n', uvs, 2), loop_order)
+                segment.vt_text = ('vt %s\n' * len(uv_unique)) % tuple(uv_unique)
+                totuvco += len(uv_unique)
+                del uvs, uv_unique
+
+            # NORMAL, Smooth/Non smoothed.
+            if EXPORT_NORMALS:
+                normals = array('f', bytes(tot_verts * 3 * 4))
+                me.vertices.foreach_get("normal", normals)
+                vert_normals = format_obj.format_floats('%.6f %.6f %.6f\n', normals, 3).splitlines()
+
+                normals = array('f', bytes(tot_polys * 3 * 4))
+                me.polygons.foreach_get("normal", normals)
+                face_normals = format_obj.format_floats('%.6f %.6f %.6f\n', normals, 3).splitlines()
+                del normals
+
+                loop_normals = []
+                for f in face_order:
+                    if face_smooth[f]:
+                        start = loop_starts[f]
+                        loop_normals.extend(map(vert_normals.__getitem__, loop_verts[start:start + loop_totals[f]]))
+                    else:
+                        # Hard, 1 normal from the face.
+                        loop_normals.extend([face_normals[f]] * loop_totals[f])
+
+                normal_unique, segment.loop_normals = format_obj.unique_lines('\n'.join(loop_normals))
+                segment.vn_text = ('vn %s\n' * len(normal_unique)) % tuple(normal_unique)
+                totno += len(normal_unique)
+                del vert_normals, face_normals, loop_normals, normal_unique
 
             if EXPORT_BLEN_OBS or EXPORT_GROUP_BY_OB:
                 name1 = ob.name
@@ -434,212 +871,57 @@ def write_file(filepath, objects, scene,
                     obnamestring = '%s_%s' % (name_compat(name1), name_compat(name2))
 
                 if EXPORT_BLEN_OBS:
-                    fw('o %s\n' % obnamestring)  # Write Object name
+                    segment.header = 'o %s\n' % obnamestring  # Write Object name
                 else:  # if EXPORT_GROUP_BY_OB:
-                    fw('g %s\n' % obnamestring)
-
-            # Vert
-            for v in me_verts:
-                fw('v %.6f %.6f %.6f\n' % v.co[:])
-
-            # UV
-            if faceuv:
-                # in case removing some of these dont get defined.
-                uv = uvkey = uv_dict = f_index = uv_index = None
-
-                uv_face_mapping = [None] * len(face_index_pairs)
-
-                uv_dict = {}  # could use a set() here
-                for f, f_index in face_index_pairs:
-                    uv_ls = uv_face_mapping[f_index] = []
-                    for uv_index, l_index in enumerate(f.loop_indices):
-                        uv = uv_layer[l_index].uv
-
-                        uvkey = veckey2d(uv)
-                        try:
-                            uv_k = uv_dict[uvkey]
-                        except:
-                            uv_k = uv_dict[uvkey] = len(uv_dict)
-                            fw('vt %.6f %.6f\n' % uv[:])
-                        uv_ls.append(uv_k)
-
-                uv_unique_count = len(uv_dict)
-
-                del uv, uvkey, uv_dict, f_index, uv_index, uv_ls, uv_k
-                # Only need uv_unique_count and uv_face_mapping
-
-            # NORMAL, Smooth/Non smoothed.
-            if EXPORT_NORMALS:
-                for f, f_index in face_index_pairs:
-                    if f.use_smooth:
-                        for v_idx in f.vertices:
-                            v = me_verts[v_idx]
-                            noKey = veckey3d(v.normal)
-                            if noKey not in globalNormals:
-                                globalNormals[noKey] = totno
-                                totno += 1
-                                fw('vn %.6f %.6f %.6f\n' % noKey)
-                    else:
-                        # Hard, 1 normal from the face.
-                        noKey = veckey3d(f.normal)
-                        if noKey not in globalNormals:
-                            globalNormals[noKey] = totno
-                            totno += 1
-                            fw('vn %.6f %.6f %.6f\n' % noKey)
-
-            if not faceuv:
-                f_image = None
+                    segment.header = 'g %s\n' % obnamestring
 
-            # XXX
-            if EXPORT_POLYGROUPS:
-                # Retrieve the list of vertex groups
-                vertGroupNames = ob.vertex_groups.keys()
-                if vertGroupNames:
-                    currentVGroup = ''
-                    # Create a dictionary keyed by face id and listing, for each vertex, the vertex groups it belongs to
-                    vgroupsMap = [[] for _i in range(len(me_verts))]
-                    for v_idx, v_ls in enumerate(vgroupsMap):
-                        v_ls[:] = [(vertGroupNames[g.group], g.weight) for g in me_verts[v_idx].groups]
+            # Material and smooth switches, only where they change.
+            contextMat = 0, 0  # Can never be this, so we will label a new material the first chance we get.
+            contextSmooth = None  # Will either be true or false,  set bad to force initialization switch.
 
-            for f, f_index in face_index_pairs:
-                f_smooth = f.use_smooth
-                f_mat = min(f.material_index, len(materials) - 1)
+            for i, f in enumerate(face_order):
+                f_smooth = face_smooth[f]
+                f_mat = face_mats[f]
+                key = material_names[f_mat], face_image_names[f]
 
-                if faceuv:
-                    tface = uv_texture[f_index]
-                    f_image = tface.image
+                if key == contextMat and f_smooth == contextSmooth:
+                    continue
 
-                # MAKE KEY
-                if faceuv and f_image:  # Object is always true.
-                    key = material_names[f_mat], f_image.name
-                else:
-                    key = material_names[f_mat], None  # No image, use None instead.
-
-                # Write the vertex group
-                if EXPORT_POLYGROUPS:
-                    if vertGroupNames:
-                        # find what vertext group the face belongs to
-                        vgroup_of_face = findVertexGroupName(f, vgroupsMap)
-                        if vgroup_of_face != currentVGroup:
-                            currentVGroup = vgroup_of_face
-                            fw('g %s\n' % vgroup_of_face)
-
-                # CHECK FOR CONTEXT SWITCH
-                if key == contextMat:
-                    pass  # Context already switched, dont do anything
-                else:
+                header = []
+                if key != contextMat:
                     if key[0] is None and key[1] is None:
                         # Write a null material, since we know the context has changed.
                         if EXPORT_GROUP_BY_MAT:
                             # can be mat_image or (null)
-                            fw("g %s_%s\n" % (name_compat(ob.name), name_compat(ob.data.name)))  # can be mat_image or (null)
+                            header.append("g %s_%s\n" % (name_compat(ob.name), name_compat(ob.data.name)))
                         if EXPORT_MTL:
-                            fw("usemtl (null)\n")  # mat, image
-
+                            header.append("usemtl (null)\n")  # mat, image
                     else:
-                        mat_data = mtl_dict.get(key)
-                        if not mat_data:
-                            # First add to global dict so we can export to mtl
-                            # Then write mtl
-
-                            # Make a new names from the mat and image name,
-                            # converting any spaces to underscores with name_compat.
-
-                            # If none image dont bother adding it to the name
-                            # Try to avoid as much as possible adding texname (or other things)
-                            # to the mtl name (see [#32102])...
-                            mtl_name = "%s" % name_compat(key[0])
-                            if mtl_rev_dict.get(mtl_name, None) not in {key, None}:
-                                if key[1] is None:
-                                    tmp_ext = "_NONE"
-                                else:
-                                    tmp_ext = "_%s" % name_compat(key[1])
-                                i = 0
-                                while mtl_rev_dict.get(mtl_name + tmp_ext, None) not in {key, None}:
-                                    i += 1
-                                    tmp_ext = "_%3d" % i
-                                mtl_name += tmp_ext
-                            mat_data = mtl_dict[key] = mtl_name, materials[f_mat], f_image
-                            mtl_rev_dict[mtl_name] = key
+                        mat_data = mtl_data_get(key, materials[f_mat], face_images[f], mtl_dict, mtl_rev_dict)
 
                         if EXPORT_GROUP_BY_MAT:
-                            fw("g %s_%s_%s\n" % (name_compat(ob.name), name_compat(ob.data.name), mat_data[0]))  # can be mat_image or (null)
+                            header.append("g %s_%s_%s\n" % (name_compat(ob.name), name_compat(ob.data.name), mat_data[0]))
                         if EXPORT_MTL:
-                            fw("usemtl %s\n" % mat_data[0])  # can be mat_image or (null)
+                            header.append("usemtl %s\n" % mat_data[0])
 
-                contextMat = key
-                if f_smooth != contextSmooth:
-                    if f_smooth:  # on now off
-                        fw('s 1\n')
-                        contextSmooth = f_smooth
-                    else:  # was off now on
-                        fw('s off\n')
-                        contextSmooth = f_smooth
-
-                f_v = [(vi, me_verts[v_idx]) for vi, v_idx in enumerate(f.vertices)]
-
-                fw('f')
-                if faceuv:
-                    if EXPORT_NORMALS:
-                        if f_smooth:  # Smoothed, use vertex normals
-                            for vi, v in f_v:
-                                fw(" %d/%d/%d" %
-                                           (v.index + totverts,
-                                            totuvco + uv_face_mapping[f_index][vi],
-                                            globalNormals[veckey3d(v.normal)],
-                                            ))  # vert, uv, normal
-
-                        else:  # No smoothing, face normals
-                            no = globalNormals[veckey3d(f.normal)]
-                            for vi, v in f_v:
-                                fw(" %d/%d/%d" %
-                                           (v.index + totverts,
-                                            totuvco + uv_face_mapping[f_index][vi],
-                                            no,
-                                            ))  # vert, uv, normal
-                    else:  # No Normals
-                        for vi, v in f_v:
-                            fw(" %d/%d" % (
-                                       v.index + totverts,
-                                       totuvco + uv_face_mapping[f_index][vi],
-                                       ))  # vert, uv
-
-                    face_vert_index += len(f_v)
-
-                else:  # No UV's
-                    if EXPORT_NORMALS:
-                        if f_smooth:  # Smoothed, use vertex normals
-                            for vi, v in f_v:
-                                fw(" %d//%d" % (
-                                           v.index + totverts,
-                                           globalNormals[veckey3d(v.normal)],
-                                           ))
-                        else:  # No smoothing, face normals
-                            no = globalNormals[veckey3d(f.normal)]
-                            for vi, v in f_v:
-                                fw(" %d//%d" % (v.index + totverts, no))
-                    else:  # No Normals
-                        for vi, v in f_v:
-                            fw(" %d" % (v.index + totverts))
+                    contextMat = key
 
-                fw('\n')
+                if f_smooth != contextSmooth:
+                    header.append('s 1\n' if f_smooth else 's off\n')
+                    contextSmooth = f_smooth
 
-            # Write edges.
-            if EXPORT_EDGES:
-                for ed in edges:
-                    if ed.is_loose:
-                        fw('f %d %d\n' % (ed.vertices[0] + totverts, ed.vertices[1] + totverts))
+                segment.runs.append((i, ''.join(header)))
 
             # Make the indices global rather then per mesh
-            totverts += len(me_verts)
-            if faceuv:
-                totuvco += uv_unique_count
+            totverts += tot_verts
 
-            # clean up
-            bpy.data.meshes.remove(me)
+            segments.append(segment)
+            if len(segments) >= EXPORT_JOBS * 2:
+                flush_segments()
 
-        if ob_main.dupli_type != 'NONE':
-            ob_main.dupli_list_clear()
+        flush_segments()
+    finally:
+        writer.close()
 
     file.close()
 
@@ -670,6 +952,7 @@ def _write(context, filepath,
               EXPORT_ANIMATION,
               EXPORT_GLOBAL_MATRIX,
               EXPORT_PATH_MODE,
+              EXPORT_BULK=False,
               ):  # Not used
 
     base_name, ext = os.path.splitext(filepath)
@@ -704,6 +987,24 @@ def _write(context, filepath,
 
         # erm... bit of a problem here, this can overwrite files when exporting frames. not too bad.
         # EXPORT THE FILE.
+        if EXPORT_BULK and not EXPORT_POLYGROUPS:
+            write_file_bulk(full_path, objects, scene,
+                            EXPORT_TRI,
+                            EXPORT_EDGES,
+                            EXPORT_NORMALS,
+                            EXPORT_UV,
+                            EXPORT_MTL,
+                            EXPORT_APPLY_MODIFIERS,
+                            EXPORT_BLEN_OBS,
+                            EXPORT_GROUP_BY_OB,
+                            EXPORT_GROUP_BY_MAT,
+                            EXPORT_KEEP_VERT_ORDER,
+                            EXPORT_CURVE_AS_NURBS,
+                            EXPORT_GLOBAL_MATRIX,
+                            EXPORT_PATH_MODE,
+                            )
+            continue
+
         write_file(full_path, objects, scene,
                    EXPORT_TRI,
                    EXPORT_EDGES,
@@ -751,7 +1052,8 @@ def save(operator, context, filepath="",
          use_selection=True,
          use_animation=False,
          global_matrix=None,
-         path_mode='AUTO'
+         path_mode='AUTO',
+         use_bulk=False,
          ):
 
     _write(context, filepath,
@@ -771,6 +1073,7 @@ def save(operator, context, filepath="",
            EXPORT_ANIMATION=use_animation,
            EXPORT_GLOBAL_MATRIX=global_matrix,
            EXPORT_PATH_MODE=path_mode,
+           EXPORT_BULK=use_bulk,
            )
 
     return {'FINISHED'}
@@ -0,0 +1,258 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Bulk formatting of the geometry of OBJ files.
+
+The exporter gathers the arrays of each object (see export_obj.write_file
+with EXPORT_BULK) into an ObjSegment, knowing the index offsets of the
+previous objects. Segments are then written to temporary files by a pool of
+processes (see SegmentWriter), and concatenated in order.
+
+This module doesn't use bpy so it can be imported by the workers.
+"""
+
+import os
+from array import array
+
+# number of elements formatted per string operation
+FORMAT_CHUNK = 65536
+
+
+class ObjSegment(object):
+    """
+    Everything needed to write one object.
+
+    header
+        Text written first (o/g lines).
+
+    verts_co
+        array('f') of 3 floats per vertex.
+
+    vt_text, vn_text
+        The unique texture coordinates and normals, already formatted
+        as 'vt'/'vn' lines.
+
+    face_totals
+        array('i') of the number of loops of each face, in file order.
+
+    loop_verts, loop_uvs, loop_normals
+        array('i') of the object local indices of each loop, in file order,
+        loop_uvs and loop_normals being None when not exported.
+
+    runs
+        List of (first_face, header), header being the text (usemtl, s...)
+        written before the faces starting at first_face.
+
+    edges
+        array('i') of 2 vertex indices per loose edge.
+
+    offsets
+        (vert, uv, normal) 1 based index of the first element of the
+        object in the file.
+    """
+    __slots__ = ("header",
+                 "verts_co",
+                 "vt_text",
+                 "vn_text",
+                 "face_totals",
+                 "loop_verts",
+                 "loop_uvs",
+                 "loop_normals",
+                 "runs",
+                 "edges",
+                 "offsets",
+                 )
+
+    def __init__(self):
+        self.header = ''
+        self.verts_co = array('f')
+        self.vt_text = ''
+        self.vn_text = ''
+        self.face_totals = array('i')
+        self.loop_verts = array('i')
+        self.loop_uvs = None
+        self.loop_normals = None
+        self.runs = []
+        self.edges = array('i')
+        self.offsets = 1, 1, 1
+
+
+def unique_lines(text, order=None):
+    """
+    Deduplicate the lines of *text*, in the order given by the *order*
+    indices when set.
+
+    Returns (unique, indices), unique being the sorted unique lines and
+    indices an array('i') of the index in unique of each line.
+    """
+    lines = text.splitlines()
+    if order is not None:
+        lines = list(map(lines.__getitem__, order))
+
+    unique = sorted(set(lines))
+    index = dict(zip(unique, range(len(unique))))
+
+    return unique, array('i', map(index.__getitem__, lines))
+
+
+def format_floats(fmt, values, stride):
+    """
+    Format a flat array of floats, *stride* values per *fmt* line.
+    """
+    chunk = FORMAT_CHUNK * stride
+    return ''.join([(fmt * (len(values[i:i + chunk]) // stride)) % tuple(values[i:i + chunk])
+                    for i in range(0, len(values), chunk)])
+
+
+def write_segment(filepath, segment):
+    """
+    Write an ObjSegment to *filepath*, a whole chunk of lines at a time.
+    """
+    vert_offset, uv_offset, normal_offset = segment.offsets
+
+    # Per loop index columns, already offset to the file indices.
+    columns = [array('i', map(vert_offset.__add__, segment.loop_verts))]
+    if segment.loop_uvs is not None:
+        columns.append(array('i', map(uv_offset.__add__, segment.loop_uvs)))
+    if segment.loop_normals is not None:
+        columns.append(array('i', map(normal_offset.__add__, segment.loop_normals)))
+
+    if len(columns) == 1:
+        loop_fmt = ' %d'
+    elif segment.loop_uvs is None:
+        loop_fmt = ' %d//%d'
+    elif segment.loop_normals is None:
+        loop_fmt = ' %d/%d'
+    else:
+        loop_fmt = ' %d/%d/%d'
+
+    stride = len(columns)
+    values = array('i', bytes(len(segment.loop_verts) * stride * 4))
+    for i, column in enumerate(columns):
+        values[i::stride] = column
+    del columns
+
+    face_fmts = {}
+
+    def face_fmt(total):
+        try:
+            return face_fmts[total]
+        except KeyError:
+            fmt = face_fmts[total] = 'f' + loop_fmt * total + '\n'
+            return fmt
+
+    face_totals = segment.face_totals
+    runs = segment.runs + [(len(face_totals), '')]
+
+    with open(filepath, "w", encoding="utf8", newline="\n") as file:
+        fw = file.write
+
+        fw(segment.header)
+        fw(format_floats('v %.6f %.6f %.6f\n', segment.verts_co, 3))
+        fw(segment.vt_text)
+        fw(segment.vn_text)
+
+        loop = 0
+        for (first, header), (end, _) in zip(runs[:-1], runs[1:]):
+            fw(header)
+            for start in range(first, end, FORMAT_CHUNK):
+                totals = face_totals[start:min(end, start + FORMAT_CHUNK)]
+                loop_end = loop + sum(totals)
+                fw(''.join(map(face_fmt, totals)) % tuple(values[loop * stride:loop_end * stride]))
+                loop = loop_end
+
+        edges = array('i', map(vert_offset.__add__, segment.edges))
+        for i in range(0, len(edges), FORMAT_CHUNK * 2):
+            chunk = edges[i:i + FORMAT_CHUNK * 2]
+            fw(('f %d %d\n' * (len(chunk) // 2)) % tuple(chunk))
+
+
+class SegmentWriter(object):
+    """
+    Write batches of segments to temporary files next to *filepath*, with
+    one pool of *jobs* processes for the whole export.
+
+    Segments are written by this process when there is no process pool,
+    see parse_obj.process_pool.
+    """
+    __slots__ = ("filepath",
+                 "jobs",
+                 "pool",
+                 "written",
+                 )
+
+    def __init__(self, filepath, jobs=None):
+        import multiprocessing
+
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+
+        self.filepath = filepath
+        self.jobs = jobs
+        self.pool = None
+        self.written = 0
+
+    def write(self, segments):
+        """
+        Write the segments and return the paths of their files, in order.
+        """
+        paths = ["%s.%d.tmp" % (self.filepath, self.written + i) for i in range(len(segments))]
+        self.written += len(segments)
+
+        if self.jobs > 1 and len(segments) > 1:
+            try:
+                if self.pool is None:
+                    from .parse_obj import process_pool
+                    self.pool = process_pool(self.jobs)
+
+                if self.pool is not None:
+                    list(self.pool.map(write_segment, paths, segments))
+                    return paths
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+                self.close()
+
+            # no process pool on this platform, write sequentially
+            self.jobs = 1
+
+        for path, segment in zip(paths, segments):
+            write_segment(path, segment)
+
+        return paths
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def append_segments(file, paths):
+    """
+    Append the temporary segment files to an opened file and remove them.
+    """
+    import shutil
+
+    for path in paths:
+        with open(path, "r", encoding="utf8", newline="\n") as segment:
+            shutil.copyfileobj(segment, file, 1 << 20)
+        os.remove(path)
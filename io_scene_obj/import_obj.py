@@ -33,29 +33,13 @@ http://wiki.blender.org/index.php/Scripts/Manual/Import/wavefront_obj
 
 import os
 import time
+from array import array
 import bpy
 import mathutils
-from bpy_extras.io_utils import unpack_list, unpack_face_list
+from bpy_extras.io_utils import unpack_list
 from bpy_extras.image_utils import load_image
 
-
-def mesh_untessellate(me, fgon_edges):
-    import bmesh
-    bm = bmesh.new()
-    bm.from_mesh(me)
-    verts = bm.verts[:]
-    get = bm.edges.get
-    edges = [get((verts[key[0]], verts[key[1]])) for key in fgon_edges]
-    try:
-        bmesh.ops.dissolve_edges(bm, edges=edges, use_verts=False)
-    except:
-        # Possible dissolve fails for some edges
-        # but dont fail silently unless this is a real bug.
-        import traceback
-        traceback.print_exc()
-
-    bm.to_mesh(me)
-    bm.free()
+from .parse_obj import ObjFaces
 
 
 def line_value(line_split):
@@ -383,17 +367,17 @@ def create_materials(filepath, relpath,
             mtl.close()
 
 
-def split_mesh(verts_loc, faces, unique_materials, filepath, SPLIT_OB_OR_GROUP):
+def split_mesh(verts_loc, faces, lines, unique_materials, filepath, SPLIT_OB_OR_GROUP):
     """
-    Takes vert_loc and faces, and separates into multiple sets of
-    (verts_loc, faces, unique_materials, dataname)
+    Takes vert_loc, faces and lines, and separates into multiple sets of
+    (verts_loc, faces, lines, unique_materials, dataname)
     """
 
     filename = os.path.splitext((os.path.basename(filepath)))[0]
 
     if not SPLIT_OB_OR_GROUP:
         # use the filename for the object name since we arnt chopping up the mesh.
-        return [(verts_loc, faces, unique_materials, filename)]
+        return [(verts_loc, faces, lines, unique_materials, filename)]
 
     def key_to_name(key):
         # if the key is a tuple, join it to make a string
@@ -402,57 +386,55 @@ def split_mesh(verts_loc, faces, unique_materials, filepath, SPLIT_OB_OR_GROUP):
         else:
             return key
 
-    # Return a key that makes the faces unique.
+    # Group the spans of faces and lines by object, the spans already
+    # share the same object so there is no per face lookup.
     face_split_dict = {}
 
-    oldkey = -1  # initialize to a value that will never match the key
-
-    for face in faces:
-        key = face[4]
-
-        if oldkey != key:
-            # Check the key has changed.
+    for spans_index, obj_faces in enumerate((faces, lines)):
+        for span in obj_faces.iter_spans():
+            key = span[2][2]
             try:
-                verts_split, faces_split, unique_materials_split, vert_remap = face_split_dict[key]
+                spans_split = face_split_dict[key]
             except KeyError:
-                faces_split = []
-                verts_split = []
-                unique_materials_split = {}
-                vert_remap = {}
+                spans_split = face_split_dict[key] = ([], [])
+            spans_split[spans_index].append(span)
 
-                face_split_dict[key] = (verts_split, faces_split, unique_materials_split, vert_remap)
+    verts_axis = verts_loc[0::3], verts_loc[1::3], verts_loc[2::3]
 
-            oldkey = key
+    split = []
+    for key, (face_spans, line_spans) in face_split_dict.items():
+        faces_split = faces.subset(face_spans)
+        lines_split = lines.subset(line_spans)
 
-        face_vert_loc_indices = face[0]
+        # Only keep the used verts, in file order, and remap the loops
+        # to the new vert list.
+        verts_used = sorted(set(faces_split.loop_verts) | set(lines_split.loop_verts))
+        vert_remap = dict(zip(verts_used, range(len(verts_used))))
 
-        # Remap verts to new vert list and add where needed
-        for enum, i in enumerate(face_vert_loc_indices):
-            map_index = vert_remap.get(i)
-            if map_index is None:
-                map_index = len(verts_split)
-                vert_remap[i] = map_index  # set the new remapped index so we only add once and can reference next time.
-                verts_split.append(verts_loc[i])  # add the vert to the local verts
+        faces_split.loop_verts = array('i', map(vert_remap.__getitem__, faces_split.loop_verts))
+        lines_split.loop_verts = array('i', map(vert_remap.__getitem__, lines_split.loop_verts))
 
-            face_vert_loc_indices[enum] = map_index  # remap to the local index
+        verts_split = array('d', bytes(len(verts_used) * 3 * 8))
+        for axis, verts in enumerate(verts_axis):
+            verts_split[axis::3] = array('d', map(verts.__getitem__, verts_used))
 
-            matname = face[2]
-            if matname and matname not in unique_materials_split:
+        unique_materials_split = {}
+        for first, end, (matname, context_smooth_group, context_object) in face_spans:
+            if matname:
                 unique_materials_split[matname] = unique_materials[matname]
 
-        faces_split.append(face)
+        split.append((verts_split, faces_split, lines_split, unique_materials_split, key_to_name(key)))
 
-    # remove one of the itemas and reorder
-    return [(value[0], value[1], value[2], key_to_name(key)) for key, value in list(face_split_dict.items())]
+    return split
 
 
 def create_mesh(new_objects,
-                has_ngons,
                 use_ngons,
                 use_edges,
                 verts_loc,
                 verts_tex,
                 faces,
+                lines,
                 unique_materials,
                 unique_material_images,
                 unique_smooth_groups,
@@ -462,58 +444,69 @@ def create_mesh(new_objects,
     """
     Takes all the data gathered and generates a mesh, adding the new object to new_objects
     deals with ngons, sharp edges and assigning materials
+
+    verts_loc and verts_tex are flat arrays, faces and lines are ObjFaces,
+    the mesh loops and polygons are filled with one foreach_set each.
     """
     from bpy_extras.mesh_utils import ngon_tessellate
 
-    if not has_ngons:
-        use_ngons = False
-
-    if unique_smooth_groups:
-        sharp_edges = {}
-        smooth_group_users = {context_smooth_group: {} for context_smooth_group in list(unique_smooth_groups.keys())}
-        context_smooth_group_old = -1
-
-    # Split ngons into tri's
-    fgon_edges = set()  # Used for storing fgon keys
+    edges = []
     if use_edges:
-        edges = []
-
-    context_object = None
-
-    # reverse loop through face indices
-    for f_idx in range(len(faces) - 1, -1, -1):
-
-        (face_vert_loc_indices,
-         face_vert_tex_indices,
-         context_material,
-         context_smooth_group,
-         context_object,
-         ) = faces[f_idx]
-
-        len_face_vert_loc_indices = len(face_vert_loc_indices)
+        for start, total in zip(lines.face_starts, lines.face_totals):
+            line = lines.loop_verts[start:start + total]
+            edges.extend(zip(line[:-1], line[1:]))
+
+    # Faces of less than 3 verts are edges or nothing, ngons are split
+    # into triangles when they are not wanted.
+    if faces.face_totals and (min(faces.face_totals) < 3 or
+                              (not use_ngons and max(faces.face_totals) > 4)):
+
+        faces_valid = ObjFaces()
+        loop_verts = faces.loop_verts
+        loop_uvs = faces.loop_uvs
+
+        for first, end, state in faces.iter_spans():
+            faces_valid.set_state(state)
+            for start, total in zip(faces.face_starts[first:end], faces.face_totals[first:end]):
+                face_verts = loop_verts[start:start + total]
+                face_uvs = loop_uvs[start:start + total]
+
+                if total == 2:
+                    if use_edges:
+                        edges.append(tuple(face_verts))
+                    continue
+                elif total < 2:
+                    continue  # cant add single vert faces
+
+                if total > 4 and not use_ngons:
+                    ngon_face_indices = ngon_tessellate([tuple(verts_loc[i * 3:i * 3 + 3]) for i in face_verts],
+                                                        range(total))
+                else:
+                    ngon_face_indices = (range(total),)
 
-        if len_face_vert_loc_indices == 1:
-            faces.pop(f_idx)  # cant add single vert faces
+                for ngon in ngon_face_indices:
+                    faces_valid.new_face(state)
+                    faces_valid.loop_verts.extend([face_verts[i] for i in ngon])
+                    faces_valid.loop_uvs.extend([face_uvs[i] for i in ngon])
+                    faces_valid.face_totals[-1] = len(ngon)
 
-        elif not face_vert_tex_indices or len_face_vert_loc_indices == 2:  # faces that have no texture coords are lines
-            if use_edges:
-                # generators are better in python 2.4+ but can't be used in 2.3
-                # edges.extend( (face_vert_loc_indices[i], face_vert_loc_indices[i+1]) for i in xrange(len_face_vert_loc_indices-1) )
-                edges.extend([(face_vert_loc_indices[i], face_vert_loc_indices[i + 1]) for i in range(len_face_vert_loc_indices - 1)])
+        faces = faces_valid
 
-            faces.pop(f_idx)
-        else:
+    loop_verts = faces.loop_verts
 
-            # Smooth Group
-            if unique_smooth_groups and context_smooth_group:
-                # Is a part of of a smooth group and is a face
-                if context_smooth_group_old is not context_smooth_group:
-                    edge_dict = smooth_group_users[context_smooth_group]
-                    context_smooth_group_old = context_smooth_group
-
-                for i in range(len_face_vert_loc_indices):
-                    i1 = face_vert_loc_indices[i]
-                    i2 = face_vert_loc_indices[i - 1]
+    # Smooth groups, count the users of each edge per group
+    sharp_edges = set()
+    if unique_smooth_groups:
+        smooth_group_users = {}
+        for first, end, (context_material, context_smooth_group, context_object) in faces.iter_spans():
+            if not context_smooth_group:
+                continue
+
+            edge_dict = smooth_group_users.setdefault(context_smooth_group, {})
+            for start, total in zip(faces.face_starts[first:end], faces.face_totals[first:end]):
+                for i in range(start, start + total):
+                    i1 = loop_verts[i]
+                    i2 = loop_verts[i - 1 if i != start else start + total - 1]
                     if i1 > i2:
                         i1, i2 = i2, i1
 
@@ -522,53 +515,11 @@ def create_mesh(new_objects,
                     except KeyError:
                         edge_dict[i1, i2] = 1
 
-            # NGons into triangles
-            if has_ngons and len_face_vert_loc_indices > 4:
-
-                ngon_face_indices = ngon_tessellate(verts_loc, face_vert_loc_indices)
-                faces.extend([([face_vert_loc_indices[ngon[0]],
-                                face_vert_loc_indices[ngon[1]],
-                                face_vert_loc_indices[ngon[2]],
-                                ],
-                               [face_vert_tex_indices[ngon[0]],
-                                face_vert_tex_indices[ngon[1]],
-                                face_vert_tex_indices[ngon[2]],
-                                ],
-                               context_material,
-                               context_smooth_group,
-                               context_object,
-                              )
-                             for ngon in ngon_face_indices]
-                            )
-
-                # edges to make ngons
-                if use_ngons:
-                    edge_users = {}
-                    for ngon in ngon_face_indices:
-                        for i in (0, 1, 2):
-                            i1 = face_vert_loc_indices[ngon[i]]
-                            i2 = face_vert_loc_indices[ngon[i - 1]]
-                            if i1 > i2:
-                                i1, i2 = i2, i1
-
-                            try:
-                                edge_users[i1, i2] += 1
-                            except KeyError:
-                                edge_users[i1, i2] = 1
-
-                    for key, users in edge_users.items():
-                        if users > 1:
-                            fgon_edges.add(key)
-
-                # remove all after 3, means we dont have to pop this one.
-                faces.pop(f_idx)
-
-    # Build sharp edges
-    if unique_smooth_groups:
-        for edge_dict in list(smooth_group_users.values()):
-            for key, users in list(edge_dict.items()):
+        # Build sharp edges
+        for edge_dict in smooth_group_users.values():
+            for key, users in edge_dict.items():
                 if users == 1:  # This edge is on the boundry of a group
-                    sharp_edges[key] = None
+                    sharp_edges.add(key)
 
     # map the material names to an index
     material_mapping = {name: i for i, name in enumerate(unique_materials)}  # enumerate over unique_materials keys()
@@ -578,118 +529,68 @@ def create_mesh(new_objects,
     for name, index in list(material_mapping.items()):
         materials[index] = unique_materials[name]
 
+    # per face material index and smooth flag, set span by span
+    face_materials = array('i')
+    face_smooth = []
+    for first, end, (context_material, context_smooth_group, context_object) in faces.iter_spans():
+        face_materials.extend(array('i', (material_mapping[context_material] if context_material else 0,)) * (end - first))
+        face_smooth.extend([bool(context_smooth_group)] * (end - first))
+
     me = bpy.data.meshes.new(dataname.decode('utf-8', "replace"))
 
     # make sure the list isnt too big
     for material in materials:
         me.materials.append(material)
 
-    me.vertices.add(len(verts_loc))
-    me.tessfaces.add(len(faces))
+    me.vertices.add(len(verts_loc) // 3)
+    me.loops.add(len(loop_verts))
+    me.polygons.add(len(faces))
 
-    # verts_loc is a list of (x, y, z) tuples
-    me.vertices.foreach_set("co", unpack_list(verts_loc))
-
-    # faces is a list of (vert_indices, texco_indices, ...) tuples
-    # XXX faces should contain either 3 or 4 verts
     # XXX no check for valid face indices
-    me.tessfaces.foreach_set("vertices_raw", unpack_face_list([f[0] for f in faces]))
-
-    if verts_tex and me.tessfaces:
-        me.tessface_uv_textures.new()
-
-    context_material_old = -1  # avoid a dict lookup
-    mat = 0  # rare case it may be un-initialized.
-    me_faces = me.tessfaces
-
-    for i, face in enumerate(faces):
-        if len(face[0]) < 2:
-            pass  # raise "bad face"
-        elif len(face[0]) == 2:
-            if use_edges:
-                edges.append(face[0])
-        else:
-
-            blender_face = me.tessfaces[i]
-
-            (face_vert_loc_indices,
-             face_vert_tex_indices,
-             context_material,
-             context_smooth_group,
-             context_object,
-             ) = face
-
-            if context_smooth_group:
-                blender_face.use_smooth = True
-
+    me.vertices.foreach_set("co", array('f', verts_loc))
+    me.loops.foreach_set("vertex_index", loop_verts)
+    me.polygons.foreach_set("loop_start", faces.face_starts)
+    me.polygons.foreach_set("loop_total", faces.face_totals)
+    me.polygons.foreach_set("material_index", face_materials)
+    me.polygons.foreach_set("use_smooth", face_smooth)
+
+    if verts_tex and me.polygons:
+        me.uv_textures.new()
+
+        # index the flat array of the whole file, only this object's loops are visited
+        loop_uvs = [i * 2 for i in faces.loop_uvs]
+        uvs = [0.0] * (len(loop_uvs) * 2)
+        uvs[0::2] = [verts_tex[i] for i in loop_uvs]
+        uvs[1::2] = [verts_tex[i + 1] for i in loop_uvs]
+        me.uv_layers[0].data.foreach_set("uv", uvs)
+
+        # assign images
+        uv_faces = me.uv_textures[0].data
+        for first, end, (context_material, context_smooth_group, context_object) in faces.iter_spans():
             if context_material:
-                if context_material_old is not context_material:
-                    mat = material_mapping[context_material]
-                    context_material_old = context_material
-
-                blender_face.material_index = mat
-#                blender_face.mat= mat
+                image, has_data = unique_material_images[context_material]
+                if image:  # Can be none if the material dosnt have an image.
+                    for i in range(first, end):
+                        uv_faces[i].image = image
 
-            if verts_tex:
-
-                blender_tface = me.tessface_uv_textures[0].data[i]
-
-                if context_material:
-                    image, has_data = unique_material_images[context_material]
-                    if image:  # Can be none if the material dosnt have an image.
-                        blender_tface.image = image
-
-                # BUG - Evil eekadoodle problem where faces that have vert index 0 location at 3 or 4 are shuffled.
-                if len(face_vert_loc_indices) == 4:
-                    if face_vert_loc_indices[2] == 0 or face_vert_loc_indices[3] == 0:
-                        face_vert_tex_indices = face_vert_tex_indices[2], face_vert_tex_indices[3], face_vert_tex_indices[0], face_vert_tex_indices[1]
-                else:  # length of 3
-                    if face_vert_loc_indices[2] == 0:
-                        face_vert_tex_indices = face_vert_tex_indices[1], face_vert_tex_indices[2], face_vert_tex_indices[0]
-                # END EEEKADOODLE FIX
-
-                # assign material, uv's and image
-                blender_tface.uv1 = verts_tex[face_vert_tex_indices[0]]
-                blender_tface.uv2 = verts_tex[face_vert_tex_indices[1]]
-                blender_tface.uv3 = verts_tex[face_vert_tex_indices[2]]
-
-                if len(face_vert_loc_indices) == 4:
-                    blender_tface.uv4 = verts_tex[face_vert_tex_indices[3]]
-
-#                for ii, uv in enumerate(blender_face.uv):
-#                    uv.x, uv.y=  verts_tex[face_vert_tex_indices[ii]]
-    del me_faces
-#     del ALPHA
-
-    if use_edges and not edges:
-        use_edges = False
-
-    if use_edges:
+    if use_edges and edges:
         me.edges.add(len(edges))
 
         # edges should be a list of (a, b) tuples
         me.edges.foreach_set("vertices", unpack_list(edges))
-#         me_edges.extend( edges )
-
-#     del me_edges
-
-    # Add edge faces.
-#     me_edges= me.edges
-
-    def edges_match(e1, e2):
-        return (e1[0] == e2[0] and e1[1] == e2[1]) or (e1[0] == e2[1] and e1[1] == e2[0])
 
+    # calc_edges keeps the loose edges and adds the ones of the polygons
+    me.update(calc_edges=True)
     me.validate()
-    me.update(calc_edges=use_edges)
 
-    if unique_smooth_groups and sharp_edges:
+    if sharp_edges:
         import bmesh
         bm = bmesh.new()
         bm.from_mesh(me)
         # to avoid slow iterator lookups later / indexing verts is slow in bmesh
         bm_verts = bm.verts[:]
 
-        for sharp_edge in sharp_edges.keys():
+        for sharp_edge in sharp_edges:
             vert1 = bm_verts[sharp_edge[0]]
             vert2 = bm_verts[sharp_edge[1]]
             if vert1 != vert2:
@@ -700,22 +601,6 @@ def create_mesh(new_objects,
         bm.free()
         del bm
 
-    mesh_untessellate(me, fgon_edges)
-
-    # XXX slow
-#     if unique_smooth_groups and sharp_edges:
-#         for sharp_edge in sharp_edges.keys():
-#             for ed in me.edges:
-#                 if edges_match(sharp_edge, ed.vertices):
-#                     ed.use_edge_sharp = True
-
-#     if unique_smooth_groups and sharp_edges:
-#         SHARP= Mesh.EdgeFlags.SHARP
-#         for ed in me.findEdges( sharp_edges.keys() ):
-#             if ed is not None:
-#                 me_edges[ed].flag |= SHARP
-#         del SHARP
-
     ob = bpy.data.objects.new(me.name, me)
     new_objects.append(ob)
 
@@ -757,7 +642,7 @@ def create_nurbs(context_nurbs, vert_loc, new_objects):
 
     nu = cu.splines.new('NURBS')
     nu.points.add(len(curv_idx) - 1)  # a point is added to start with
-    nu.points.foreach_set("co", [co_axis for vt_idx in curv_idx for co_axis in (vert_loc[vt_idx] + (1.0,))])
+    nu.points.foreach_set("co", [co_axis for vt_idx in curv_idx for co_axis in (tuple(vert_loc[vt_idx * 3:vt_idx * 3 + 3]) + (1.0,))])
 
     nu.order_u = deg[0] + 1
 
@@ -842,12 +727,17 @@ def load(operator, context, filepath,
          use_groups_as_vgroups=False,
          relpath=None,
          global_matrix=None,
+         use_parallel=False,
          ):
     """
     Called by the user interface or another script.
     load_obj(path) - should give acceptable results.
     This function passes the file and sends the data off
         to be split into objects and then converted into mesh objects
+
+    use_parallel parses the file in a pool of processes (see parse_obj),
+    files using lines, curves or multi-line statements fall back to the
+    sequential parser.
     """
     print('\nimporting obj %r' % filepath)
 
@@ -861,9 +751,10 @@ def load(operator, context, filepath,
 
     time_main = time.time()
 
-    verts_loc = []
-    verts_tex = []
-    faces = []  # tuples of the faces
+    verts_loc = array('d')  # 3 floats per vertex
+    verts_tex = array('d')  # 2 floats per texture coordinate
+    faces = ObjFaces()
+    lines = ObjFaces()  # lines, when use_edges is enabled
     material_libs = []  # filanems to material libs this uses
     vertex_groups = {}  # when use_groups_as_vgroups is true
 
@@ -881,7 +772,6 @@ def load(operator, context, filepath,
     nurbs = []
     context_parm = b''  # used by nurbs too but could be used elsewhere
 
-    has_ngons = False
     # has_smoothgroups= False - is explicit with len(unique_smooth_groups) being > 0
 
     # Until we can use sets
@@ -900,205 +790,224 @@ def load(operator, context, filepath,
     time_sub = time.time()
 #     time_sub= sys.time()
 
-    file = open(filepath, 'rb')
-    for line in file:  # .readlines():
-        line_split = line.split()
+    parsed = None
+    if use_parallel and not use_groups_as_vgroups:
+        from . import parse_obj
+        try:
+            parsed = parse_obj.parse(filepath, float_func is not float, use_edges)
+        except Exception:
+            # no process pool on this platform, parse sequentially
+            import traceback
+            traceback.print_exc()
+
+        if parsed is None:
+            print("\tfile not supported by the parallel parser, parsing sequentially...")
+        else:
+            verts_loc, verts_tex, faces, events = parsed
+            (unique_materials,
+             unique_smooth_groups,
+             material_libs,
+             ) = parse_obj.replay_events(faces, events,
+                                         use_smooth_groups,
+                                         use_split_objects,
+                                         use_split_groups,
+                                         )
+            del events
+
+    if parsed is None:
+        file = open(filepath, 'rb')
+        for line in file:  # .readlines():
+            line_split = line.split()
+
+            if not line_split:
+                continue
+
+            line_start = line_split[0]  # we compare with this a _lot_
+
+            if line_start == b'v':
+                verts_loc.extend((float_func(line_split[1]), float_func(line_split[2]), float_func(line_split[3])))
+
+            elif line_start == b'vn':
+                pass
 
-        if not line_split:
-            continue
+            elif line_start == b'vt':
+                verts_tex.extend((float_func(line_split[1]), float_func(line_split[2])))
 
-        line_start = line_split[0]  # we compare with this a _lot_
+            # Handel faces lines (as faces) and the second+ lines of fa multiline face here
+            # use 'f' not 'f ' because some objs (very rare have 'fo ' for faces)
+            elif line_start == b'f' or context_multi_line == b'f':
 
-        if line_start == b'v':
-            verts_loc.append((float_func(line_split[1]), float_func(line_split[2]), float_func(line_split[3])))
+                if context_multi_line:
+                    # keep adding loops to the face previously defined
+                    pass
 
-        elif line_start == b'vn':
-            pass
+                else:
+                    line_split = line_split[1:]
 
-        elif line_start == b'vt':
-            verts_tex.append((float_func(line_split[1]), float_func(line_split[2])))
+                    # Instance a face
+                    faces.new_face((context_material,
+                                    context_smooth_group,
+                                    context_object,
+                                    ))
 
-        # Handel faces lines (as faces) and the second+ lines of fa multiline face here
-        # use 'f' not 'f ' because some objs (very rare have 'fo ' for faces)
-        elif line_start == b'f' or context_multi_line == b'f':
+                if strip_slash(line_split):
+                    context_multi_line = b'f'
+                else:
+                    context_multi_line = b''
 
-            if context_multi_line:
-                # use face_vert_loc_indices and face_vert_tex_indices previously defined and used the obj_face
-                pass
+                for v in line_split:
+                    obj_vert = v.split(b'/')
+                    vert_loc_index = int(obj_vert[0]) - 1
+                    # Add the vertex to the current group
+                    # *warning*, this wont work for files that have groups defined around verts
+                    if use_groups_as_vgroups and context_vgroup:
+                        vertex_groups[context_vgroup].append(vert_loc_index)
 
-            else:
-                line_split = line_split[1:]
-                face_vert_loc_indices = []
-                face_vert_tex_indices = []
-
-                # Instance a face
-                faces.append((face_vert_loc_indices,
-                              face_vert_tex_indices,
-                              context_material,
-                              context_smooth_group,
-                              context_object,
-                              ))
-
-            if strip_slash(line_split):
-                context_multi_line = b'f'
-            else:
-                context_multi_line = b''
+                    # Make relative negative vert indices absolute
+                    if vert_loc_index < 0:
+                        vert_loc_index = len(verts_loc) // 3 + vert_loc_index + 1
 
-            for v in line_split:
-                obj_vert = v.split(b'/')
-                vert_loc_index = int(obj_vert[0]) - 1
-                # Add the vertex to the current group
-                # *warning*, this wont work for files that have groups defined around verts
-                if use_groups_as_vgroups and context_vgroup:
-                    vertex_groups[context_vgroup].append(vert_loc_index)
+                    faces.loop_verts.append(vert_loc_index)
 
-                # Make relative negative vert indices absolute
-                if vert_loc_index < 0:
-                    vert_loc_index = len(verts_loc) + vert_loc_index + 1
+                    if len(obj_vert) > 1 and obj_vert[1]:
+                        # formatting for faces with normals and textures us
+                        # loc_index/tex_index/nor_index
 
-                face_vert_loc_indices.append(vert_loc_index)
+                        vert_tex_index = int(obj_vert[1]) - 1
+                        # Make relative negative vert indices absolute
+                        if vert_tex_index < 0:
+                            vert_tex_index = len(verts_tex) // 2 + vert_tex_index + 1
 
-                if len(obj_vert) > 1 and obj_vert[1]:
-                    # formatting for faces with normals and textures us
-                    # loc_index/tex_index/nor_index
+                        faces.loop_uvs.append(vert_tex_index)
+                    else:
+                        # dummy
+                        faces.loop_uvs.append(0)
 
-                    vert_tex_index = int(obj_vert[1]) - 1
-                    # Make relative negative vert indices absolute
-                    if vert_tex_index < 0:
-                        vert_tex_index = len(verts_tex) + vert_tex_index + 1
+                faces.face_totals[-1] = len(faces.loop_verts) - faces.face_starts[-1]
 
-                    face_vert_tex_indices.append(vert_tex_index)
-                else:
-                    # dummy
-                    face_vert_tex_indices.append(0)
+            elif use_edges and (line_start == b'l' or context_multi_line == b'l'):
+                # very similar to the face load function above with some parts removed
 
-            if len(face_vert_loc_indices) > 4:
-                has_ngons = True
+                if context_multi_line:
+                    # keep adding loops to the line previously defined
+                    pass
 
-        elif use_edges and (line_start == b'l' or context_multi_line == b'l'):
-            # very similar to the face load function above with some parts removed
+                else:
+                    line_split = line_split[1:]
 
-            if context_multi_line:
-                # use face_vert_loc_indices and face_vert_tex_indices previously defined and used the obj_face
-                pass
+                    # Instance a line
+                    lines.new_face((context_material,
+                                    context_smooth_group,
+                                    context_object,
+                                    ))
 
-            else:
-                line_split = line_split[1:]
-                face_vert_loc_indices = []
-                face_vert_tex_indices = []
-
-                # Instance a face
-                faces.append((face_vert_loc_indices,
-                              face_vert_tex_indices,
-                              context_material,
-                              context_smooth_group,
-                              context_object,
-                              ))
-
-            if strip_slash(line_split):
-                context_multi_line = b'l'
-            else:
-                context_multi_line = b''
-
-            # isline = line_start == b'l'  # UNUSED
-
-            for v in line_split:
-                vert_loc_index = int(v) - 1
-
-                # Make relative negative vert indices absolute
-                if vert_loc_index < 0:
-                    vert_loc_index = len(verts_loc) + vert_loc_index + 1
-
-                face_vert_loc_indices.append(vert_loc_index)
-
-        elif line_start == b's':
-            if use_smooth_groups:
-                context_smooth_group = line_value(line_split)
-                if context_smooth_group == b'off':
-                    context_smooth_group = None
-                elif context_smooth_group:  # is not None
-                    unique_smooth_groups[context_smooth_group] = None
-
-        elif line_start == b'o':
-            if use_split_objects:
-                context_object = line_value(line_split)
-                # unique_obects[context_object]= None
-
-        elif line_start == b'g':
-            if use_split_groups:
-                context_object = line_value(line.split())
-                # print 'context_object', context_object
-                # unique_obects[context_object]= None
-            elif use_groups_as_vgroups:
-                context_vgroup = line_value(line.split())
-                if context_vgroup and context_vgroup != b'(null)':
-                    vertex_groups.setdefault(context_vgroup, [])
+                if strip_slash(line_split):
+                    context_multi_line = b'l'
                 else:
-                    context_vgroup = None  # dont assign a vgroup
-
-        elif line_start == b'usemtl':
-            context_material = line_value(line.split())
-            unique_materials[context_material] = None
-        elif line_start == b'mtllib':  # usemap or usemat
-            material_libs = list(set(material_libs) | set(line.split()[1:]))  # can have multiple mtllib filenames per line, mtllib can appear more than once, so make sure only occurance of material exists
-
-            # Nurbs support
-        elif line_start == b'cstype':
-            context_nurbs[b'cstype'] = line_value(line.split())  # 'rat bspline' / 'bspline'
-        elif line_start == b'curv' or context_multi_line == b'curv':
-            curv_idx = context_nurbs[b'curv_idx'] = context_nurbs.get(b'curv_idx', [])  # in case were multiline
-
-            if not context_multi_line:
-                context_nurbs[b'curv_range'] = float_func(line_split[1]), float_func(line_split[2])
-                line_split[0:3] = []  # remove first 3 items
-
-            if strip_slash(line_split):
-                context_multi_line = b'curv'
-            else:
-                context_multi_line = b''
+                    context_multi_line = b''
+
+                # isline = line_start == b'l'  # UNUSED
 
-            for i in line_split:
-                vert_loc_index = int(i) - 1
+                for v in line_split:
+                    vert_loc_index = int(v) - 1
 
-                if vert_loc_index < 0:
-                    vert_loc_index = len(verts_loc) + vert_loc_index + 1
+                    # Make relative negative vert indices absolute
+                    if vert_loc_index < 0:
+                        vert_loc_index = len(verts_loc) // 3 + vert_loc_index + 1
+
+                    lines.loop_verts.append(vert_loc_index)
+                    lines.loop_uvs.append(0)
+
+                lines.face_totals[-1] = len(lines.loop_verts) - lines.face_starts[-1]
+
+            elif line_start == b's':
+                if use_smooth_groups:
+                    context_smooth_group = line_value(line_split)
+                    if context_smooth_group == b'off':
+                        context_smooth_group = None
+                    elif context_smooth_group:  # is not None
+                        unique_smooth_groups[context_smooth_group] = None
+
+            elif line_start == b'o':
+                if use_split_objects:
+                    context_object = line_value(line_split)
+                    # unique_obects[context_object]= None
+
+            elif line_start == b'g':
+                if use_split_groups:
+                    context_object = line_value(line.split())
+                    # print 'context_object', context_object
+                    # unique_obects[context_object]= None
+                elif use_groups_as_vgroups:
+                    context_vgroup = line_value(line.split())
+                    if context_vgroup and context_vgroup != b'(null)':
+                        vertex_groups.setdefault(context_vgroup, [])
+                    else:
+                        context_vgroup = None  # dont assign a vgroup
+
+            elif line_start == b'usemtl':
+                context_material = line_value(line.split())
+                unique_materials[context_material] = None
+            elif line_start == b'mtllib':  # usemap or usemat
+                material_libs = list(set(material_libs) | set(line.split()[1:]))  # can have multiple mtllib filenames per line, mtllib can appear more than once, so make sure only occurance of material exists
+
+                # Nurbs support
+            elif line_start == b'cstype':
+                context_nurbs[b'cstype'] = line_value(line.split())  # 'rat bspline' / 'bspline'
+            elif line_start == b'curv' or context_multi_line == b'curv':
+                curv_idx = context_nurbs[b'curv_idx'] = context_nurbs.get(b'curv_idx', [])  # in case were multiline
+
+                if not context_multi_line:
+                    context_nurbs[b'curv_range'] = float_func(line_split[1]), float_func(line_split[2])
+                    line_split[0:3] = []  # remove first 3 items
+
+                if strip_slash(line_split):
+                    context_multi_line = b'curv'
+                else:
+                    context_multi_line = b''
 
-                curv_idx.append(vert_loc_index)
+                for i in line_split:
+                    vert_loc_index = int(i) - 1
 
-        elif line_start == b'parm' or context_multi_line == b'parm':
-            if context_multi_line:
-                context_multi_line = b''
-            else:
-                context_parm = line_split[1]
-                line_split[0:2] = []  # remove first 2
+                    if vert_loc_index < 0:
+                        vert_loc_index = len(verts_loc) // 3 + vert_loc_index + 1
 
-            if strip_slash(line_split):
-                context_multi_line = b'parm'
-            else:
-                context_multi_line = b''
-
-            if context_parm.lower() == b'u':
-                context_nurbs.setdefault(b'parm_u', []).extend([float_func(f) for f in line_split])
-            elif context_parm.lower() == b'v':  # surfaces not supported yet
-                context_nurbs.setdefault(b'parm_v', []).extend([float_func(f) for f in line_split])
-            # else: # may want to support other parm's ?
-
-        elif line_start == b'deg':
-            context_nurbs[b'deg'] = [int(i) for i in line.split()[1:]]
-        elif line_start == b'end':
-            # Add the nurbs curve
-            if context_object:
-                context_nurbs[b'name'] = context_object
-            nurbs.append(context_nurbs)
-            context_nurbs = {}
-            context_parm = b''
-
-        ''' # How to use usemap? depricated?
-        elif line_start == b'usema': # usemap or usemat
-            context_image= line_value(line_split)
-        '''
+                    curv_idx.append(vert_loc_index)
 
-    file.close()
+            elif line_start == b'parm' or context_multi_line == b'parm':
+                if context_multi_line:
+                    context_multi_line = b''
+                else:
+                    context_parm = line_split[1]
+                    line_split[0:2] = []  # remove first 2
+
+                if strip_slash(line_split):
+                    context_multi_line = b'parm'
+                else:
+                    context_multi_line = b''
+
+                if context_parm.lower() == b'u':
+                    context_nurbs.setdefault(b'parm_u', []).extend([float_func(f) for f in line_split])
+                elif context_parm.lower() == b'v':  # surfaces not supported yet
+                    context_nurbs.setdefault(b'parm_v', []).extend([float_func(f) for f in line_split])
+                # else: # may want to support other parm's ?
+
+            elif line_start == b'deg':
+                context_nurbs[b'deg'] = [int(i) for i in line.split()[1:]]
+            elif line_start == b'end':
+                # Add the nurbs curve
+                if context_object:
+                    context_nurbs[b'name'] = context_object
+                nurbs.append(context_nurbs)
+                context_nurbs = {}
+                context_parm = b''
+
+            ''' # How to use usemap? depricated?
+            elif line_start == b'usema': # usemap or usemat
+                context_image= line_value(line_split)
+            '''
+
+        file.close()
     time_new = time.time()
     print("%.4f sec" % (time_new - time_sub))
     time_sub = time_new
@@ -1118,22 +1027,22 @@ def load(operator, context, filepath,
 #     scn.objects.selected = []
     new_objects = []  # put new objects here
 
-    print('\tbuilding geometry...\n\tverts:%i faces:%i materials: %i smoothgroups:%i ...' % (len(verts_loc), len(faces), len(unique_materials), len(unique_smooth_groups)))
+    print('\tbuilding geometry...\n\tverts:%i faces:%i materials: %i smoothgroups:%i ...' % (len(verts_loc) // 3, len(faces), len(unique_materials), len(unique_smooth_groups)))
     # Split the mesh by objects/materials, may
     if use_split_objects or use_split_groups:
         SPLIT_OB_OR_GROUP = True
     else:
         SPLIT_OB_OR_GROUP = False
 
-    for verts_loc_split, faces_split, unique_materials_split, dataname in split_mesh(verts_loc, faces, unique_materials, filepath, SPLIT_OB_OR_GROUP):
+    for verts_loc_split, faces_split, lines_split, unique_materials_split, dataname in split_mesh(verts_loc, faces, lines, unique_materials, filepath, SPLIT_OB_OR_GROUP):
         # Create meshes from the data, warning 'vertex_groups' wont support splitting
         create_mesh(new_objects,
-                    has_ngons,
                     use_ngons,
                     use_edges,
                     verts_loc_split,
                     verts_tex,
                     faces_split,
+                    lines_split,
                     unique_materials_split,
                     unique_material_images,
                     unique_smooth_groups,
@@ -0,0 +1,392 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Parallel parsing of the geometry of big OBJ files.
+
+The file is cut into byte ranges ending on line boundaries, each range is
+parsed in a worker process into flat arrays, then the results are merged
+in file order. State lines (usemtl, o, g, s) are recorded as events with
+the index of the next face, and replayed in order when merging, so the
+state carried from one range to the next is kept.
+
+Faces are stored in an ObjFaces, flat arrays of loop indices plus spans of
+faces sharing the same material, smooth group and object.
+
+This module doesn't use bpy so it can be imported by the workers.
+"""
+
+import os
+from array import array
+
+# don't bother splitting files smaller than this
+PARALLEL_MIN_SIZE = 1 << 20
+
+
+class ObjFaces(object):
+    """
+    Compact storage of the faces of an OBJ file.
+
+    loop_verts, loop_uvs
+        array('i') of the vertex and texture coordinate index of each
+        loop (0 when a face has no texture coordinate).
+
+    face_starts, face_totals
+        array('i') of the first loop and the number of loops of each face.
+
+    span_starts, span_states
+        Index of the first face of each run of faces sharing the same
+        (material, smooth_group, object) state, and that state.
+    """
+    __slots__ = ("loop_verts",
+                 "loop_uvs",
+                 "face_starts",
+                 "face_totals",
+                 "span_starts",
+                 "span_states",
+                 )
+
+    def __init__(self):
+        self.loop_verts = array('i')
+        self.loop_uvs = array('i')
+        self.face_starts = array('i')
+        self.face_totals = array('i')
+        self.span_starts = array('i', (0,))
+        self.span_states = [(None, None, None)]
+
+    def __len__(self):
+        return len(self.face_totals)
+
+    def set_state(self, state, first=None):
+        """
+        Set the (material, smooth_group, object) of the faces from *first*
+        on, the next face added by default.
+        """
+        if first is None:
+            first = len(self.face_totals)
+
+        if state == self.span_states[-1]:
+            return
+        if self.span_starts[-1] == first:
+            # no face uses the current span yet, just replace it
+            self.span_states[-1] = state
+        else:
+            self.span_starts.append(first)
+            self.span_states.append(state)
+
+    def iter_spans(self):
+        """
+        Iterate over (first_face, end_face, state) of the non empty spans.
+        """
+        ends = list(self.span_starts[1:]) + [len(self.face_totals)]
+        for first, end, state in zip(self.span_starts, ends, self.span_states):
+            if first != end:
+                yield first, end, state
+
+    def new_face(self, state):
+        """
+        Start a new face with no loop, using the given state.
+        """
+        self.set_state(state)
+        self.face_starts.append(len(self.loop_verts))
+        self.face_totals.append(0)
+
+    def subset(self, spans):
+        """
+        Return a new ObjFaces made of the faces of the given
+        (first_face, end_face, state) spans.
+        """
+        sub = ObjFaces()
+        face_starts = self.face_starts
+        face_totals = self.face_totals
+
+        for first, end, state in spans:
+            # the loops of consecutive faces are contiguous
+            loop_first = face_starts[first]
+            loop_end = face_starts[end - 1] + face_totals[end - 1]
+            offset = len(sub.loop_verts) - loop_first
+
+            sub.set_state(state)
+            sub.loop_verts.extend(self.loop_verts[loop_first:loop_end])
+            sub.loop_uvs.extend(self.loop_uvs[loop_first:loop_end])
+            sub.face_starts.extend([start + offset for start in face_starts[first:end]])
+            sub.face_totals.extend(face_totals[first:end])
+
+        return sub
+
+
+def _line_value(line_split):
+    # same as import_obj.line_value
+    if len(line_split) == 1:
+        return None
+    return b' '.join(line_split[1:])
+
+
+def split_ranges(filepath, count):
+    """
+    Cut a file in up to *count* (start, end) byte ranges ending on line
+    boundaries.
+    """
+    size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, 'rb') as f:
+        for i in range(1, count):
+            f.seek(max(bounds[-1], size * i // count))
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_range(filepath, start, end, use_comma, use_edges):
+    """
+    Parse the v, vt and f lines of a byte range of an OBJ file.
+
+    Negative (relative) indices are resolved against the vertices of the
+    range, their loop positions are returned so the merge can offset them.
+
+    Returns None when the range uses something only the sequential parser
+    supports (lines, curves, multi-line statements).
+    """
+    if use_comma:
+        def float_func(f):
+            return float(f.replace(b',', b'.'))
+    else:
+        float_func = float
+
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    verts = array('d')
+    uvs = array('d')
+    loop_verts = array('i')
+    loop_uvs = array('i')
+    face_totals = array('i')
+    relative_verts = array('i')
+    relative_uvs = array('i')
+    events = []
+
+    for line in data.splitlines():
+        line_split = line.split()
+
+        if not line_split:
+            continue
+
+        line_start = line_split[0]
+
+        if line_start == b'v':
+            verts.extend((float_func(line_split[1]),
+                          float_func(line_split[2]),
+                          float_func(line_split[3])))
+
+        elif line_start == b'vt':
+            uvs.extend((float_func(line_split[1]), float_func(line_split[2])))
+
+        elif line_start == b'f':
+            if line_split[-1][-1] == 92:  # '\' char
+                return None
+
+            for v in line_split[1:]:
+                obj_vert = v.split(b'/')
+
+                index = int(obj_vert[0])
+                if index < 0:
+                    relative_verts.append(len(loop_verts))
+                    index += len(verts) // 3
+                else:
+                    index -= 1
+                loop_verts.append(index)
+
+                if len(obj_vert) > 1 and obj_vert[1]:
+                    index = int(obj_vert[1])
+                    if index < 0:
+                        relative_uvs.append(len(loop_uvs))
+                        index += len(uvs) // 2
+                    else:
+                        index -= 1
+                    loop_uvs.append(index)
+                else:
+                    loop_uvs.append(0)
+
+            face_totals.append(len(line_split) - 1)
+
+        elif line_start in {b'usemtl', b'o', b'g', b's'}:
+            events.append((len(face_totals), line_start, _line_value(line_split)))
+
+        elif line_start == b'mtllib':
+            events.append((len(face_totals), line_start, tuple(line_split[1:])))
+
+        elif line_start in {b'cstype', b'curv', b'parm', b'deg', b'end'}:
+            return None
+
+        elif line_start == b'l' and use_edges:
+            return None
+
+    return (verts, uvs, loop_verts, loop_uvs, face_totals,
+            relative_verts, relative_uvs, events)
+
+
+def process_pool(jobs):
+    """
+    Return a ProcessPoolExecutor of *jobs* forked processes, or None where
+    processes can't be forked (Windows).
+
+    Spawned workers would start the Blender binary instead of Python, and
+    before Python 3.3 a pool whose workers die hangs instead of raising,
+    so the callers could never fall back to a single process.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if os.name != 'posix':
+        return None
+
+    try:
+        # fork isn't the default start method everywhere since Python 3.8
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        # before Python 3.4, always fork on POSIX
+        return ProcessPoolExecutor(jobs)
+
+    try:
+        return ProcessPoolExecutor(jobs, mp_context=context)
+    except TypeError:
+        # before Python 3.7, the default start method is fork on POSIX
+        return ProcessPoolExecutor(jobs)
+
+
+def parse(filepath, use_comma, use_edges, jobs=None):
+    """
+    Parse the geometry of an OBJ file using a pool of *jobs* processes,
+    or in this process for small files and where there is no pool.
+
+    Returns (verts_loc, verts_tex, faces, events), verts_loc and verts_tex
+    being flat array('d') of 3 and 2 floats per element, faces an ObjFaces
+    without spans yet and events the ordered list of
+    (face_index, keyword, value) state changes, see replay_events.
+
+    Returns None when the file needs the sequential parser.
+    """
+    import multiprocessing
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    pool = None
+    if jobs > 1 and os.path.getsize(filepath) >= PARALLEL_MIN_SIZE:
+        pool = process_pool(jobs)
+
+    if pool is None:
+        results = [parse_range(filepath, start, end, use_comma, use_edges)
+                   for start, end in split_ranges(filepath, 1)]
+    else:
+        ranges = split_ranges(filepath, jobs * 4)
+
+        with pool:
+            results = list(pool.map(parse_range,
+                                    *zip(*[(filepath, start, end, use_comma, use_edges)
+                                           for start, end in ranges])))
+
+    if None in results:
+        return None
+
+    verts_loc = array('d')
+    verts_tex = array('d')
+    faces = ObjFaces()
+    events = []
+
+    for (verts, uvs, loop_verts, loop_uvs, face_totals,
+         relative_verts, relative_uvs, range_events) in results:
+
+        verts_base = len(verts_loc) // 3
+        for i in relative_verts:
+            loop_verts[i] += verts_base
+
+        uvs_base = len(verts_tex) // 2
+        for i in relative_uvs:
+            loop_uvs[i] += uvs_base
+
+        face_base = len(faces.face_totals)
+        events.extend([(face + face_base, keyword, value)
+                       for face, keyword, value in range_events])
+
+        verts_loc.extend(verts)
+        verts_tex.extend(uvs)
+        faces.loop_verts.extend(loop_verts)
+        faces.loop_uvs.extend(loop_uvs)
+        faces.face_totals.extend(face_totals)
+
+    start = 0
+    face_starts = faces.face_starts
+    for total in faces.face_totals:
+        face_starts.append(start)
+        start += total
+
+    return verts_loc, verts_tex, faces, events
+
+
+def replay_events(faces, events,
+                  use_smooth_groups,
+                  use_split_objects,
+                  use_split_groups,
+                  ):
+    """
+    Apply the state changes returned by parse to the spans of *faces*, the
+    same way the sequential parser does.
+
+    Returns (unique_materials, unique_smooth_groups, material_libs).
+    """
+    unique_materials = {}
+    unique_smooth_groups = {}
+    material_libs = set()
+
+    context_material = None
+    context_smooth_group = None
+    context_object = None
+
+    for face, keyword, value in events:
+        if keyword == b'usemtl':
+            context_material = value
+            unique_materials[context_material] = None
+        elif keyword == b's':
+            if use_smooth_groups:
+                context_smooth_group = value
+                if context_smooth_group == b'off':
+                    context_smooth_group = None
+                elif context_smooth_group:
+                    unique_smooth_groups[context_smooth_group] = None
+        elif keyword == b'o':
+            if use_split_objects:
+                context_object = value
+        elif keyword == b'g':
+            if use_split_groups:
+                context_object = value
+        elif keyword == b'mtllib':
+            material_libs.update(value)
+            continue
+
+        faces.set_state((context_material, context_smooth_group, context_object), face)
+
+    return unique_materials, unique_smooth_groups, list(material_libs)
@@ -22,7 +22,8 @@ DEBUG = False
 
 # This should work without a blender at all
 import os
-import shlex
+import re
+from array import array
 
 
 def imageConvertCompat(path):
@@ -55,261 +56,192 @@ def imageConvertCompat(path):
 
 # =============================== VRML Spesific
 
-def vrmlFormat(data):
-    """
-    Keep this as a valid vrml file, but format in a way we can predict.
-    """
-    # Strip all commends - # not in strings - warning multiline strings are ignored.
-    def strip_comment(l):
-        #l = ' '.join(l.split())
-        l = l.strip()
-
-        if l.startswith('#'):
-            return ''
-
-        i = l.find('#')
-
-        if i == -1:
-            return l
-
-        # Most cases accounted for! if we have a comment at the end of the line do this...
-        #j = l.find('url "')
-        j = l.find('"')
-
-        if j == -1:  # simple no strings
-            return l[:i].strip()
-
-        q = False
-        for i, c in enumerate(l):
-            if c == '"':
-                q = not q  # invert
+# The VRML file is split into tokens in a single pass, tokens are tuples:
+# (kind, text, lineno), kind is one of the brace characters, ',', 'word' or 'string'
+# (strings keep their quotes). Arrays containing only numbers, such as
+# point and coordIndex, are kept as one 'numbers' token holding the span of
+# the file between the brackets (data, start, end), they are only converted
+# into an array when the importer asks for them (see vrmlNode.getArrayData)
 
-            elif c == '#':
-                if q is False:
-                    return l[:i - 1]
+TOKEN_NUMBERS = 'numbers'
+TOKEN_WORD = 'word'
+TOKEN_STRING = 'string'
 
-        return l
+vrml_token_re = re.compile(r'''
+    (?P<space>[ \t\r\n]+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<string>"(?:[^"\\]|\\.)*"?)
+  | (?P<brace>[{}\[\],])
+  | (?P<word>[^ \t\r\n{}\[\],"\#]+)
+''', re.VERBOSE | re.DOTALL)
 
-    data = '\n'.join([strip_comment(l) for l in data.split('\n')])  # remove all whitespace
+# contents of a bracket that can be kept as a span of numbers
+vrml_numbers_re = re.compile(r'[ \t\r\n,0-9.eE+\-]*\]')
 
-    EXTRACT_STRINGS = True  # only needed when strings or filesnames containe ,[]{} chars :/
+# these always start a new field or statement
+VRML_STATEMENTS = {'field', 'exposedField', 'eventIn', 'eventOut', 'ROUTE', 'PROTO', 'EXTERNPROTO'}
 
-    if EXTRACT_STRINGS:
+# words used as values, not field names
+VRML_VALUE_WORDS = {'TRUE', 'FALSE', 'NULL'}
 
-        # We need this so we can detect URL's
-        data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
 
-        string_ls = []
-
-        #search = 'url "'
-        search = '"'
-
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search, last_i)
-            if i != -1:
-
-                start = i + len(search)  # first char after end of search
-                end = data.find('"', start)
-                if end != -1:
-                    item = data[start:end]
-                    string_ls.append(item)
-                    data = data[:start] + data[end:]
-                    ok = True  # keep looking
-
-                    last_i = (end - len(item)) + 1
-                    # print(last_i, item, '|' + data[last_i] + '|')
-
-    # done with messy extracting strings part
-
-    # Bad, dont take strings into account
-    '''
-    data = data.replace('#', '\n#')
-    data = '\n'.join([ll for l in data.split('\n') for ll in (l.strip(),) if not ll.startswith('#')]) # remove all whitespace
-    '''
-    data = data.replace('{', '\n{\n')
-    data = data.replace('}', '\n}\n')
-    data = data.replace('[', '\n[\n')
-    data = data.replace(']', '\n]\n')
-    data = data.replace(',', ' , ')  # make sure comma's separate
-
-    if EXTRACT_STRINGS:
-        # add strings back in
+def vrmlTokenize(data):
+    """
+    Split VRML text into tokens, comments are removed.
+    """
+    tokens = []
+    tokens_append = tokens.append
+    lineno = 1
+    pos = 0
+    end = len(data)
+    match_token = vrml_token_re.match
+    match_numbers = vrml_numbers_re.match
+
+    while pos < end:
+        m = match_token(data, pos)
+        if m is None:  # unbalanced quote, should not happen
+            break
 
-        search = '"'  # fill in these empty strings
+        kind = m.lastgroup
+        text = m.group()
+        pos = m.end()
 
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search + '"', last_i)
-            # print(i)
-            if i != -1:
-                start = i + len(search)  # first char after end of search
-                item = string_ls.pop(0)
-                # print(item)
-                data = data[:start] + item + data[start:]
+        if kind == 'space':
+            lineno += text.count('\n')
+        elif kind == 'comment':
+            pass
+        elif kind == 'brace':
+            if text == '[':
+                m = match_numbers(data, pos)
+                if m:
+                    # keep large arrays as a span of the file
+                    tokens_append((TOKEN_NUMBERS, (data, pos, m.end() - 1), lineno))
+                    lineno += data.count('\n', pos, m.end())
+                    pos = m.end()
+                    continue
+
+            tokens_append((text, text, lineno))
+        else:
+            tokens_append((kind, text, lineno))
+            if kind == 'string':
+                lineno += text.count('\n')
 
-                last_i = start + len(item) + 1
+    return tokens
 
-                ok = True
 
-    # More annoying obscure cases where USE or DEF are placed on a newline
-    # data = data.replace('\nDEF ', ' DEF ')
-    # data = data.replace('\nUSE ', ' USE ')
+def vrmlArrayDecode(span):
+    """
+    Numbers of a span of the file (data, start, end) as a flat array, ints when possible.
+    """
+    data, start, end = span
+    values = data[start:end].replace(',', ' ').split()
 
-    data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
+    if '.' not in data[start:end] and 'e' not in data[start:end] and 'E' not in data[start:end]:
+        try:
+            return array('i', [int(val) for val in values])
+        except (ValueError, OverflowError):
+            pass
 
-    # Better to parse the file accounting for multiline arrays
-    '''
-    data = data.replace(',\n', ' , ') # remove line endings with commas
-    data = data.replace(']', '\n]\n') # very very annoying - but some comma's are at the end of the list, must run this again.
-    '''
+    try:
+        return array('d', [float(val) for val in values])
+    except ValueError:
+        print('\tWarning, could not parse array data from field')
+        return array('d')
 
-    return [l for l in data.split('\n') if l]
 
-NODE_NORMAL = 1  # {}
-NODE_ARRAY = 2  # []
-NODE_REFERENCE = 3  # USE foobar
-# NODE_PROTO = 4 #
+def iskey(k):
+    if k[0] != '"' and k[0].isalpha() and k.upper() not in VRML_VALUE_WORDS:
+        return True
+    return False
 
-lines = []
 
+def split_fields(value):
+    """
+    key 0.0 otherkey 1,2,3 opt1 opt1 0.0
+        -> [key 0.0], [otherkey 1,2,3], [opt1 opt1 0.0]
+    """
+    field_list = []
+    field_context = []
 
-def getNodePreText(i, words):
-    # print(lines[i])
-    use_node = False
-    while len(words) < 5:
+    for j in range(len(value)):
+        if iskey(value[j]):
+            if field_context:
+                # this IS a key but the previous value was not a key, ot it was a defined field.
+                if (not iskey(field_context[-1])) or ((len(field_context) == 3 and field_context[1] == 'IS')) or value[j] in VRML_STATEMENTS:
+                    field_list.append(field_context)
 
-        if i >= len(lines):
-            break
-            '''
-        elif lines[i].startswith('PROTO'):
-            return NODE_PROTO, i+1
-            '''
-        elif lines[i] == '{':
-            # words.append(lines[i]) # no need
-            # print("OK")
-            return NODE_NORMAL, i + 1
-        elif lines[i].count('"') % 2 != 0:  # odd number of quotes? - part of a string.
-            # print('ISSTRING')
-            break
+                    field_context = [value[j]]
+                else:
+                    # The last item was not a value, multiple keys are needed in some cases.
+                    field_context.append(value[j])
+            else:
+                # Is empty, just add this on
+                field_context.append(value[j])
         else:
-            new_words = lines[i].split()
-            if 'USE' in new_words:
-                use_node = True
+            # Add a value to the list
+            field_context.append(value[j])
 
-            words.extend(new_words)
-            i += 1
+    if field_context:
+        field_list.append(field_context)
 
-        # Check for USE node - no {
-        # USE #id - should always be on the same line.
-        if use_node:
-            # print('LINE', i, words[:words.index('USE')+2])
-            words[:] = words[:words.index('USE') + 2]
-            if lines[i] == '{' and lines[i + 1] == '}':
-                # USE sometimes has {} after it anyway
-                i += 2
-            return NODE_REFERENCE, i
+    return field_list
 
-    # print("error value!!!", words)
-    return 0, -1
-
-
-def is_nodeline(i, words):
-
-    if not lines[i][0].isalpha():
-        return 0, 0
-
-    #if lines[i].startswith('field'):
-    #   return 0, 0
-
-    # Is this a prototype??
-    if lines[i].startswith('PROTO'):
-        words[:] = lines[i].split()
-        return NODE_NORMAL, i + 1  # TODO - assumes the next line is a '[\n', skip that
-    if lines[i].startswith('EXTERNPROTO'):
-        words[:] = lines[i].split()
-        return NODE_ARRAY, i + 1  # TODO - assumes the next line is a '[\n', skip that
-
-    '''
-    proto_type, new_i = is_protoline(i, words, proto_field_defs)
-    if new_i != -1:
-        return proto_type, new_i
-    '''
-
-    # Simple "var [" type
-    if lines[i + 1] == '[':
-        if lines[i].count('"') % 2 == 0:
-            words[:] = lines[i].split()
-            return NODE_ARRAY, i + 2
-
-    node_type, new_i = getNodePreText(i, words)
-
-    if not node_type:
-        if DEBUG:
-            print("not node_type", lines[i])
-        return 0, 0
-
-    # Ok, we have a { after some values
-    # Check the values are not fields
-    for i, val in enumerate(words):
-        if i != 0 and words[i - 1] in {'DEF', 'USE'}:
-            # ignore anything after DEF, it is a ID and can contain any chars.
-            pass
-        elif val[0].isalpha() and val not in {'TRUE', 'FALSE'}:
-            pass
-        else:
-            # There is a number in one of the values, therefor we are not a node.
-            return 0, 0
 
-    #if node_type==NODE_REFERENCE:
-    #   print(words, "REF_!!!!!!!")
-    return node_type, new_i
+def is_numword(word):
+    """
+    Does this word start a number?
+    """
+    c = word[0]
+    return c.isdigit() or (c in '+-.' and len(word) > 1 and (word[1].isdigit() or word[1] == '.'))
 
 
-def is_numline(i):
+def getNodeHeader(words):
     """
-    Does this line start with a number?
+    Number of words at the end of *words* naming the node that follows them,
+    eg: 'geometry DEF foo IndexedFaceSet {' or 'children ['.
+    words are (text, lineno) pairs.
     """
+    tot = len(words)
 
-    # Works but too slow.
-    '''
-    l = lines[i]
-    for w in l.split():
-        if w==',':
-            pass
-        else:
-            try:
-                float(w)
-                return True
+    # the last run of keys, anything after DEF or USE is an ID and can contain any chars.
+    i = tot
+    while i:
+        if i >= 2 and words[i - 2][0] in {'DEF', 'USE'}:
+            i -= 2
+            continue
 
-            except:
-                return False
+        text = words[i - 1][0]
+        if not iskey(text) or text == 'IS':
+            if text == 'IS' and i < tot:
+                i += 1  # 'diffuseColor IS legColor', legColor is not ours
+            break
 
-    return False
-    '''
+        i -= 1
+        if text in VRML_STATEMENTS:
+            break
 
-    l = lines[i]
+    # ROUTE a.b TO c.d
+    for j in range(i, tot):
+        if words[j][0] == 'ROUTE':
+            i = min(j + 4, tot)
 
-    line_start = 0
+    # the node is named on its own line, except for a single word or 'DEF foo' on the line before
+    lineno_last = words[-1][1] if words else 0
+    j = i
+    while j < tot and words[j][1] != lineno_last:
+        j += 1
+    if j - i > 1 and not (j - i == 2 and words[i][0] == 'DEF'):
+        i = j
 
-    if l.startswith(', '):
-        line_start += 2
+    return tot - i
 
-    line_end = len(l) - 1
-    line_end_new = l.find(' ', line_start)  # comma's always have a space before them
 
-    if line_end_new != -1:
-        line_end = line_end_new
+NODE_NORMAL = 1  # {}
+NODE_ARRAY = 2  # []
+NODE_REFERENCE = 3  # USE foobar
+# NODE_PROTO = 4 #
 
-    try:
-        float(l[line_start:line_end])  # works for a float or int
-        return True
-    except:
-        return False
+tokens = []
 
 
 class vrmlNode(object):
@@ -323,6 +255,7 @@ class vrmlNode(object):
                  'children',
                  'parent',
                  'array_data',
+                 'array_span',
                  'reference',
                  'lineno',
                  'filename',
@@ -358,6 +291,7 @@ class vrmlNode(object):
         self.PROTO_NAMESPACE = None
 
         self.reference = None
+        self.array_span = None  # span of the file with the numbers of the array, not decoded yet
 
         if node_type == NODE_REFERENCE:
             # For references, only the parent and ID are needed
@@ -720,6 +654,16 @@ class vrmlNode(object):
             print('\tvalue "%s" could not be used as a string for field "%s"' % (f[0], field))
             return default
 
+    def getArrayData(self):
+        """
+        Data of an array node, numbers kept as a span of the file are decoded on first use
+        """
+        if self.array_span is not None:
+            self.array_data = vrmlArrayDecode(self.array_span)
+            self.array_span = None
+
+        return self.array_data
+
     def getFieldAsArray(self, field, group, ancestry):
         """
         For this parser arrays are children
@@ -756,10 +700,13 @@ class vrmlNode(object):
         elif type(child_array) == list:
             # x3d creates these
             array_data = array_as_number(child_array)
+        elif type(child_array) == array:
+            # x3d arrays, decoded from the attribute
+            array_data = child_array
         else:
             # print(child_array)
             # Normal vrml
-            array_data = child_array.array_data
+            array_data = child_array.getArrayData()
 
         # print('array_data', array_data)
         if group == -1 or len(array_data) == 0:
@@ -767,10 +714,11 @@ class vrmlNode(object):
 
         # We want a flat list
         flat = True
-        for item in array_data:
-            if type(item) == list:
-                flat = False
-                break
+        if type(array_data) != array:
+            for item in array_data:
+                if type(item) == list:
+                    flat = False
+                    break
 
         # make a flat array
         if flat:
@@ -791,17 +739,11 @@ class vrmlNode(object):
         if group == 0:
             return flat_array
 
-        new_array = []
-        sub_array = []
+        tot = len(flat_array) - (len(flat_array) % group)
+        new_array = [flat_array[i:i + group] for i in range(0, tot, group)]
 
-        for item in flat_array:
-            sub_array.append(item)
-            if len(sub_array) == group:
-                new_array.append(sub_array)
-                sub_array = []
-
-        if sub_array:
-            print('\twarning, array was not aligned to requested grouping', group, 'remaining value', sub_array)
+        if tot != len(flat_array):
+            print('\twarning, array was not aligned to requested grouping', group, 'remaining value', flat_array[tot:])
 
         return new_array
 
@@ -878,7 +820,7 @@ class vrmlNode(object):
             text += ind + 'PROTO_FIELD:\n'
             text += ind + str(item) + '\n'
 
-        text += ind + 'ARRAY: ' + str(len(self.array_data)) + ' ' + str(self.array_data) + '\n'
+        text += ind + 'ARRAY: ' + str(len(self.getArrayData())) + ' ' + str(self.getArrayData()) + '\n'
         #text += ind + 'ARRAY: ' + str(len(self.array_data)) + '[...] \n'
 
         text += ind + 'CHILDREN: ' + str(len(self.children)) + '\n'
@@ -916,6 +858,8 @@ class vrmlNode(object):
 
                 for ff in f:
                     for f_split in ff.split('"'):
+                        if not f_split.strip():
+                            continue
                         # print(f_split)
                         # "someextern.vrml#SomeID"
                         if '#' in f_split:
@@ -966,21 +910,14 @@ class vrmlNode(object):
                             # Tricky - inline another VRML
                             print('\tLoading Inline:"%s"...' % url)
 
-                            # Watch it! - backup lines
-                            lines_old = lines[:]
-
-                            lines[:] = vrmlFormat(data)
+                            # Watch it! - backup tokens
+                            tokens_old = tokens[:]
 
-                            lines.insert(0, '{')
-                            lines.insert(0, 'root_node____')
-                            lines.append('}')
-                            '''
-                            ff = open('/tmp/test.txt', 'w')
-                            ff.writelines([l+'\n' for l in lines])
-                            '''
+                            tokens[:] = vrmlRootTokens(data)
 
                             child = vrmlNode(self, NODE_NORMAL, -1)
                             child.setRoot(url)  # initialized dicts
+                            child.id = ('root_node____',)
                             child.parse(0)
 
                             # if self.getExternprotoName():
@@ -1004,40 +941,17 @@ class vrmlNode(object):
                                     else:
                                         print("\tEXTERNPROTO ID not found!:", extern_key)
 
-                            # Watch it! - restore lines
-                            lines[:] = lines_old
+                            # Watch it! - restore tokens
+                            tokens[:] = tokens_old
 
         return new_i
 
     def __parse(self, i, IS_PROTO_DATA=False):
-        '''
-        print('parsing at', i, end="")
-        print(i, self.id, self.lineno)
-        '''
-        l = lines[i]
-
-        if l == '[':
-            # An anonymous list
-            self.id = None
-            i += 1
-        else:
-            words = []
-
-            node_type, new_i = is_nodeline(i, words)
-            if not node_type:  # fail for parsing new node.
-                print("Failed to parse new node")
-                raise ValueError
-
-            if self.node_type == NODE_REFERENCE:
-                # Only assign the reference and quit
-                key = words[words.index('USE') + 1]
-                self.id = (words[0],)
-
-                self.reference = self.getDefDict()[key]
-                return new_i
-
-            self.id = tuple(words)
-
+        """
+        Parse the node opened at tokens[i] ({, [ or an array of numbers),
+        its id (the words before the bracket) is set by the parent.
+        """
+        if self.id:
             # fill in DEF/USE
             key = self.getDefName()
             if key != None:
@@ -1052,14 +966,19 @@ class vrmlNode(object):
                 proto_dict[key] = self
 
                 # Parse the proto nodes fields
-                self.proto_node = vrmlNode(self, NODE_ARRAY, new_i)
-                new_i = self.proto_node.parse(new_i)
+                self.proto_node = vrmlNode(self, NODE_ARRAY, tokens[i][2])
+                i = self.proto_node.parse(i)
 
                 self.children.remove(self.proto_node)
 
                 # print(self.proto_node)
 
-                new_i += 1  # skip past the {
+                if self.getExternprotoName():
+                    # only the url follows, "someextern.vrml#SomeID" or a list of them
+                    return self.__parseExternprotoUrl(i)
+
+                if i < len(tokens) and tokens[i][0] == '{':
+                    i += 1  # skip past the {
 
             else:  # If we're a proto instance, add the proto node as our child.
                 spec = self.getSpec()
@@ -1071,149 +990,174 @@ class vrmlNode(object):
 
                 del spec
 
+                if tokens[i][0] == TOKEN_NUMBERS:
+                    self.array_span = tokens[i][1]
+                    return i + 1
+
+                i += 1
+
             del proto_dict, key
 
-            i = new_i
+        elif tokens[i][0] == TOKEN_NUMBERS:
+            # An anonymous list of numbers
+            self.array_span = tokens[i][1]
+            return i + 1
+
+        else:
+            # An anonymous list
+            i += 1
+
+        # words since the last bracket, (text, lineno)
+        words = []
 
-        # print(self.id)
-        ok = True
-        while ok:
-            if i >= len(lines):
-                return len(lines) - 1
+        while i < len(tokens):
+            kind, text, lineno = tokens[i]
+            # print('\tDEBUG:', i, self.node_type, kind, text)
 
-            l = lines[i]
-            # print('\tDEBUG:', i, self.node_type, l)
-            if l == '':
+            if kind in {TOKEN_WORD, TOKEN_STRING, ','}:
+                words.append((text, lineno))
                 i += 1
                 continue
 
-            if l == '}':
+            # a bracket, the words before it are fields and the id of the node it opens
+            if kind in {'{', '[', TOKEN_NUMBERS}:
+                header_len = getNodeHeader(words)
+            else:
+                header_len = 0
+
+            header = words[len(words) - header_len:] if header_len else []
+            self.__parseWords(words[:len(words) - header_len])
+            words = []
+
+            if kind == '}':
                 if self.node_type != NODE_NORMAL:  # also ends proto nodes, we may want a type for these too.
-                    print('wrong node ending, expected an } ' + str(i) + ' ' + str(self.node_type))
+                    print('wrong node ending, expected an } ' + str(lineno) + ' ' + str(self.node_type))
                     if DEBUG:
                         raise ValueError
                 ### print("returning", i)
                 return i + 1
-            if l == ']':
+            if kind == ']':
                 if self.node_type != NODE_ARRAY:
-                    print('wrong node ending, expected a ] ' + str(i) + ' ' + str(self.node_type))
+                    print('wrong node ending, expected a ] ' + str(lineno) + ' ' + str(self.node_type))
                     if DEBUG:
                         raise ValueError
                 ### print("returning", i)
                 return i + 1
 
-            node_type, new_i = is_nodeline(i, [])
-            if node_type:  # check text\n{
-                child = vrmlNode(self, node_type, i)
-                i = child.parse(i)
+            header_words = tuple([word for word, word_lineno in header])
 
-            elif l == '[':  # some files have these anonymous lists
-                child = vrmlNode(self, NODE_ARRAY, i)
-                i = child.parse(i)
+            if 'USE' in header_words:
+                self.__parseWords(header)
 
-            elif is_numline(i):
-                l_split = l.split(',')
+                if kind == '{' and i + 1 < len(tokens) and tokens[i + 1][0] == '}':
+                    # USE sometimes has {} after it anyway
+                    i += 2
+                    continue
 
-                values = None
-                # See if each item is a float?
+                header_words = ()
 
-                for num_type in (int, float):
-                    try:
-                        values = [num_type(v) for v in l_split]
-                        break
-                    except:
-                        pass
+            if header_words and header_words[0] == 'PROTO':
+                node_type = NODE_NORMAL
+            elif header_words and header_words[0] == 'EXTERNPROTO':
+                node_type = NODE_ARRAY
+            elif kind == '{':
+                node_type = NODE_NORMAL
+            else:  # some files have anonymous lists
+                node_type = NODE_ARRAY
 
-                    try:
-                        values = [[num_type(v) for v in segment.split()] for segment in l_split]
-                        break
-                    except:
-                        pass
+            child = vrmlNode(self, node_type, header[0][1] if header else lineno)
+            child.id = header_words or None
+            i = child.parse(i)
 
-                if values is None:  # dont parse
-                    values = l_split
+        return len(tokens) - 1
 
-                # This should not extend over multiple lines however it is possible
-                # print(self.array_data)
-                if values:
-                    self.array_data.extend(values)
+    def __parseExternprotoUrl(self, i):
+        url = []
+        if i < len(tokens) and tokens[i][0] == TOKEN_STRING:
+            url.append(tokens[i][1])
+            i += 1
+        elif i < len(tokens) and tokens[i][0] == '[':
+            i += 1
+            while i < len(tokens) and tokens[i][0] != ']':
+                if tokens[i][0] == TOKEN_STRING:
+                    url.append(tokens[i][1])
                 i += 1
+            i += 1
+
+        if url:
+            self.fields.append(url)
+
+        return i
+
+    def __parseWords(self, words):
+        """
+        Fields, references and numbers, words are (text, lineno) pairs.
+        Fields have no end so each line is parsed on its own.
+        """
+        start = 0
+        while start < len(words):
+            lineno = words[start][1]
+            end = start + 1
+            while end < len(words) and words[end][1] == lineno:
+                end += 1
+
+            self.__parseLine([text for text, text_lineno in words[start:end]], lineno)
+            start = end
+
+    def __parseLine(self, l, lineno):
+        if is_numword(l[0]) or (l[0] == ',' and len(l) > 1 and is_numword(l[1])):
+            values = [v for v in l if v != ',']
+
+            # See if each item is an int or a float?
+            for num_type in (int, float):
+                try:
+                    values = [num_type(v) for v in values]
+                    break
+                except:
+                    pass
+
+            # This should not extend over multiple lines however it is possible
+            self.array_data.extend(values)
+            return
+
+        # 'geometry USE foobar' or 'USE foobar'
+        while 'USE' in l:
+            j = l.index('USE')
+            if j + 1 == len(l):
+                break
+
+            if j and iskey(l[j - 1]):
+                fields = l[:j - 1]
+                ref_id = (l[j - 1],)
             else:
-                words = l.split()
-                if len(words) > 2 and words[1] == 'USE':
-                    vrmlNode(self, NODE_REFERENCE, i)
-                else:
+                fields = l[:j]
+                ref_id = ('USE',)
 
-                    # print("FIELD", i, l)
-                    #
-                    #words = l.split()
-                    ### print('\t\ttag', i)
-                    # this is a tag/
-                    # print(words, i, l)
-                    value = l
-                    # print(i)
-                    # javastrips can exist as values.
-                    quote_count = l.count('"')
-                    if quote_count % 2:  # odd number?
-                        # print('MULTILINE')
-                        while 1:
-                            i += 1
-                            l = lines[i]
-                            quote_count = l.count('"')
-                            if quote_count % 2:  # odd number?
-                                value += '\n' + l[:l.rfind('"')]
-                                break  # assume
-                            else:
-                                value += '\n' + l
-
-                    # use shlex so we get '"a b" "b v"' --> '"a b"', '"b v"'
-                    value_all = shlex.split(value, posix=False)
-
-                    def iskey(k):
-                        if k[0] != '"' and k[0].isalpha() and k.upper() not in {'TRUE', 'FALSE'}:
-                            return True
-                        return False
-
-                    def split_fields(value):
-                        """
-                        key 0.0 otherkey 1,2,3 opt1 opt1 0.0
-                            -> [key 0.0], [otherkey 1,2,3], [opt1 opt1 0.0]
-                        """
-                        field_list = []
-                        field_context = []
-
-                        for j in range(len(value)):
-                            if iskey(value[j]):
-                                if field_context:
-                                    # this IS a key but the previous value was not a key, ot it was a defined field.
-                                    if (not iskey(field_context[-1])) or ((len(field_context) == 3 and field_context[1] == 'IS')):
-                                        field_list.append(field_context)
-
-                                        field_context = [value[j]]
-                                    else:
-                                        # The last item was not a value, multiple keys are needed in some cases.
-                                        field_context.append(value[j])
-                                else:
-                                    # Is empty, just add this on
-                                    field_context.append(value[j])
-                            else:
-                                # Add a value to the list
-                                field_context.append(value[j])
+            if fields:
+                self.__parseFields(fields)
 
-                        if field_context:
-                            field_list.append(field_context)
+            child = vrmlNode(self, NODE_REFERENCE, lineno)
+            child.id = ref_id
+            try:
+                child.reference = self.getDefDict()[l[j + 1]]
+            except KeyError:
+                print('\tWarning: reference', l[j + 1], 'not found')
+                self.children.remove(child)
 
-                        return field_list
+            l = l[j + 2:]
 
-                    for value in split_fields(value_all):
-                        # Split
+        if l:
+            self.__parseFields(l)
 
-                        if value[0] == 'field':
-                            # field SFFloat creaseAngle 4
-                            self.proto_field_defs.append(value)
-                        else:
-                            self.fields.append(value)
-                i += 1
+    def __parseFields(self, l):
+        for value in split_fields(l):
+            # Split
+
+            if value[0] == 'field':
+                # field SFFloat creaseAngle 4
+                self.proto_field_defs.append(value)
+            else:
+                self.fields.append(value)
 
 
 def gzipOpen(path):
@@ -1236,6 +1180,43 @@ def gzipOpen(path):
     return data
 
 
+def gzipOpenStream(path):
+    """
+    Binary file object of path, decompressed while it's read when the file is gzipped.
+    """
+    import gzip
+
+    try:
+        filehandle = open(path, 'rb')
+    except:
+        return None
+
+    if filehandle.read(2) == b'\x1f\x8b':
+        filehandle.close()
+        return gzip.open(path, 'rb')
+
+    filehandle.seek(0)
+    return filehandle
+
+
+def vrmlRootTokens(data):
+    """
+    Tokens of a VRML file as the body of a root node, from the { of the root node.
+    """
+    if type(data) == bytes:
+        data = data.decode('utf-8', 'replace')
+
+    if data.startswith('\ufeff'):
+        data = data[1:]
+
+    root_tokens = vrmlTokenize(data)
+    # Trick to make sure we get all root nodes.
+    root_tokens.insert(0, ('{', '{', 0))
+    root_tokens.append(('}', '}', 0))
+
+    return root_tokens
+
+
 def vrml_parse(path):
     """
     Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
@@ -1246,36 +1227,22 @@ def vrml_parse(path):
     if data is None:
         return None, 'Failed to open file: ' + path
 
-    # Stripped above
-    lines[:] = vrmlFormat(data)
+    tokens[:] = vrmlRootTokens(data)
+    del data
 
-    lines.insert(0, '{')
-    lines.insert(0, 'dymmy_node')
-    lines.append('}')
-    # Use for testing our parsed output, so we can check on line numbers.
-
-    '''
-    ff = open('/tmp/test.txt', 'w')
-    ff.writelines([l+'\n' for l in lines])
-    ff.close()
-    '''
-
-    # Now evaluate it
-    node_type, new_i = is_nodeline(0, [])
-    if not node_type:
+    if not [token for token in tokens if token[0] in {'{', '['}][1:]:
         return None, 'Error: VRML file has no starting Node'
 
-    # Trick to make sure we get all root nodes.
-    lines.insert(0, '{')
-    lines.insert(0, 'root_node____')  # important the name starts with an ascii char
-    lines.append('}')
-
     root = vrmlNode(None, NODE_NORMAL, -1)
     root.setRoot(path)  # we need to set the root so we have a namespace and know the path in case of inlineing
+    root.id = ('root_node____',)  # important the name starts with an ascii char
 
     # Parse recursively
     root.parse(0)
 
+    # Only the nodes keep a reference to the file data, for the arrays not decoded yet.
+    tokens[:] = []
+
     # This prints a load of text
     if DEBUG:
         print(root)
@@ -1287,6 +1254,32 @@ def vrml_parse(path):
 
 # ====================== X3d Support
 
+class x3dAttribute(object):
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class x3dElement(object):
+    """
+    Tag and attributes of an XML element, all x3dNode needs from the file,
+    with the minidom names x3dNode uses.
+    """
+    __slots__ = ('tagName', 'attributes')
+
+    def __init__(self, tagName, attributes):
+        self.tagName = tagName
+        self.attributes = attributes
+
+    def getAttributeNode(self, name):
+        value = self.attributes.get(name)
+        if value is None:
+            return None
+        return x3dAttribute(name, value)
+
+
 # Sane as vrml but replace the parser
 class x3dNode(vrmlNode):
     def __init__(self, parent, node_type, x3dNode):
@@ -1294,6 +1287,10 @@ class x3dNode(vrmlNode):
         self.x3dNode = x3dNode
 
     def parse(self, IS_PROTO_DATA=False):
+        """
+        DEF and USE of the node, children are added by x3d_parse() as they are read.
+        Returns False for references, their children are ignored.
+        """
         # print(self.x3dNode.tagName)
 
         define = self.x3dNode.getAttributeNode('DEF')
@@ -1309,22 +1306,12 @@ class x3dNode(vrmlNode):
                     print('\tWarning: reference', use.value, 'not found')
                     self.parent.children.remove(self)
 
-                return
-
-        for x3dChildNode in self.x3dNode.childNodes:
-            if x3dChildNode.nodeType in {x3dChildNode.TEXT_NODE, x3dChildNode.COMMENT_NODE, x3dChildNode.CDATA_SECTION_NODE}:
-                continue
-
-            node_type = NODE_NORMAL
-            # print(x3dChildNode, dir(x3dChildNode))
-            if x3dChildNode.getAttributeNode('USE'):
-                node_type = NODE_REFERENCE
-
-            child = x3dNode(self, node_type, x3dChildNode)
-            child.parse()
+                return False
 
         # TODO - x3d Inline
 
+        return True
+
     def getSpec(self):
         return self.x3dNode.tagName  # should match vrml spec
 
@@ -1337,13 +1324,18 @@ class x3dNode(vrmlNode):
     # Other funcs operate from vrml, but this means we can wrap XML fields, still use nice utility funcs
     # getFieldAsArray getFieldAsBool etc
     def getFieldName(self, field, ancestry, AS_CHILD=False, SPLIT_COMMAS=False):
-        # ancestry and AS_CHILD are ignored, only used for VRML now
+        # ancestry is ignored, only used for VRML now
+        # AS_CHILD is only used by getFieldAsArray(), the array is decoded from the attribute
 
         self_real = self.getRealNode()  # in case we're an instance
         field_xml = self.x3dNode.getAttributeNode(field)
         if field_xml:
             value = field_xml.value
 
+            if AS_CHILD:
+                # the text is the only copy kept of large arrays such as coordIndex
+                return vrmlArrayDecode((value, 0, len(value)))
+
             # We may want to edit. for x3d specific stuff
             # Sucks a bit to return the field name in the list but vrml excepts this :/
             if SPLIT_COMMAS:
@@ -1353,41 +1345,106 @@ class x3dNode(vrmlNode):
             return None
 
 
+# bytes read at once, more while a large attribute is being read
+X3D_READ_SIZE = 1 << 20
+
+
+class x3dParseTarget(object):
+    """
+    Builds the x3dNode tree from the events of the XML parser
+    (the target of xml.etree.ElementTree.XMLParser), XML elements are never built.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = None
+        self.nodes = []  # x3dNode of the open elements, None when they're not part of the tree (outside X3D or inside a USE)
+        self.events = 0
+
+    def start(self, tag, attrib):
+        self.events += 1
+
+        if tag[0] == '{':
+            tag = tag[tag.index('}') + 1:]  # namespaced document
+
+        parent = self.nodes[-1] if self.nodes else None
+        node = None
+
+        if parent is not None:
+            if attrib.get('USE') is not None:
+                node_type = NODE_REFERENCE
+            else:
+                node_type = NODE_NORMAL
+
+            node = x3dNode(parent, node_type, x3dElement(tag, attrib))
+            if not node.parse():
+                node = None
+
+        elif self.root is None and tag == 'X3D':
+            node = self.root = x3dNode(None, NODE_NORMAL, x3dElement(tag, attrib))
+            self.root.setRoot(self.path)  # so images and Inline's we load have a relative path
+
+        self.nodes.append(node)
+
+    def end(self, tag):
+        self.events += 1
+        self.nodes.pop()
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.root
+
+
 def x3d_parse(path):
     """
     Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
     Return root (x3dNode, '') or (None, 'Error String')
+
+    The file is read in chunks, only the x3dNode tree and the attributes of the
+    elements are kept, numbers are decoded from the attributes when requested.
     """
 
     try:
-        import xml.dom.minidom
+        from xml.etree.ElementTree import XMLParser
     except:
-        return None, 'Error, import XML parsing module (xml.dom.minidom) failed, install python'
-
-    '''
-    try:    doc = xml.dom.minidom.parse(path)
-    except: return None, 'Could not parse this X3D file, XML error'
-    '''
+        return None, 'Error, import XML parsing module (xml.etree.ElementTree) failed, install python'
 
     # Could add a try/except here, but a console error is more useful.
-    data = gzipOpen(path)
+    filehandle = gzipOpenStream(path)
 
-    if data is None:
+    if filehandle is None:
         return None, 'Failed to open file: ' + path
 
-    doc = xml.dom.minidom.parseString(data)
+    target = x3dParseTarget(path)
+    parser = XMLParser(target=target)
 
-    try:
-        x3dnode = doc.getElementsByTagName('X3D')[0]
-    except:
+    size = X3D_READ_SIZE
+    while True:
+        data = filehandle.read(size)
+        if not data:
+            break
+
+        events = target.events
+        parser.feed(data)
+
+        # expat reads an unfinished attribute again with each chunk, read larger chunks until it ends
+        if target.events == events:
+            size *= 2
+        else:
+            size = X3D_READ_SIZE
+
+    del data
+    filehandle.close()
+
+    root = parser.close()
+
+    if root is None:
         return None, 'Not a valid x3d document, cannot import'
 
     bpy.ops.object.select_all(action='DESELECT')
 
-    root = x3dNode(None, NODE_NORMAL, x3dnode)
-    root.setRoot(path)  # so images and Inline's we load have a relative path
-    root.parse()
-
     return root, ''
 
 ## f = open('/_Cylinder.wrl', 'r')
@@ -1554,7 +1611,11 @@ def importMesh_IndexedFaceSet(geom, bpyima, ancestry):
     coord = geom.getChildBySpec('Coordinate')  # works for x3d and vrml
 
     if coord:
-        ifs_points = coord.getFieldAsArray('point', 3, ancestry)
+        # flat, x, y, z for each point
+        ifs_points = coord.getFieldAsArray('point', 0, ancestry)
+        if len(ifs_points) % 3:
+            print('\twarning, points are not aligned to 3, remaining value', ifs_points[-(len(ifs_points) % 3):])
+            ifs_points = ifs_points[:len(ifs_points) - (len(ifs_points) % 3)]
     else:
         coord = []
 
@@ -1660,8 +1721,8 @@ def importMesh_IndexedFaceSet(geom, bpyima, ancestry):
     bpymesh = bpy.data.meshes.new(name="XXX")
 
     # EEKADOODLE
-    bpymesh.vertices.add(1 + (len(ifs_points)))
-    bpymesh.vertices.foreach_set("co", [0, 0, 0] + [a for v in ifs_points for a in v])  # XXX25 speed
+    bpymesh.vertices.add(1 + (len(ifs_points) // 3))
+    bpymesh.vertices.foreach_set("co", array('f', [0.0, 0.0, 0.0]) + array('f', ifs_points))
 
     # print(len(ifs_points), faces, edges, ngons)
 
@@ -1716,23 +1777,8 @@ def importMesh_IndexedFaceSet(geom, bpyima, ancestry):
 
         # Note, S,T == U,V
         # U gets longest, V gets second longest
-        xmin, ymin, zmin = ifs_points[0]
-        xmax, ymax, zmax = ifs_points[0]
-        for co in ifs_points:
-            x, y, z = co
-            if x < xmin:
-                xmin = x
-            if y < ymin:
-                ymin = y
-            if z < zmin:
-                zmin = z
-
-            if x > xmax:
-                xmax = x
-            if y > ymax:
-                ymax = y
-            if z > zmax:
-                zmax = z
+        xmin, ymin, zmin = min(ifs_points[0::3]), min(ifs_points[1::3]), min(ifs_points[2::3])
+        xmax, ymax, zmax = max(ifs_points[0::3]), max(ifs_points[1::3]), max(ifs_points[2::3])
 
         xlen = xmax - xmin
         ylen = ymax - ymin
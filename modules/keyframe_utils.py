@@ -0,0 +1,253 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+    keyframe_utils.py
+
+    Keyframe reduction of sampled animation channels, for exporters.
+
+    A channel is a sequence of values, one per sampled frame (a list or an
+    array.array). Reducers return the indices of the keys to keep, the first
+    and last keys are always kept. They take an optional *keys* argument, the
+    indices kept by a previous reducer, so reducers can be chained:
+
+        keys = reduce_constant_runs(values, 0.0001)
+        keys = reduce_linear(values, 0.0001, keys)
+
+    Run this file to benchmark the reducers on long mocap like takes.
+"""
+
+REDUCE_METHODS = ('CONSTANT', 'LINEAR', 'RDP')
+
+
+def _removable(values, tolerance, left, key, right):
+    # is the key (by index) on the line between its neighbours?
+    value = values[key]
+    value_left = values[left]
+    value_right = values[right]
+
+    # co-linear horizontal...
+    if abs(value - value_left) < tolerance and abs(value - value_right) < tolerance:
+        return True
+
+    fac = (right - key) / (right - left)
+    return abs((value_left * fac + value_right * (1.0 - fac)) - value) < tolerance
+
+
+def reduce_constant_runs(values, tolerance, keys=None):
+    """ Collapses runs of keys within *tolerance* of the first key of the run,
+    only the first and last key of each run are kept. Linear time.
+    """
+    if keys is None:
+        keys = range(len(values))
+
+    if len(keys) < 3:
+        return list(keys)
+
+    kept = [keys[0]]
+    run_value = values[keys[0]]
+    run_last = keys[0]  # last key of the current run, not kept yet
+
+    for key in keys[1:]:
+        value = values[key]
+        if abs(value - run_value) < tolerance:
+            run_last = key
+        else:
+            if run_last != kept[-1]:
+                kept.append(run_last)
+            kept.append(key)
+            run_value = value
+            run_last = key
+
+    if run_last != kept[-1]:
+        kept.append(run_last)
+
+    return kept
+
+
+def reduce_linear(values, tolerance, keys=None):
+    """ Removes the keys within *tolerance* of the line between their neighbours.
+
+    Keys are tested from the last to the first one, against the previous key
+    and the next kept key, when a key is removed the next kept key is tested
+    again with its new neighbour. Each key is removed at most once so this
+    runs in linear time.
+    """
+    if keys is None:
+        keys = range(len(values))
+
+    if len(keys) < 3:
+        return list(keys)
+
+    # kept keys, from the last one
+    kept = [keys[-1]]
+
+    right = keys[-1]
+    value_right = values[right]
+
+    for j in range(len(keys) - 2, 0, -1):
+        left = keys[j - 1]
+        key = keys[j]
+        value = values[key]
+        value_left = values[left]
+
+        # inline _removable(), for speed
+        if abs(value - value_left) < tolerance and abs(value - value_right) < tolerance:
+            removable = True
+        else:
+            fac = (right - key) / (right - left)
+            removable = abs((value_left * fac + value_right * (1.0 - fac)) - value) < tolerance
+
+        if removable:
+            # the next kept key has a new neighbour
+            while len(kept) > 1 and _removable(values, tolerance, left, kept[-1], kept[-2]):
+                kept.pop()
+        else:
+            kept.append(key)
+
+        right = kept[-1]
+        value_right = values[right]
+
+    kept.append(keys[0])
+    kept.reverse()
+
+    return kept
+
+
+def reduce_rdp(values, tolerance, keys=None):
+    """ Ramer-Douglas-Peucker reduction, keeps the keys further than *tolerance*
+    (in value) from the line between the kept keys around them.
+
+    Near linear time on typical curves, quadratic on degenerate ones.
+    """
+    if keys is None:
+        keys = range(len(values))
+
+    if len(keys) < 3:
+        return list(keys)
+
+    keep = [False] * len(keys)
+    keep[0] = keep[-1] = True
+
+    # spans to split, as positions in keys
+    spans = [(0, len(keys) - 1)]
+
+    while spans:
+        first, last = spans.pop()
+
+        key_first = keys[first]
+        key_last = keys[last]
+        value_first = values[key_first]
+        slope = (values[key_last] - value_first) / (key_last - key_first)
+
+        error_max = tolerance
+        split = -1
+        for i in range(first + 1, last):
+            key = keys[i]
+            error = abs(value_first + slope * (key - key_first) - values[key])
+            if error >= error_max:
+                error_max = error
+                split = i
+
+        if split != -1:
+            keep[split] = True
+            if split - first > 1:
+                spans.append((first, split))
+            if last - split > 1:
+                spans.append((split, last))
+
+    return [key for key, is_kept in zip(keys, keep) if is_kept]
+
+
+def reduce_keys(values, tolerance, method='LINEAR'):
+    """ Indices of the keys of the channel *values* to keep, *method* is one of REDUCE_METHODS.
+    Runs of constant keys are collapsed first, by all methods.
+    """
+    keys = reduce_constant_runs(values, tolerance)
+
+    if method == 'LINEAR':
+        keys = reduce_linear(values, tolerance, keys)
+    elif method == 'RDP':
+        keys = reduce_rdp(values, tolerance, keys)
+    elif method != 'CONSTANT':
+        raise ValueError("invalid keyframe reduction method: %r" % method)
+
+    return keys
+
+
+def _reduce_linear_list(values, tolerance):
+    # the previous reduction of the FBX exporter, deleting keys from a list, for the benchmark
+    keys = [(value, j) for j, value in enumerate(values)]
+
+    j = len(keys) - 2
+    while j > 0 and len(keys) > 2:
+        if abs(keys[j][0] - keys[j - 1][0]) < tolerance and abs(keys[j][0] - keys[j + 1][0]) < tolerance:
+            del keys[j]
+        else:
+            fac = (keys[j + 1][1] - keys[j][1]) / float(keys[j + 1][1] - keys[j - 1][1])
+            if abs((keys[j - 1][0] * fac + keys[j + 1][0] * (1.0 - fac)) - keys[j][0]) < tolerance:
+                del keys[j]
+            else:
+                j -= 1
+
+        if j > len(keys) - 2:
+            j = len(keys) - 2
+
+    return [j for value, j in keys]
+
+
+def benchmark(frames=10000, channels=60, tolerance=0.0001):
+    import time
+    import random
+    from array import array
+
+    random.seed(0)
+
+    # mocap like channels: piecewise linear motion and holds, with noise under the tolerance
+    takes = []
+    for c in range(channels):
+        values = array('d')
+        value = random.uniform(-90.0, 90.0)
+        step = 0.0
+        span = 0
+        for frame in range(frames):
+            if not span:
+                span = random.randint(5, 400)
+                step = 0.0 if random.random() < 0.3 else random.uniform(-0.5, 0.5)
+            span -= 1
+            value += step
+            values.append(value + random.uniform(-0.2, 0.2) * tolerance)
+        takes.append(values)
+
+    def run(name, reduce):
+        t = time.time()
+        tot = sum(len(reduce(values)) for values in takes)
+        print("%-24s %8.3f sec  %8i keys (of %i)" % (name, time.time() - t, tot, frames * channels))
+
+    print("%i channels of %i frames, tolerance %g" % (channels, frames, tolerance))
+    run("list deletion (old)", lambda values: _reduce_linear_list(values, tolerance))
+    run("constant runs", lambda values: reduce_keys(values, tolerance, 'CONSTANT'))
+    run("linear", lambda values: reduce_linear(values, tolerance))
+    run("constant runs + linear", lambda values: reduce_keys(values, tolerance, 'LINEAR'))
+    run("constant runs + rdp", lambda values: reduce_keys(values, tolerance, 'RDP'))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -30,34 +30,57 @@ bl_info = {
     "category": "Render"}
 
 
+try:
+    import bpy
+except ImportError:
+    bpy = None # outside of Blender, only the master modules are loaded (see loadtest.py)
+
 # To support reload properly, try to access a package var, if it's there, reload everything
 if "init_data" in locals():
     import imp
     imp.reload(model)
-    imp.reload(operators)
-    imp.reload(client)
-    imp.reload(slave)
     imp.reload(master)
     imp.reload(master_html)
     imp.reload(utils)
     imp.reload(balancing)
-    imp.reload(ui)
-    imp.reload(repath)
-    imp.reload(versioning)
-    imp.reload(baking)
+    imp.reload(scheduling)
+    imp.reload(journal)
+    imp.reload(logs)
+    imp.reload(metrics)
+    imp.reload(cache)
+    imp.reload(transfer)
+    imp.reload(worker)
+
+    if bpy:
+        imp.reload(operators)
+        imp.reload(client)
+        imp.reload(slave)
+        imp.reload(ui)
+        imp.reload(repath)
+        imp.reload(versioning)
+        imp.reload(baking)
 else:
     from netrender import model
-    from netrender import operators
-    from netrender import client
-    from netrender import slave
     from netrender import master
     from netrender import master_html
     from netrender import utils
     from netrender import balancing
-    from netrender import ui
-    from netrender import repath
-    from netrender import versioning
-    from netrender import baking
+    from netrender import scheduling
+    from netrender import journal
+    from netrender import logs
+    from netrender import metrics
+    from netrender import cache
+    from netrender import transfer
+    from netrender import worker
+
+    if bpy:
+        from netrender import operators
+        from netrender import client
+        from netrender import slave
+        from netrender import ui
+        from netrender import repath
+        from netrender import versioning
+        from netrender import baking
 
 jobs = []
 slaves = []
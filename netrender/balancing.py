@@ -16,12 +16,22 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
-import time
+import time, math
 
 from netrender.utils import *
 import netrender.model
 
+# Job fields rules can depend on, see Balancer.jobChanged
+#   usage, priority, category, status: the job attributes
+#   frames: status of the frames (counts, dispatched slaves)
+#   slaves: number of jobs and slaves on the master
+#   time: current time, refreshed at each tick of the master (see updateUsage)
+JOB_FIELDS = {"usage", "priority", "category", "status", "frames", "slaves", "time"}
+
 class RatingRule:
+    depends = JOB_FIELDS
+    usage_scaled = False # rating proportional to the usage of the jobs
+
     def __init__(self):
         self.enabled = True
         self.editable = False
@@ -32,7 +42,20 @@ class RatingRule:
     def rate(self, job):
         return 0
 
+    def jobChanged(self, job, fields):
+        # return the other jobs whose rating it changes (True for all of them)
+        return ()
+
+    def invalidate(self):
+        pass
+
+    def usageScaled(self, factor):
+        # usage of all jobs multiplied by factor, only called for rules with usage_scaled
+        self.invalidate()
+
 class ExclusionRule:
+    depends = JOB_FIELDS
+
     def __init__(self):
         self.enabled = True
         self.editable = True
@@ -43,6 +66,8 @@ class ExclusionRule:
         return False
 
 class PriorityRule:
+    depends = JOB_FIELDS
+
     def __init__(self):
         self.enabled = True
         self.editable = True
@@ -52,11 +77,28 @@ class PriorityRule:
     def test(self, job):
         return False
 
+class ChunkingRule:
+    def __init__(self):
+        self.enabled = True
+        self.editable = True
+    def id(self):
+        return str(id(self))
+
+    def chunkSize(self, job, slave):
+        return job.chunks
+
 class Balancer:
     def __init__(self):
         self.rules = []
         self.priorities = []
         self.exceptions = []
+        self.chunking = []
+
+        # incremental mode: sort keys are cached per job and only recomputed
+        # when a field a rule depends on changes
+        self.incremental = True
+        self.keys = {}
+        self.generation = 0 # incremented when all keys are invalidated
 
     def ruleByID(self, rule_id):
         for rule in self.rules:
@@ -68,6 +110,9 @@ class Balancer:
         for rule in self.exceptions:
             if rule.id() == rule_id:
                 return rule
+        for rule in self.chunking:
+            if rule.id() == rule_id:
+                return rule
 
         return None
 
@@ -80,6 +125,9 @@ class Balancer:
     def addException(self, exception):
         self.exceptions.append(exception)
 
+    def addChunking(self, chunking):
+        self.chunking.append(chunking)
+
     def applyRules(self, job):
         return sum((rule.rate(job) for rule in self.rules if rule.enabled))
 
@@ -97,11 +145,112 @@ class Balancer:
 
         return False
 
-    def sortKey(self, job):
+    def chunkSize(self, job, slave):
+        # number of frames to dispatch, the first enabled chunking rule decides
+        for chunking in self.chunking:
+            if chunking.enabled:
+                return chunking.chunkSize(job, slave)
+
+        return job.chunks
+
+    def dependencies(self):
+        fields = set()
+        for rule in self.rules + self.priorities + self.exceptions:
+            if rule.enabled:
+                fields.update(rule.depends)
+
+        return fields
+
+    def jobChanged(self, job, fields):
+        # forget the key of a job after some of its fields changed,
+        # return the jobs whose rank may have changed (the job and the ones rated with it)
+        if not self.incremental:
+            return (job,)
+
+        if fields.isdisjoint(self.dependencies()):
+            return ()
+
+        self.keys.pop(job.id, None)
+        changed = [job]
+
+        for rule in self.rules:
+            if rule.enabled:
+                others = rule.jobChanged(job, fields)
+
+                if others is True:
+                    self.invalidate()
+                    break
+
+                for other in others:
+                    self.keys.pop(other.id, None)
+                    changed.append(other)
+
+        return changed
+
+    def globalChanged(self, fields, jobs = ()):
+        # fields shared by all jobs changed (number of jobs or slaves, time), return the jobs whose key changed.
+        # Priorities and exceptions are tested again on the cached keys of jobs, ratings depending
+        # on these fields invalidate all the keys.
+        if not self.incremental or fields.isdisjoint(self.dependencies()):
+            return ()
+
+        if any((rule.enabled and not fields.isdisjoint(rule.depends) for rule in self.rules)):
+            self.invalidate()
+            return ()
+
+        changed = []
+        for job in jobs:
+            key = self.keys.get(job.id)
+
+            if key is not None:
+                new_key = (1 if self.applyExceptions(job) else 0, 0 if self.applyPriorities(job) else 1) + key[2:]
+
+                if new_key != key:
+                    self.keys[job.id] = new_key
+                    changed.append(job)
+
+        return changed
+
+    def invalidate(self):
+        self.keys = {}
+        self.generation += 1
+
+        for rule in self.rules:
+            rule.invalidate()
+
+    def usageScaled(self, factor):
+        # usage of all jobs multiplied by factor, the order of the jobs doesn't change
+        # when all ratings are proportional to the usage: the cached keys are scaled.
+        # Returns False when the keys were invalidated instead.
+        if not self.incremental or not all((rule.usage_scaled for rule in self.rules if rule.enabled)):
+            self.invalidate()
+            return False
+
+        self.keys = {job_id: key[:-1] + (key[-1] * factor,) for job_id, key in self.keys.items()}
+
+        for rule in self.rules:
+            if rule.enabled:
+                rule.usageScaled(factor)
+
+        return True
+
+    def computeSortKey(self, job):
         return (1 if self.applyExceptions(job) else 0, # exceptions after
                         0 if self.applyPriorities(job) else 1, # priorities first
                         self.applyRules(job))
 
+    def sortKey(self, job):
+        if not self.incremental:
+            # no cached data at all, rules like usage per category are recomputed too
+            self.invalidate()
+            return self.computeSortKey(job)
+
+        key = self.keys.get(job.id)
+        if key is None:
+            key = self.keys[job.id] = self.computeSortKey(job)
+
+        return key
+
     def balance(self, jobs):
         if jobs:
             # use inline copy to make sure the list is still accessible while sorting
@@ -113,6 +262,9 @@ class Balancer:
 # ==========================
 
 class RatingUsage(RatingRule):
+    depends = {"usage", "priority"}
+    usage_scaled = True
+
     def __str__(self):
         return "Usage per job"
 
@@ -128,16 +280,45 @@ class RatingUsage(RatingRule):
 	  }
 
 class RatingUsageByCategory(RatingRule):
+    depends = {"usage", "priority", "category"}
+    usage_scaled = True
+
     def __init__(self, get_jobs):
         super().__init__()
         self.getJobs = get_jobs
+        self.totals = None # category -> (total usage, maximum priority)
 
     def __str__(self):
         return "Usage per category"
 
+    def jobChanged(self, job, fields):
+        if fields.isdisjoint(self.depends):
+            return ()
+
+        # the totals of the category change for all its jobs
+        self.invalidate()
+        return [other for other in self.getJobs() if other.category == job.category and other is not job]
+
+    def invalidate(self):
+        self.totals = None
+
+    def usageScaled(self, factor):
+        if self.totals is not None:
+            self.totals = {category: (usage * factor, priority) for category, (usage, priority) in self.totals.items()}
+
+    def categoryTotals(self):
+        if self.totals is None:
+            totals = {}
+            for j in self.getJobs():
+                usage, priority = totals.get(j.category, (0.0, j.priority))
+                totals[j.category] = (usage + j.usage, max(priority, j.priority))
+
+            self.totals = totals
+
+        return self.totals
+
     def rate(self, job):
-        total_category_usage = sum([j.usage for j in self.getJobs() if j.category == job.category])
-        maximum_priority = max([j.priority for j in self.getJobs() if j.category == job.category])
+        total_category_usage, maximum_priority = self.categoryTotals()[job.category]
 
         # less usage is better
         return total_category_usage / maximum_priority
@@ -153,6 +334,8 @@ class RatingUsageByCategory(RatingRule):
 
 
 class NewJobPriority(PriorityRule):
+    depends = {"frames"}
+
     def __init__(self, limit = 1):
         super().__init__()
         self.limit = limit
@@ -179,6 +362,8 @@ class NewJobPriority(PriorityRule):
 	  }
 
 class MinimumTimeBetweenDispatchPriority(PriorityRule):
+    depends = {"frames", "time"}
+
     def __init__(self, limit = 10):
         super().__init__()
         self.limit = limit
@@ -207,6 +392,8 @@ class MinimumTimeBetweenDispatchPriority(PriorityRule):
 	  }
 
 class ExcludeQueuedEmptyJob(ExclusionRule):
+    depends = {"status", "frames"}
+
     def __init__(self):
         super().__init__()
         self.editable= False
@@ -227,6 +414,8 @@ class ExcludeQueuedEmptyJob(ExclusionRule):
 	  }
 
 class ExcludeSlavesLimit(ExclusionRule):
+    depends = {"frames", "slaves"}
+
     def __init__(self, count_jobs, count_slaves, limit = 0.75):
         super().__init__()
         self.count_jobs = count_jobs
@@ -254,3 +443,42 @@ class ExcludeSlavesLimit(ExclusionRule):
                  "limit_str":self.str_limit(),
                  "id":self.id()
 	  }
+
+class AdaptiveChunking(ChunkingRule):
+    def __init__(self, count_slaves, limit = 180):
+        super().__init__()
+        self.enabled = False # fixed chunks of the job settings by default
+        self.count_slaves = count_slaves
+        self.limit = limit
+
+    def setLimit(self, value):
+        self.limit = float(value)
+
+    def str_limit(self):
+        return "about %.0f second%s per dispatch" % (self.limit, "s" if self.limit != 1 else "")
+
+    def __str__(self):
+        return "Adapt chunks to the measured frame times"
+
+    def chunkSize(self, job, slave):
+        # frames rendered by the slave in the target time, measured from the frames already done
+        if job.frame_time > 0:
+            count = max(int(self.limit * slave.speed / job.frame_time), 1)
+        else:
+            count = job.chunks
+
+        # near the end of the job, split the remaining frames between the slaves working on it
+        slaves = min(job.countSlaves() + 1, max(self.count_slaves(), 1))
+        tail = math.ceil(job.countFrames(status = netrender.model.FRAME_QUEUED) / slaves)
+
+        return max(min(count, tail), 1)
+
+    def serialize(self):
+        return { "type": "chunking",
+                 "enabled": self.enabled,
+                 "editable": self.editable,
+                 "descritpiton":str(self),
+                 "limit": self.limit,
+                 "limit_str":self.str_limit(),
+                 "id":self.id()
+	  }
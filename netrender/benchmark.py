@@ -0,0 +1,245 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Benchmarks of the master, run from blender:
+#
+#   blender -b -P netrender/benchmark.py -- balancing [jobs] [slaves] [requests]
+#   blender -b -P netrender/benchmark.py -- chunking [jobs] [slaves] [target]
+#
+# The master is simulated in process, slaves poll for jobs and complete the
+# frames of their previous dispatch, usage is updated every 'tick' requests
+# like the 2 seconds update of runMaster.
+#
+# The chunking benchmark renders jobs on a simulated clock, with slaves of
+# different speeds and jobs of different frame times, to compare fixed and
+# adaptive chunk sizes.
+
+import sys, time, random, tempfile, shutil, heapq
+
+import netrender.model
+import netrender.master
+
+def createMaster(path):
+    # port 0, the server socket is never used by the simulation
+    return netrender.master.RenderMasterServer(("127.0.0.1", 0), netrender.master.RenderHandler, path, subdir=False)
+
+def createJobs(httpd, job_count, seed = 0):
+    rand = random.Random(seed)
+
+    for i in range(job_count):
+        info = netrender.model.RenderJob()
+        info.name = "job %i" % i
+        info.category = "category %i" % rand.randint(0, 9)
+        info.priority = rand.randint(1, 5)
+        info.chunks = rand.randint(1, 5)
+        info.tags = {netrender.model.TAG_RENDER} if rand.random() < 0.2 else set()
+
+        for frame_number in range(1, rand.randint(20, 200)):
+            info.addFrame(frame_number)
+
+        job = netrender.master.MRenderJob(httpd.nextJobID(), info)
+        for frame in info.frames:
+            job.addFrame(frame.number, frame.command)
+
+        httpd.addJob(job)
+        job.start()
+
+def createSlaves(httpd, slave_count, seed = 0):
+    rand = random.Random(seed)
+    slaves = []
+
+    for i in range(slave_count):
+        info = netrender.model.RenderSlave()
+        info.name = "slave %i" % i
+        info.address = ("127.0.0.1", i)
+        info.tags = set(netrender.model.TAG_ALL) if rand.random() < 0.5 else set()
+
+        slaves.append(httpd.getSlave(httpd.addSlave(info)))
+
+    return slaves
+
+def completeFrames(slave, rand):
+    job = slave.job
+
+    for frame_number in slave.job_frames[:]:
+        frame = job[frame_number]
+        frame.time = rand.random()
+        frame.status = netrender.model.FRAME_DONE if rand.random() < 0.98 else netrender.model.FRAME_ERROR
+        slave.finishedFrame(frame_number, job)
+
+    job.testFinished()
+
+def dispatch(httpd, slave):
+    # same as the GET /job handler
+    job, frames = httpd.newDispatch(slave)
+
+    if job and frames:
+        for f in frames:
+            f.slave = slave
+            f.status = netrender.model.FRAME_DISPATCHED
+
+        slave.dispatch(job, frames)
+    else:
+        slave.dispatch(None, [])
+
+def benchmarkBalancing(job_count = 5000, slave_count = 500, requests = 5000, incremental = True, tick = 500, seed = 0):
+    path = tempfile.mkdtemp()
+
+    try:
+        httpd = createMaster(path)
+        httpd.balancer.incremental = incremental
+
+        createJobs(httpd, job_count, seed)
+        slaves = createSlaves(httpd, slave_count, seed)
+
+        rand = random.Random(seed)
+        timings = []
+
+        start = time.time()
+        for i in range(requests):
+            slave = slaves[i % slave_count]
+
+            if slave.job:
+                completeFrames(slave, rand)
+
+            t = time.time()
+            dispatch(httpd, slave)
+            timings.append(time.time() - t)
+
+            if i % tick == tick - 1:
+                httpd.updateUsage()
+
+        total = time.time() - start
+
+        httpd.server_close()
+    finally:
+        shutil.rmtree(path)
+
+    timings.sort()
+
+    return {
+            "mode": "incremental" if incremental else "full sort",
+            "jobs": job_count,
+            "slaves": slave_count,
+            "requests": requests,
+            "total": total,
+            "requests_per_second": requests / total if total else 0.0,
+            "dispatch_median": timings[len(timings) // 2],
+            "dispatch_max": timings[-1],
+            }
+
+DISPATCH_OVERHEAD = 5.0 # seconds to start rendering a dispatch on a slave
+POLL_DELAY = 1.0 # seconds between job requests of idle slaves
+
+def benchmarkChunking(job_count = 20, slave_count = 50, adaptive = True, target = 180, seed = 0):
+    path = tempfile.mkdtemp()
+
+    try:
+        httpd = createMaster(path)
+
+        for chunking in httpd.balancer.chunking:
+            chunking.enabled = adaptive
+            chunking.limit = target
+
+        createJobs(httpd, job_count, seed)
+        slaves = createSlaves(httpd, slave_count, seed)
+
+        rand = random.Random(seed)
+        job_frame_times = {job.id: rand.uniform(1, 120) for job in httpd.jobs}
+        slave_speeds = {slave.id: rand.uniform(0.5, 2.0) for slave in slaves}
+
+        events = [(0.0, i) for i in range(slave_count)] # (time of the next job request, slave index)
+        frame_times = {} # time of the frames of the current dispatch of each slave
+        requests = 0
+        render_time = 0.0
+        end = 0.0
+
+        while events:
+            t, i = heapq.heappop(events)
+            slave = slaves[i]
+
+            if slave.job:
+                job = slave.job
+                avg_t = sum(frame_times[i]) / len(frame_times[i])
+
+                for frame_number in slave.job_frames[:]:
+                    frame = job[frame_number]
+                    frame.time = avg_t
+                    frame.status = netrender.model.FRAME_DONE
+                    job.updateFrameTime(slave, avg_t)
+                    slave.finishedFrame(frame_number, job)
+
+                job.testFinished()
+
+            dispatch(httpd, slave)
+            requests += 1
+
+            if slave.job:
+                base_time = job_frame_times[slave.job.id] / slave_speeds[slave.id]
+                frame_times[i] = [base_time * rand.uniform(0.8, 1.2) for frame_number in slave.job_frames]
+                duration = DISPATCH_OVERHEAD + sum(frame_times[i])
+
+                render_time += sum(frame_times[i])
+                end = max(end, t + duration)
+                heapq.heappush(events, (t + duration, i))
+            elif any((job.countFrames(status = netrender.model.FRAME_QUEUED) for job in httpd.jobs)):
+                heapq.heappush(events, (t + POLL_DELAY, i))
+
+        httpd.server_close()
+    finally:
+        shutil.rmtree(path)
+
+    return {
+            "mode": "adaptive" if adaptive else "fixed",
+            "jobs": job_count,
+            "slaves": slave_count,
+            "requests": requests,
+            "makespan": end,
+            "utilisation": render_time / (end * slave_count) if end else 0.0,
+            }
+
+def printChunkingResult(result):
+    print("%(mode)s chunks: %(jobs)i jobs, %(slaves)i slaves, %(requests)i requests, rendered in %(makespan).0fs, %(utilisation).1f%% of slave time rendering" % dict(result, utilisation = result["utilisation"] * 100))
+
+def printResult(result):
+    print("%(mode)s: %(jobs)i jobs, %(slaves)i slaves, %(requests)i requests in %(total).2fs, %(requests_per_second).1f requests/s" % result)
+    print("    dispatch median %.3fms, max %.3fms" % (result["dispatch_median"] * 1000, result["dispatch_max"] * 1000))
+
+if __name__ == "__main__":
+    try:
+        start = sys.argv.index("--") + 1
+    except ValueError:
+        start = len(sys.argv)
+
+    action, *args = sys.argv[start:] or ["balancing"]
+
+    if action == "balancing":
+        job_count = int(args[0]) if len(args) > 0 else 5000
+        slave_count = int(args[1]) if len(args) > 1 else 500
+        requests = int(args[2]) if len(args) > 2 else 5000
+
+        printResult(benchmarkBalancing(job_count, slave_count, requests, incremental = True))
+        # the full sort is quadratic in the number of jobs, only sample a few requests
+        printResult(benchmarkBalancing(job_count, slave_count, max(requests // 500, 2), incremental = False))
+    elif action == "chunking":
+        job_count = int(args[0]) if len(args) > 0 else 20
+        slave_count = int(args[1]) if len(args) > 1 else 50
+        target = float(args[2]) if len(args) > 2 else 180
+
+        printChunkingResult(benchmarkChunking(job_count, slave_count, adaptive = False))
+        printChunkingResult(benchmarkChunking(job_count, slave_count, adaptive = True, target = target))
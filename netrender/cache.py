@@ -0,0 +1,174 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Content addressed cache of job files, shared by the slaves of a node
+#
+# Files downloaded from the master are stored once under their signature and
+# hard linked (or symlinked, or copied when links aren't supported) into the
+# job directories. The modification time of a cached file is its last use,
+# the least recently used files are removed when the cache grows over its
+# size limit. Slaves running on the same node and using the same path share
+# the cache, changes are done while holding a lock file.
+
+import os, shutil, time
+
+from netrender.utils import *
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# cached files used more recently than that are never evicted, jobs can be
+# using them through symlinks
+EVICT_MIN_AGE = 600 # seconds
+
+class CacheLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except (IOError, OSError):
+                    pass # LK_LOCK gives up after 10 seconds, keep waiting
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+        self.file.close()
+        self.file = None
+
+def linkFile(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError, NotImplementedError):
+        try:
+            os.symlink(source, destination)
+        except (OSError, AttributeError, NotImplementedError):
+            shutil.copyfile(source, destination)
+
+class AssetCache:
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size # in bytes, 0 for no limit
+
+        # statistics of this slave, reported to the master
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        verifyCreateDir(self.path)
+        self.lock_path = os.path.join(self.path, "cache.lock")
+
+    def lock(self):
+        return CacheLock(self.lock_path)
+
+    def filePath(self, signature):
+        return os.path.join(self.path, signature)
+
+    def fetch(self, signature, destination):
+        # link the cached file with that signature to destination, return True on a hit
+        cached_path = self.filePath(signature)
+
+        with self.lock():
+            if not os.path.exists(cached_path):
+                self.misses += 1
+                return False
+
+            linkFile(cached_path, destination)
+            os.utime(cached_path, None) # mark as used
+
+            self.hits += 1
+            self.bytes_saved += os.path.getsize(cached_path)
+
+        return True
+
+    def store(self, signature, temp_path, destination):
+        # move a downloaded file in the cache and link it to destination
+        if hashFile(temp_path) != signature:
+            # don't cache broken downloads
+            print("Signature mismatch for downloaded file", destination)
+            os.renames(temp_path, destination)
+            return
+
+        cached_path = self.filePath(signature)
+
+        with self.lock():
+            if os.path.exists(cached_path):
+                # stored by another slave in the meantime
+                os.remove(temp_path)
+            else:
+                shutil.move(temp_path, cached_path)
+
+            linkFile(cached_path, destination)
+            os.utime(cached_path, None)
+
+            self.evict()
+
+    def evict(self):
+        # remove the least recently used files until the cache fits, called with the lock held
+        if not self.max_size:
+            return
+
+        files = []
+        total = 0
+        for name in os.listdir(self.path):
+            filepath = os.path.join(self.path, name)
+            if filepath == self.lock_path:
+                continue
+
+            stat = os.stat(filepath)
+            files.append((stat.st_mtime, stat.st_size, filepath))
+            total += stat.st_size
+
+        files.sort()
+
+        limit = time.time() - EVICT_MIN_AGE
+        for mtime, size, filepath in files:
+            if total <= self.max_size or mtime > limit:
+                break
+
+            os.remove(filepath)
+            total -= size
+
+    def statsHeaders(self):
+        return {
+                "cache-hits": str(self.hits),
+                "cache-misses": str(self.misses),
+                "cache-bytes-saved": str(self.bytes_saved)
+                }
@@ -223,6 +223,8 @@ def sendJobBaking(conn, scene, can_save = True):
     processObjectDependencies(pointCacheFunc, fluidFunc, multiresFunc)
 
     fillCommonJobSettings(job, job_name, netsettings)
+
+    job.signFiles()
     
     job.tags.add(netrender.model.TAG_BAKING)
     job.subtype = netrender.model.JOB_SUB_BAKING
@@ -319,6 +321,8 @@ def sendJobBlender(conn, scene, anim = False, can_save = True):
     #print(job.files)
 
     fillCommonJobSettings(job, job_name, netsettings)
+
+    job.signFiles()
     
     job.tags.add(netrender.model.TAG_RENDER)
 
@@ -371,7 +375,14 @@ class NetworkRenderEngine(bpy.types.RenderEngine):
 
         address = "" if netsettings.server_address == "[default]" else netsettings.server_address
 
-        master.runMaster(address = (address, netsettings.server_port), 
+        if netsettings.use_master_async:
+            # needs python 3.5 or later, only imported when used
+            import netrender.master_async
+            run_master = netrender.master_async.runMaster
+        else:
+            run_master = master.runMaster
+
+        run_master(address = (address, netsettings.server_port), 
                          broadcast = netsettings.use_master_broadcast,
                          clear = netsettings.use_master_clear,
                          force = netsettings.use_master_force_upload,
@@ -0,0 +1,345 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Journaled state of the master
+#
+# Jobs, frames and slaves that changed are marked during a request and their
+# current state is appended to the journal (one json record per line) when
+# the request is done. Every SNAPSHOT_RECORDS records, the whole state is
+# written to a snapshot and the journal is started over. Recovering is loading
+# the snapshot and replaying the journal records in order, each record
+# replacing the state of its object.
+#
+# Job usage is only saved with the other changes of a job and in snapshots.
+
+import os, json, time, threading
+
+from netrender.utils import *
+import netrender.model
+
+SNAPSHOT_RECORDS = 50000
+SYNC_DELAY = 1 # seconds between fsync of the journal
+
+JOURNAL_NAME = "blender_master.journal"
+SNAPSHOT_NAME = "blender_master.snapshot"
+
+def frameRecord(frame):
+    return {
+            "number": frame.number,
+            "status": frame.status,
+            "time": frame.time,
+            "slave_id": frame.slave.id if frame.slave else None,
+            "results": frame.results,
+            "log_path": frame.log_path
+            }
+
+def jobStateRecord(job):
+    return {
+            "id": job.id,
+            "status": job.status,
+            "transitions": job.transitions,
+            "priority": job.priority,
+            "chunks": job.chunks,
+            "usage": job.usage,
+            "blacklist": job.blacklist,
+            "last_dispatched": job.last_dispatched,
+            "resolution": job.resolution,
+            "finish_time": job.finish_time,
+            "files": [(rfile.filepath, rfile.found) for rfile in job.files]
+            }
+
+def jobRecord(job):
+    data = job.serialize()
+
+    # frames are restored from their own records, slaves from their id
+    data["frames"] = [frameRecord(frame) for frame in job.frames]
+    data["commands"] = [frame.command for frame in job.frames]
+    data["save_path"] = job.save_path
+    data["start_time"] = job.start_time
+    data["state"] = jobStateRecord(job)
+
+    return data
+
+def slaveRecord(slave):
+    # frames dispatched to the slave are restored from the frame records
+    return slave.serialize()
+
+class MasterJournal:
+    def __init__(self, path):
+        self.journal_path = os.path.join(path, JOURNAL_NAME)
+        self.snapshot_path = os.path.join(path, SNAPSHOT_NAME)
+
+        self.lock = threading.RLock()
+        self.file = None
+        self.generation = 0
+        self.records = 0
+        self.last_sync = 0
+
+        # objects changed since the last flush, in order
+        self.pending = []
+        self.pending_keys = set()
+
+    def exists(self):
+        # a snapshot is written when the journal is started
+        return os.path.exists(self.snapshot_path)
+
+    def open(self, generation):
+        self.generation = generation
+        self.file = open(self.journal_path, "w", encoding="utf8")
+        self.write(["generation", generation])
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def write(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write("\n")
+        self.records += 1
+
+    def touch(self, key, record_function, *args):
+        with self.lock:
+            if key not in self.pending_keys:
+                self.pending_keys.add(key)
+                self.pending.append((record_function, args))
+
+    def touchJob(self, job):
+        self.touch(("job_state", job.id), lambda job: ["job_state", jobStateRecord(job)], job)
+
+    def touchFrame(self, job, frame):
+        self.touch(("frame", job.id, frame.number), lambda job, frame: ["frame", job.id, frameRecord(frame)], job, frame)
+
+    def addSlave(self, slave):
+        self.touch(("slave", slave.id), lambda slave: ["slave", slaveRecord(slave)], slave)
+
+    def addJob(self, job):
+        self.touch(("job", job.id), lambda job: ["job", jobRecord(job)], job)
+
+    def removeJob(self, job):
+        job_id = job.id
+        self.touch(("job_remove", job_id), lambda: ["job_remove", job_id])
+
+    def removeSlave(self, slave):
+        slave_id = slave.id
+        self.touch(("slave_remove", slave_id), lambda: ["slave_remove", slave_id])
+
+    def flush(self, httpd):
+        with self.lock:
+            if not self.pending:
+                return
+
+            pending = self.pending
+            self.pending = []
+            self.pending_keys = set()
+
+            for record_function, args in pending:
+                self.write(record_function(*args))
+
+            self.file.flush()
+
+            if time.time() - self.last_sync > SYNC_DELAY:
+                os.fsync(self.file.fileno())
+                self.last_sync = time.time()
+
+            if self.records > SNAPSHOT_RECORDS:
+                self.snapshot(httpd)
+
+    def snapshot(self, httpd):
+        # write the whole state and start a new journal
+        with self.lock:
+            generation = self.generation + 1
+
+            data = {
+                    "generation": generation,
+                    "path": httpd.path,
+                    "jobs": [jobRecord(job) for job in httpd.jobs],
+                    "slaves": [slaveRecord(slave) for slave in httpd.slaves]
+                    }
+
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, "w", encoding="utf8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            replaceFile(temp_path, self.snapshot_path)
+
+            # pending changes are in the snapshot
+            self.pending = []
+            self.pending_keys = set()
+
+            self.close()
+            self.records = 0
+            self.open(generation)
+
+    def clear(self):
+        self.close()
+
+        for filepath in (self.journal_path, self.snapshot_path):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def read(self):
+        # returns (path, generation, jobs data, slaves data) from the snapshot and journal
+        path = None
+        generation = 0
+        jobs = {}
+        slaves = {}
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf8") as f:
+                data = json.load(f)
+
+            path = data["path"]
+            generation = data["generation"]
+            jobs = dict(((job_data["id"], job_data) for job_data in data["jobs"]))
+            slaves = dict(((slave_data["id"], slave_data) for slave_data in data["slaves"]))
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf8") as f:
+                lines = f.readlines()
+
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break # last record cut by a crash
+
+            # journal written before the last snapshot
+            if records and records[0] == ["generation", generation]:
+                frame_indices = {} # job id -> {frame number: index in the frames data}
+                for record in records[1:]:
+                    self.replay(record, jobs, slaves, frame_indices)
+
+        return path, generation, jobs, slaves
+
+    def replay(self, record, jobs, slaves, frame_indices):
+        kind = record[0]
+
+        if kind == "job":
+            jobs[record[1]["id"]] = record[1]
+            frame_indices.pop(record[1]["id"], None)
+        elif kind == "job_remove":
+            jobs.pop(record[1], None)
+            frame_indices.pop(record[1], None)
+        elif kind == "job_state":
+            job_data = jobs.get(record[1]["id"])
+            if job_data:
+                job_data["state"] = record[1]
+        elif kind == "frame":
+            job_data = jobs.get(record[1])
+            if job_data:
+                frame_data = record[2]
+
+                # built once per job, a scan per record is too slow on big journals
+                indices = frame_indices.get(record[1])
+                if indices is None:
+                    indices = dict(((old_data["number"], i) for i, old_data in enumerate(job_data["frames"])))
+                    frame_indices[record[1]] = indices
+
+                i = indices.get(frame_data["number"])
+                if i is not None:
+                    job_data["frames"][i] = frame_data
+        elif kind == "slave":
+            slaves[record[1]["id"]] = record[1]
+        elif kind == "slave_remove":
+            slaves.pop(record[1], None)
+
+def restoreSlave(data):
+    import netrender.master
+
+    slave = netrender.master.MRenderSlave(netrender.model.RenderSlave.materialize(data, cache = False))
+    del netrender.model.RenderSlave._slave_map[slave.id]
+
+    # the id was computed from the original address
+    slave.id = data["id"]
+    slave.address = tuple(data["address"])
+    netrender.model.RenderSlave._slave_map[slave.id] = slave
+
+    return slave
+
+def restoreJob(data, slaves_map):
+    import netrender.master
+
+    frames_data = data["frames"]
+
+    # materialize only needs the frame numbers, they are restored after
+    data = dict(data)
+    data["frames"] = [netrender.model.RenderFrame(frame_data["number"]).serialize() for frame_data in frames_data]
+    info = netrender.model.RenderJob.materialize(data)
+
+    job = netrender.master.MRenderJob(data["id"], info)
+
+    for rfile, file_data in zip(job.files, data["files"]):
+        rfile.original_path = file_data["original_path"]
+        rfile.force = file_data["force"]
+
+    for frame_data, command in zip(frames_data, data["commands"]):
+        frame = job.addFrame(frame_data["number"], command)
+        frame.slave = slaves_map.get(frame_data["slave_id"])
+        frame.status = frame_data["status"]
+        frame.time = frame_data["time"]
+        frame.results = frame_data["results"]
+        frame.log_path = frame_data["log_path"]
+
+    state = data["state"]
+    job.status = state["status"]
+    job.transitions = [tuple(transition) for transition in state["transitions"]]
+    job.priority = state["priority"]
+    job.chunks = state["chunks"]
+    job.usage = state["usage"]
+    job.blacklist = state["blacklist"]
+    job.last_dispatched = state["last_dispatched"]
+    job.resolution = tuple(state["resolution"]) if state["resolution"] else None
+    job.finish_time = state["finish_time"]
+    job.start_time = data["start_time"]
+    job.save_path = data["save_path"]
+
+    for rfile, (filepath, found) in zip(job.files, state["files"]):
+        rfile.filepath = filepath
+        rfile.found = found
+
+    return job
+
+def recover(journal):
+    # returns (path, jobs, slaves) to restore into a RenderMasterServer
+    path, generation, jobs_data, slaves_data = journal.read()
+    journal.generation = generation
+
+    # slaves are seen when recovering, they get the whole timeout to reconnect
+    slaves = [restoreSlave(data) for data in slaves_data.values()]
+    slaves_map = dict(((slave.id, slave) for slave in slaves))
+
+    jobs = [restoreJob(data, slaves_map) for data in jobs_data.values()]
+    jobs.sort(key = lambda job: int(job.id))
+
+    for job in jobs:
+        for frame in job.frames:
+            if frame.status == netrender.model.FRAME_DISPATCHED and frame.slave:
+                slave = frame.slave
+
+                if slave.job is None or slave.job is job:
+                    slave.job = job
+                    slave.job_frames.append(frame.number)
+                else:
+                    slave.uploading.append((job, frame.number))
+
+    return path, jobs, slaves
@@ -0,0 +1,417 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Load test of the master, runs without Blender from the addons directory:
+#
+#   python -m netrender.loadtest [--slaves 200] [--clients 10] [--duration 30] ...
+#
+# A RenderMasterServer is run in process and driven over HTTP by simulated
+# slaves (register, request jobs, download the main file, announce and send
+# logs, poll the job status, upload fake EXR results after a fake render time)
+# and clients (submit jobs, poll the job list and the web interface).
+#
+# Reports the latency of each request type (percentiles), the requests served
+# per second, the memory growth of the process and the time spent in
+# newDispatch and in the balancer. Failed requests (connection errors and 5xx
+# responses) are counted by request type, and exceptions raised in the master
+# are reported with their traceback.
+
+import sys, os, time, json, random, tempfile, shutil, threading, argparse, traceback
+import http, http.client
+
+try:
+    import resource
+except ImportError:
+    resource = None # not on Windows, memory isn't measured
+
+from netrender.utils import *
+import netrender.model
+import netrender.master
+
+TICK = 2 # seconds between slave timeouts and usage updates, as in runMaster
+RESOLUTION = [1920, 1080, 100] # file info of the main file, read by Blender on a real master
+
+def percentile(values, fraction):
+    # values must be sorted
+    if not values:
+        return 0.0
+
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def maxMemory():
+    # peak resident memory of the process in bytes
+    if not resource:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+class Timings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {} # name -> list of durations
+        self.errors = {} # name -> failed requests
+
+    def add(self, name, duration):
+        with self.lock:
+            self.samples.setdefault(name, []).append(duration)
+
+    def error(self, name):
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def count(self):
+        with self.lock:
+            return sum((len(samples) for samples in self.samples.values()))
+
+    def timed(self, name, function):
+        # function measured each time it's called
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.time() - start)
+
+        return call
+
+    def report(self):
+        report = {}
+
+        with self.lock:
+            for name, samples in self.samples.items():
+                samples = sorted(samples)
+                report[name] = {
+                                "count": len(samples),
+                                "total": sum(samples),
+                                "p50": percentile(samples, 0.5),
+                                "p90": percentile(samples, 0.9),
+                                "p99": percentile(samples, 0.99),
+                                "max": samples[-1],
+                                "errors": self.errors.get(name, 0),
+                                }
+
+            for name, errors in self.errors.items():
+                if name not in report:
+                    report[name] = {"count": 0, "total": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0, "errors": errors}
+
+        return report
+
+class MasterErrors:
+    # exceptions raised by the request handlers, which the server prints to the discarded stderr
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {} # last line of the traceback -> count
+        self.tracebacks = {} # last line of the traceback -> first traceback
+
+    def handle_error(self, request, client_address):
+        # replaces the handle_error method of the server
+        text = traceback.format_exc()
+        key = text.strip().splitlines()[-1]
+
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.tracebacks.setdefault(key, text)
+
+    def report(self):
+        with self.lock:
+            return [{"error": key, "count": count, "traceback": self.tracebacks[key]} for key, count in sorted(self.counts.items())]
+
+class SimulatedClient:
+    def __init__(self, address, timings, stop):
+        self.conn = http.client.HTTPConnection(address[0], address[1], timeout = 30)
+        self.timings = timings
+        self.stop = stop
+
+    def request(self, name, method, url, body = None, headers = {}):
+        # returns (status, response headers, data), status None on connection errors
+        start = time.time()
+
+        try:
+            self.conn.request(method, url, body, headers = headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (IOError, OSError, http.client.HTTPException):
+            self.timings.error(name)
+            self.conn.close()
+            return None, None, None
+
+        self.timings.add(name, time.time() - start)
+
+        if response.status >= 500:
+            self.timings.error(name)
+
+        return response.status, response, data
+
+class SimulatedSlave(SimulatedClient):
+    def __init__(self, index, address, timings, stop, options, payload):
+        super().__init__(address, timings, stop)
+        self.index = index
+        self.options = options
+        self.payload = payload
+        self.rand = random.Random(options.seed + index)
+        self.files = set() # jobs with their main file downloaded
+
+    def register(self):
+        info = netrender.model.RenderSlave()
+        info.name = "simulated slave %i" % self.index
+        info.stats = "load test"
+
+        while not self.stop.is_set():
+            status, response, data = self.request("POST /slave", "POST", "/slave", json.dumps(info.serialize()))
+
+            if status == http.client.OK:
+                return response.getheader("slave-id")
+
+            self.stop.wait(self.options.poll)
+
+        return None
+
+    def run(self):
+        slave_id = self.register()
+
+        if not slave_id:
+            return
+
+        headers = {"slave-id": slave_id}
+
+        while not self.stop.is_set():
+            status, response, data = self.request("GET /job", "GET", "/job", headers = headers)
+
+            if status == http.client.OK:
+                self.render(slave_id, netrender.model.RenderJob.materialize(json.loads(str(data, encoding='utf8'))))
+            elif status == http.client.NO_CONTENT: # forgotten by the master
+                slave_id = self.register()
+
+                if not slave_id:
+                    return
+
+                headers = {"slave-id": slave_id}
+            else:
+                self.stop.wait(self.options.poll)
+
+    def render(self, slave_id, job):
+        headers = {"slave-id": slave_id}
+        frames = [frame.number for frame in job.frames]
+
+        if job.id not in self.files:
+            self.request("GET /file", "GET", fileURL(job.id, 0), headers = headers)
+            self.files.add(job.id)
+
+        self.request("POST /log", "POST", "/log", bytes(json.dumps(netrender.model.LogFile(job.id, slave_id, frames).serialize()), encoding='utf8'))
+
+        # fake render, sending the log and polling the job status like slaves do
+        render_time = sum((self.options.frame_time * self.rand.uniform(0.5, 1.5) for frame in frames))
+        end = time.time() + render_time
+        log_offset = 0
+
+        while not self.stop.is_set():
+            remaining = end - time.time()
+
+            log = bytes("Fra:%i Mem:1.00M | Time:00:01.00 | Rendering %.2fs remaining\n" % (frames[0], max(remaining, 0)), encoding='utf8')
+            self.request("PUT /log", "PUT", logURL(job.id, frames[0]), log, headers = dict(headers, **{"log-offset": str(log_offset)}))
+            log_offset += len(log)
+
+            if remaining <= 0:
+                break
+
+            self.request("HEAD /status", "HEAD", "/status", headers = {"job-id": job.id, "job-frame": str(frames[0])})
+            self.stop.wait(min(remaining, self.options.poll))
+
+        headers = {"job-id": job.id, "slave-id": slave_id, "job-time": str(render_time / len(frames))}
+
+        for frame_number in frames:
+            headers["job-frame"] = str(frame_number)
+
+            if self.rand.random() < self.options.error_rate:
+                headers["job-result"] = str(netrender.model.FRAME_ERROR)
+                self.request("PUT /render", "PUT", "/render", headers = headers)
+            else:
+                headers["job-result"] = str(netrender.model.FRAME_DONE)
+                self.request("PUT /render", "PUT", "/render", self.payload, headers = headers)
+
+class SimulatedUser(SimulatedClient):
+    def __init__(self, index, address, timings, stop, options, blend_path):
+        super().__init__(address, timings, stop)
+        self.index = index
+        self.options = options
+        self.blend_path = blend_path
+        self.rand = random.Random(options.seed - index - 1)
+
+    def submit(self, number):
+        job = netrender.model.RenderJob()
+        job.name = "client %i job %i" % (self.index, number)
+        job.category = "category %i" % self.rand.randint(0, 9)
+        job.priority = self.rand.randint(1, 5)
+        job.chunks = self.rand.randint(1, 5)
+        job.addFile(self.blend_path, signed=False)
+
+        for frame_number in range(1, self.options.frames + 1):
+            job.addFrame(frame_number)
+
+        self.request("POST /job", "POST", "/job", json.dumps(job.serialize()))
+
+    def run(self):
+        for number in range(self.options.jobs):
+            self.submit(number)
+
+        while not self.stop.is_set():
+            self.request("GET /html/jobs", "GET", "/html/jobs")
+            self.request("GET /html", "GET", "/html")
+            self.request("GET /html/slaves", "GET", "/html/slaves")
+            self.stop.wait(self.options.poll * 5)
+
+def runLoadTest(options):
+    path = tempfile.mkdtemp()
+    stop = threading.Event()
+    timings = Timings()
+    internal = Timings() # master functions, called by the request handlers
+    master_errors = MasterErrors()
+
+    # master output (dispatches, created directories, requests) isn't part of the report
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    # no Blender to read the main file
+    getFileInfo = netrender.master.getFileInfo
+    netrender.master.getFileInfo = lambda filepath, infos: RESOLUTION
+
+    try:
+        httpd = netrender.master.createMaster(("127.0.0.1", 0), True, False, path)
+        httpd.stats = lambda info, stats: None
+        httpd.handle_error = master_errors.handle_error
+        httpd.newDispatch = internal.timed("newDispatch", httpd.newDispatch)
+        httpd.scheduler.balance = internal.timed("scheduler rebuild", httpd.scheduler.balance)
+
+        address = httpd.server_address
+
+        server_thread = threading.Thread(target = httpd.serve_forever, args = (0.5,))
+        server_thread.daemon = True
+        server_thread.start()
+
+        # main file of all jobs, found by the master on its disk
+        blend_path = os.path.join(path, "loadtest.blend")
+        with open(blend_path, "wb") as f:
+            f.write(os.urandom(options.payload))
+
+        payload = os.urandom(options.payload) # fake EXR
+
+        memory_start = maxMemory()
+        start = time.time()
+
+        threads = []
+        for i in range(options.clients):
+            threads.append(threading.Thread(target = SimulatedUser(i, address, timings, stop, options, blend_path).run))
+        for i in range(options.slaves):
+            threads.append(threading.Thread(target = SimulatedSlave(i, address, timings, stop, options, payload).run))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        while time.time() - start < options.duration:
+            time.sleep(TICK)
+            httpd.timeoutSlaves()
+            httpd.updateUsage()
+            httpd.flushJournal()
+
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        total = time.time() - start
+        memory_end = maxMemory()
+
+        # full sort of all jobs, as done for the web interface
+        balance_start = time.time()
+        for i in range(10):
+            httpd.balance()
+        balance_time = (time.time() - balance_start) / 10
+
+        frames_done = sum((job.countFrames(status = netrender.model.FRAME_DONE) for job in httpd.jobs))
+
+        httpd.shutdown()
+        httpd.server_close()
+        httpd.journal.close()
+    finally:
+        netrender.master.getFileInfo = getFileInfo
+        sys.stdout.close()
+        sys.stdout, sys.stderr = stdout, stderr
+        shutil.rmtree(path, ignore_errors = True)
+
+    requests = timings.count()
+
+    return {
+            "slaves": options.slaves,
+            "clients": options.clients,
+            "jobs": options.clients * options.jobs,
+            "duration": total,
+            "requests": requests,
+            "requests_per_second": requests / total if total else 0.0,
+            "errors": sum(timings.errors.values()),
+            "master_errors": master_errors.report(),
+            "frames_done": frames_done,
+            "memory_growth": memory_end - memory_start if memory_start is not None else None,
+            "balance": balance_time,
+            "routes": timings.report(),
+            "master": internal.report(),
+            }
+
+def printTimings(timings):
+    for name, timing in sorted(timings.items()):
+        line = "    %-20s %7i  p50 %8.2fms  p90 %8.2fms  p99 %8.2fms  max %8.2fms" % (name, timing["count"], timing["p50"] * 1000, timing["p90"] * 1000, timing["p99"] * 1000, timing["max"] * 1000)
+
+        if timing["errors"]:
+            line += "  %i errors" % timing["errors"]
+
+        print(line)
+
+def printReport(report):
+    print("%(slaves)i slaves, %(clients)i clients, %(jobs)i jobs for %(duration).1fs" % report)
+    print("%(requests)i requests, %(requests_per_second).1f requests/s, %(errors)i errors, %(frames_done)i frames done" % report)
+
+    if report["memory_growth"] is not None:
+        print("peak memory growth %.1f MB" % (report["memory_growth"] / (1024 * 1024)))
+
+    print("full balance of all jobs %.3fms" % (report["balance"] * 1000))
+    print("requests:")
+    printTimings(report["routes"])
+    print("master:")
+    printTimings(report["master"])
+
+    for error in report["master_errors"]:
+        print("%i exceptions in the master: %s" % (error["count"], error["error"]))
+        print(error["traceback"])
+
+def parseArguments(args):
+    parser = argparse.ArgumentParser(description = "Load test of the netrender master, with simulated slaves and clients")
+    parser.add_argument("--slaves", type = int, default = 200, help = "number of simulated slaves")
+    parser.add_argument("--clients", type = int, default = 10, help = "number of simulated clients")
+    parser.add_argument("--jobs", type = int, default = 5, help = "jobs submitted by each client")
+    parser.add_argument("--frames", type = int, default = 100, help = "frames per job")
+    parser.add_argument("--duration", type = float, default = 30, help = "seconds of load")
+    parser.add_argument("--frame-time", type = float, default = 0.2, help = "mean fake render time of a frame in seconds")
+    parser.add_argument("--poll", type = float, default = 0.5, help = "seconds between log updates and job requests of idle slaves")
+    parser.add_argument("--payload", type = int, default = 256 * 1024, help = "size of the fake results in bytes")
+    parser.add_argument("--error-rate", type = float, default = 0.02, help = "fraction of frames failing")
+    parser.add_argument("--seed", type = int, default = 0)
+
+    return parser.parse_args(args)
+
+if __name__ == "__main__":
+    printReport(runLoadTest(parseArguments(sys.argv[1:])))
@@ -0,0 +1,193 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Render logs on the master
+#
+# Slaves send the new output of a render with its offset in the log (the
+# log-offset header), pieces already received are skipped when a slave sends
+# them again. Only the first LOG_MAX_SIZE bytes of a log are written to disk,
+# the last LOG_TAIL_LINES lines are kept in memory for the web interface and
+# added at the end of the file when the log is closed. Logs are gzip compressed
+# once all their frames are finished.
+#
+# Offsets are in the output of the slave for the current dispatch, other
+# dispatches of the same frames are appended to the same log.
+
+import os, threading, collections, gzip, shutil
+
+LOG_MAX_SIZE = 10 * 1024 * 1024
+LOG_TAIL_LINES = 200
+COPY_CHUNK = 1 << 16
+
+def compressedPath(log_path):
+    return log_path + ".gz"
+
+def readLog(log_path, offset = 0):
+    # content of a log from offset, compressed or not, b"" when there's none
+    if os.path.exists(log_path):
+        f = open(log_path, "rb")
+    elif os.path.exists(compressedPath(log_path)):
+        f = gzip.open(compressedPath(log_path), "rb")
+    else:
+        return bytes()
+
+    with f:
+        if offset:
+            f.seek(offset)
+
+        return f.read()
+
+def tailLines(data, count):
+    lines = data.split(b"\n")
+
+    if lines and not lines[-1]:
+        lines.pop()
+
+    return lines[-count:] if count else []
+
+class MasterLog:
+    def __init__(self, log_path, frames):
+        self.lock = threading.Lock()
+        self.log_path = log_path
+        self.pending = set(frames) # frames still rendering
+
+        # appending to a log already on disk, the log of an earlier dispatch of the same frames
+        self.size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        self.received = 0 # offset of the next piece in the output of the slave
+        self.skipped = 0
+
+        self.tail = collections.deque(maxlen = LOG_TAIL_LINES)
+        self.line = bytes() # last line, not finished yet
+
+    def write(self, data, offset = None):
+        with self.lock:
+            if offset is not None:
+                if offset < self.received:
+                    # sent again after a failed request
+                    data = data[self.received - offset:]
+                else:
+                    # pieces lost, or sent before a master restart
+                    self.received = offset
+
+            if not data:
+                return self.received
+
+            self.received += len(data)
+
+            lines = (self.line + data).split(b"\n")
+            self.line = lines.pop()
+            self.tail.extend(lines)
+
+            written = data[:max(LOG_MAX_SIZE - self.size, 0)]
+
+            if written:
+                with open(self.log_path, "ab") as f:
+                    f.write(written)
+                self.size += len(written)
+
+            self.skipped += len(data) - len(written)
+
+            return self.received
+
+    def tailLines(self, count):
+        with self.lock:
+            lines = list(self.tail) + ([self.line] if self.line else [])
+            return lines[-count:] if count else []
+
+    def frameFinished(self, frame_number):
+        # returns True once all the frames of the log are finished
+        with self.lock:
+            self.pending.discard(frame_number)
+            return not self.pending
+
+    def close(self):
+        with self.lock:
+            if self.skipped:
+                with open(self.log_path, "ab") as f:
+                    f.write(bytes("\n[... %i bytes skipped, last lines of the log follow ...]\n" % self.skipped, encoding='utf8'))
+                    f.write(b"\n".join(list(self.tail) + [self.line]))
+
+            if os.path.exists(self.log_path):
+                # appended as a new gzip member to the log of earlier dispatches
+                with open(self.log_path, "rb") as fsrc, gzip.open(compressedPath(self.log_path), "ab") as fdst:
+                    shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+
+                os.remove(self.log_path)
+
+class LogStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.logs = {} # log path -> MasterLog, logs still written to
+
+    def open(self, log_path, frames):
+        with self.lock:
+            log = self.logs.get(log_path)
+
+            if log:
+                log.pending.update(frames)
+            else:
+                log = self.logs[log_path] = MasterLog(log_path, frames)
+
+            return log
+
+    def get(self, log_path):
+        with self.lock:
+            return self.logs.get(log_path)
+
+    def write(self, log_path, frame_number, data, offset = None):
+        # logs announced before a master restart aren't in memory anymore
+        return self.open(log_path, [frame_number]).write(data, offset)
+
+    def frameFinished(self, log_path, frame_number):
+        log = self.get(log_path)
+
+        if log and log.frameFinished(frame_number):
+            with self.lock:
+                self.logs.pop(log_path, None)
+
+            log.close()
+
+    def close(self, log_path):
+        # no more output expected, whatever frames are still pending
+        with self.lock:
+            log = self.logs.pop(log_path, None)
+
+        if log:
+            log.close()
+
+    def discard(self, log_path):
+        # log removed with its directory
+        with self.lock:
+            self.logs.pop(log_path, None)
+
+    def tail(self, log_path, count):
+        log = self.get(log_path)
+
+        if log:
+            return log.tailLines(count)
+        else:
+            return tailLines(readLog(log_path), count)
+
+    def read(self, log_path, offset = 0):
+        log = self.get(log_path)
+
+        if log:
+            with log.lock:
+                return readLog(log_path, offset)
+
+        return readLog(log_path, offset)
@@ -18,9 +18,11 @@
 
 import sys, os
 import http, http.client, http.server, socket, socketserver
-import shutil, time, hashlib
+import shutil, time, hashlib, heapq
+import urllib.parse
 import pickle
 import zipfile
+import tempfile
 import select # for select.error
 import json
 
@@ -28,34 +30,75 @@ import json
 from netrender.utils import *
 import netrender.model
 import netrender.balancing
+import netrender.scheduling
+import netrender.journal
+import netrender.transfer
+import netrender.logs
+import netrender.metrics
 import netrender.master_html
 import netrender.thumbnail as thumbnail
 
+FRAME_TIME_WEIGHT = 0.2 # weight of the last frame time in the running averages
+RESOLUTION_INFO = ["bpy.context.scene.render.resolution_x", "bpy.context.scene.render.resolution_y", "bpy.context.scene.render.resolution_percentage"]
+
+# Blocking steps of the requests, they only read files and don't touch the master
+# state (master_async runs them off the event loop, see RenderHandler.offload)
+
+def readFiles(tests, info_path):
+    # signatures of the (path, signature) tests, info of info_path when they all match
+    paths = [path for path, signature in tests]
+    signatures = dict(zip(paths, hashFiles(paths)))
+
+    info = None
+    if info_path and all(signatures[path] == signature for path, signature in tests):
+        info = getFileInfo(info_path, RESOLUTION_INFO)
+
+    return signatures, info
+
+def zipFiles(zip_filepath, files):
+    # zip the (path, name) files, written aside first as requests for the same zip can overlap
+    fd, partial_path = tempfile.mkstemp(suffix = ".zip", dir = os.path.dirname(zip_filepath))
+
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w") as zfile:
+            for filepath, filename in files:
+                zfile.write(filepath, filename)
+
+        replaceFile(partial_path, zip_filepath)
+    except:
+        os.remove(partial_path)
+        raise
+
+    return zip_filepath
+
 class MRenderFile(netrender.model.RenderFile):
     def __init__(self, filepath, index, start, end, signature):
         super().__init__(filepath, index, start, end, signature)
         self.found = False
 
-    def updateStatus(self):
+    def updateStatus(self, signature = None):
+        # signature of the file when already hashed (see readFiles)
         self.found = os.path.exists(self.filepath)
         
         if self.found and self.signature != None:
-            found_signature = hashFile(self.filepath)
+            found_signature = signature or hashFile(self.filepath)
             self.found = self.signature == found_signature
             if not self.found:
                 print("Signature mismatch", self.signature, found_signature)
             
         return self.found
 
-    def test(self):
+    def test(self, signature = None):
         # don't check when forcing upload and only until found
         if not self.force and not self.found:
-            self.updateStatus()
+            self.updateStatus(signature)
             
         return self.found
 
 
 class MRenderSlave(netrender.model.RenderSlave):
+    speed = 1.0 # relative to the other slaves on the same jobs, measured from the frame times
+
     def __init__(self, slave_info):
         super().__init__(slave_info)
         self.id = hashlib.md5(bytes(repr(slave_info.name) + repr(slave_info.address), encoding='utf8')).hexdigest()
@@ -64,13 +107,51 @@ class MRenderSlave(netrender.model.RenderSlave):
 
         self.job = None
         self.job_frames = []
+        self.uploading = [] # (job, frame number) of previous dispatches, results still being uploaded
 
         netrender.model.RenderSlave._slave_map[self.id] = self
 
     def seen(self):
         self.last_seen = time.time()
 
-    def finishedFrame(self, frame_number):
+    def updateCacheStats(self, headers):
+        if "cache-hits" in headers:
+            self.cache_hits = int(headers["cache-hits"])
+            self.cache_misses = int(headers["cache-misses"])
+            self.cache_bytes_saved = int(headers["cache-bytes-saved"])
+
+    def updateTransferStats(self, headers):
+        if "transfer-latency" in headers:
+            self.upload_bytes = int(headers["transfer-upload-bytes"])
+            self.upload_time = float(headers["transfer-upload-time"])
+            self.download_bytes = int(headers["transfer-download-bytes"])
+            self.download_time = float(headers["transfer-download-time"])
+            self.transfer_latency = float(headers["transfer-latency"])
+
+    def dispatch(self, job, frames):
+        # slaves upload results in the background, frames of the last dispatch can still be coming
+        if self.job:
+            self.uploading.extend(((self.job, frame_number) for frame_number in self.job_frames))
+
+        self.job = job
+        self.job_frames = [f.number for f in frames]
+
+    def dispatchedFrames(self):
+        # (job, frame number) of all frames not reported by the slave yet
+        return self.uploading + [(self.job, frame_number) for frame_number in self.job_frames]
+
+    def removeJob(self, job):
+        self.uploading = [(uploading_job, frame_number) for uploading_job, frame_number in self.uploading if uploading_job != job]
+
+        if self.job == job:
+            self.job = None
+            self.job_frames = []
+
+    def finishedFrame(self, frame_number, job = None):
+        if job and (job, frame_number) in self.uploading:
+            self.uploading.remove((job, frame_number))
+            return
+
         try:
             self.job_frames.remove(frame_number)
         except ValueError as e:
@@ -80,6 +161,11 @@ class MRenderSlave(netrender.model.RenderSlave):
             self.job = None
 
 class MRenderJob(netrender.model.RenderJob):
+    scheduler = None
+    journal = None
+    logs = None
+    frame_time = 0.0 # running average of the frame times reported by slaves
+
     def __init__(self, job_id, job_info):
         super().__init__(job_info)
         self.id = job_id
@@ -97,20 +183,104 @@ class MRenderJob(netrender.model.RenderJob):
         self.last_update = 0
         self.save_path = ""
         self.files = [MRenderFile(rfile.filepath, rfile.index, rfile.start, rfile.end, rfile.signature) for rfile in job_info.files]
-        
+
+        self.reindex()
+
+    def __getstate__(self):
+        # the scheduler, journal and logs are set again when restoring the master
+        state = self.__dict__.copy()
+        state.pop("scheduler", None)
+        state.pop("journal", None)
+        state.pop("logs", None)
+        return state
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        old_status = self._status
+        netrender.model.RenderJob.status.fset(self, value)
+
+        if self.scheduler and old_status != value:
+            self.scheduler.jobStatusChanged(self, old_status, value)
+
+        self.stateChanged()
+
+    def stateChanged(self):
+        if self.journal:
+            self.journal.touchJob(self)
+
+    def reindex(self):
+        # frame indexes, kept up to date by the frames on status changes
+        self.frames_map = {}
+        self.frame_counts = dict.fromkeys(netrender.model.FRAME_STATUS_TEXT, 0)
+        self.queued = [] # heap of the indices of queued frames, can contain stale ones
+        self.queued_set = set()
+        self.slave_counts = {} # slave -> number of frames dispatched to it
+
+        for index, frame in enumerate(self.frames):
+            frame.index = index
+            frame.job = self
+            self.frames_map[frame.number] = frame
+            self.frameStatusChanged(frame, None, frame.status)
+
+    def frameStatusChanged(self, frame, old_status, new_status):
+        if self.scheduler:
+            # the frame indexes are used by dispatches in other threads
+            with self.scheduler.lock:
+                self.indexFrame(frame, old_status, new_status)
+        else:
+            self.indexFrame(frame, old_status, new_status)
+
+    def indexFrame(self, frame, old_status, new_status):
+        if old_status is not None:
+            self.frame_counts[old_status] -= 1
+        self.frame_counts[new_status] += 1
+
+        if old_status == netrender.model.FRAME_DISPATCHED:
+            count = self.slave_counts.get(frame.slave, 0) - 1
+            if count > 0:
+                self.slave_counts[frame.slave] = count
+            else:
+                self.slave_counts.pop(frame.slave, None)
+        elif new_status == netrender.model.FRAME_DISPATCHED:
+            self.slave_counts[frame.slave] = self.slave_counts.get(frame.slave, 0) + 1
+
+        if new_status == netrender.model.FRAME_QUEUED and frame.index not in self.queued_set:
+            self.queued_set.add(frame.index)
+            heapq.heappush(self.queued, frame.index)
+
+        if self.scheduler:
+            self.scheduler.jobChanged(self, {"frames"})
+
+        if self.journal:
+            self.journal.touchFrame(self, frame)
+
+    def countFrames(self, status=netrender.model.FRAME_QUEUED):
+        return self.frame_counts[status]
+
+    def countSlaves(self):
+        return len(self.slave_counts)
+
+    def framesStatus(self):
+        return dict(self.frame_counts)
+
+    def __contains__(self, frame_number):
+        return frame_number in self.frames_map
+
+    def __getitem__(self, frame_number):
+        return self.frames_map.get(frame_number)
+
     def setForceUpload(self, force):
         for rfile in self.files:
             rfile.force = force
 
-    def initInfo(self):
+    def initInfo(self, info = None):
+        # info read beforehand from the first file (see readFiles)
         if not self.resolution:
-            self.resolution = tuple(getFileInfo(self.files[0].filepath, ["bpy.context.scene.render.resolution_x", "bpy.context.scene.render.resolution_y", "bpy.context.scene.render.resolution_percentage"]))
-
-    def save(self):
-        if self.save_path:
-            f = open(os.path.join(self.save_path, "job.txt"), "w")
-            f.write(json.dumps(self.serialize()))
-            f.close()
+            self.resolution = tuple(info or getFileInfo(self.files[0].filepath, RESOLUTION_INFO))
 
     def edit(self, info_map):
         if "status" in info_map:
@@ -119,25 +289,52 @@ class MRenderJob(netrender.model.RenderJob):
         if "priority" in info_map:
             self.priority = info_map["priority"]
 
+            if self.scheduler:
+                self.scheduler.jobChanged(self, {"priority"})
+
         if "chunks" in info_map:
             self.chunks = info_map["chunks"]
 
-    def testStart(self):
+        self.stateChanged()
+
+    def testFiles(self, uploaded = None):
+        # arguments of readFiles: (path, signature) of the files testStart hashes, uploaded is
+        # tested even if forced, and the file to read the info from when the job can start
+        tests = []
+        ready = True
+
+        # Don't test files for versionned jobs
+        if not self.version_info:
+            for f in self.files:
+                if f is uploaded or (not f.force and not f.found):
+                    if not os.path.exists(f.filepath):
+                        ready = False
+                    elif f.signature != None:
+                        tests.append((f.filepath, f.signature))
+                elif not f.found:
+                    ready = False
+
+        return tests, self.files[0].filepath if ready and not self.resolution else None
+
+    def testStart(self, read = None):
+        # read is the result of readFiles(*self.testFiles()) when done beforehand
+        signatures, info = read or readFiles(*self.testFiles())
+
+        # paths and status of the files
+        self.stateChanged()
+
         # Don't test files for versionned jobs
         if not self.version_info:
             for f in self.files:
-                if not f.test():
+                if not f.test(signatures.get(f.filepath)):
                     return False
 
         self.start()
-        self.initInfo()
+        self.initInfo(info)
         return True
 
     def testFinished(self):
-        for f in self.frames:
-            if f.status == netrender.model.FRAME_QUEUED or f.status == netrender.model.FRAME_DISPATCHED:
-                break
-        else:
+        if self.frame_counts[netrender.model.FRAME_QUEUED] == 0 and self.frame_counts[netrender.model.FRAME_DISPATCHED] == 0:
             self.status = netrender.model.JOB_FINISHED
             self.finish_time=time.time()
 
@@ -166,9 +363,18 @@ class MRenderJob(netrender.model.RenderJob):
             if frame:
                 frame.log_path = log_path
 
+                if self.journal:
+                    self.journal.touchFrame(self, frame)
+
+        return log_path
+
     def addFrame(self, frame_number, command):
         frame = MRenderFrame(frame_number, command)
+        frame.index = len(self.frames)
+        frame.job = self
         self.frames.append(frame)
+        self.frames_map[frame.number] = frame
+        self.frameStatusChanged(frame, None, frame.status)
         return frame
 
     def reset(self, all):
@@ -178,13 +384,30 @@ class MRenderJob(netrender.model.RenderJob):
         if all:
             self.status = netrender.model.JOB_QUEUED
 
-    def getFrames(self):
+    def updateFrameTime(self, slave, frame_time):
+        # running averages of the job frame time and of the slave speed, used by the adaptive chunking
+        if self.frame_time and frame_time > 0:
+            slave.speed += FRAME_TIME_WEIGHT * (self.frame_time / frame_time - slave.speed)
+
+        if self.frame_time:
+            self.frame_time += FRAME_TIME_WEIGHT * (frame_time - self.frame_time)
+        else:
+            self.frame_time = frame_time
+
+    def getFrames(self, count = None):
+        if count is None:
+            count = self.chunks
+
         frames = []
-        for f in self.frames:
+        while self.queued:
+            index = heapq.heappop(self.queued)
+            self.queued_set.discard(index)
+
+            f = self.frames[index]
             if f.status == netrender.model.FRAME_QUEUED:
                 self.last_dispatched = time.time()
                 frames.append(f)
-                if len(frames) >= self.chunks:
+                if len(frames) >= count:
                     break
 
         return frames
@@ -193,6 +416,10 @@ class MRenderJob(netrender.model.RenderJob):
         return os.path.join(self.save_path, filename)
 
 class MRenderFrame(netrender.model.RenderFrame):
+    job = None
+    index = 0
+    _status = None
+
     def __init__(self, frame, command):
         super().__init__()
         self.number = frame
@@ -203,6 +430,24 @@ class MRenderFrame(netrender.model.RenderFrame):
 
         self.log_path = None
 
+    def __setstate__(self, state):
+        # frames saved by older versions store the status as a plain attribute
+        if "status" in state:
+            state["_status"] = state.pop("status")
+        self.__dict__.update(state)
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        old_status = self._status
+        self._status = value
+
+        if self.job and old_status != value:
+            self.job.frameStatusChanged(self, old_status, value)
+
     def addDefaultRenderResult(self):
         self.results.append(self.getRenderFilename())
 
@@ -211,10 +456,16 @@ class MRenderFrame(netrender.model.RenderFrame):
 
     def reset(self, all):
         if all or self.status == netrender.model.FRAME_ERROR:
+            # change status first, the job still needs the slave of dispatched frames
+            self.status = netrender.model.FRAME_QUEUED
+
+            # no more output for that log, the next dispatch opens its own
+            if self.log_path and self.job and self.job.logs:
+                self.job.logs.frameFinished(self.log_path, self.number)
+
             self.log_path = None
             self.slave = None
             self.time = 0
-            self.status = netrender.model.FRAME_QUEUED
 
 
 # -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -232,14 +483,71 @@ pause_pattern = re.compile("/pause_([a-zA-Z0-9]+)")
 edit_pattern = re.compile("/edit_([a-zA-Z0-9]+)")
 
 class RenderHandler(http.server.BaseHTTPRequestHandler):
+    wait_thumbnails = True # wait for thumbnails not made yet
+
+    def offload(self, function, args, then):
+        # blocking step not touching the master state, then(result) handles the rest of the request
+        then(function(*args))
+
     def write_file(self, file_path, mode = 'wb'):
         length = int(self.headers['content-length'])
-        f = open(file_path, mode)
-        buf = self.rfile.read(length)
-        f.write(buf)
-        f.close()
-        del buf
-        
+        start = time.time()
+
+        with open(file_path, mode) as f:
+            netrender.transfer.copyBody(self.rfile, f, length, self.headers.get('content-encoding'))
+
+        self.server.metrics.transfer("in", length, time.time() - start, self.headers.get('slave-id'))
+
+    def send_file(self, file_path, content = "application/octet-stream"):
+        start, length = self.send_file_head(file_path, content)
+        start_time = time.time()
+
+        if length:
+            with open(file_path, 'rb') as f:
+                f.seek(start)
+                netrender.transfer.copyLength(f, self.wfile, length)
+
+        self.server.metrics.transfer("out", length, time.time() - start_time, self.headers.get('slave-id'))
+
+    def send_data(self, data, content = "application/octet-stream"):
+        self.send_head(headers = {"Content-Length": str(len(data))}, content = content)
+        self.wfile.write(data)
+
+    def send_file_head(self, file_path, content):
+        # send the headers for the whole file or the requested range, returns (start, length) of the data to send
+        size = os.path.getsize(file_path)
+        byte_range = netrender.transfer.parseRange(self.headers.get('range'), size)
+
+        if byte_range is None:
+            self.send_head(headers = {"Content-Length": str(size), "Accept-Ranges": "bytes"}, content = content)
+            return 0, size
+
+        start, end = byte_range
+
+        if start > end:
+            self.send_head(http.client.REQUESTED_RANGE_NOT_SATISFIABLE, headers = {"Content-Range": "bytes */%i" % size})
+            return 0, 0
+
+        length = end - start + 1
+        self.send_head(http.client.PARTIAL_CONTENT, headers = {"Content-Length": str(length), "Content-Range": "bytes %i-%i/%i" % (start, end, size), "Accept-Ranges": "bytes"}, content = content)
+        return start, length
+
+
+    def handle_one_request(self):
+        start = time.time()
+        self.response_code = None
+
+        super().handle_one_request()
+
+        if self.response_code is not None: # not for the end of the connection
+            self.server.metrics.request(self.command, self.path, self.response_code, time.time() - start)
+
+        self.server.flushJournal()
+
+    def send_response(self, code, message = None):
+        self.response_code = code
+        super().send_response(code, message)
+
     def log_message(self, format, *args):
         # override because the original calls self.address_string(), which
         # is extremely slow due to some timeout..
@@ -257,7 +565,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
     def send_head(self, code = http.client.OK, headers = {}, content = "application/octet-stream"):
         self.send_response(code)
         
-        if code == http.client.OK and content:
+        if code in {http.client.OK, http.client.PARTIAL_CONTENT} and content:
             self.send_header("Content-type", content)
 
         for key, value in headers.items():
@@ -318,10 +626,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                             filename = job.getResultPath(frame.getRenderFilename())
 
-                            f = open(filename, 'rb')
-                            self.send_head(content = "image/x-exr")
-                            shutil.copyfileobj(f, self.wfile)
-                            f.close()
+                            self.send_file(filename, content = "image/x-exr")
                         elif frame.status == netrender.model.FRAME_ERROR:
                             self.send_head(http.client.PARTIAL_CONTENT)
                     else:
@@ -345,20 +650,9 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 if job:
                     self.server.stats("", "Sending result to client")
 
-                    zip_filepath = job.getResultPath("results.zip")
-                    with zipfile.ZipFile(zip_filepath, "w") as zfile:
-                        for frame in job.frames:
-                            if frame.status == netrender.model.FRAME_DONE:
-                                for filename in frame.results:
-                                    filepath = job.getResultPath(filename)
-                                    
-                                    zfile.write(filepath, filename)
-                                    
-                    
-                    f = open(zip_filepath, 'rb')
-                    self.send_head(content = "application/x-zip-compressed")
-                    shutil.copyfileobj(f, self.wfile)
-                    f.close()
+                    files = [(job.getResultPath(filename), filename) for frame in job.frames if frame.status == netrender.model.FRAME_DONE for filename in frame.results]
+
+                    self.offload(zipFiles, (job.getResultPath("results.zip"), files), lambda zip_filepath: self.send_file(zip_filepath, content = "application/x-zip-compressed"))
                 else:
                     # no such job id
                     self.send_head(http.client.NO_CONTENT)
@@ -384,13 +678,18 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                         elif frame.status == netrender.model.FRAME_DONE:
                             filename = job.getResultPath(frame.getRenderFilename())
 
-                            thumbname = thumbnail.generate(filename)
+                            # made on first request, then cached
+                            thumbname = thumbnail.cached(filename)
+
+                            if not thumbname and self.wait_thumbnails:
+                                thumbname = thumbnail.generate(filename)
 
                             if thumbname:
-                                f = open(thumbname, 'rb')
-                                self.send_head(content = "image/jpeg")
-                                shutil.copyfileobj(f, self.wfile)
-                                f.close()
+                                self.send_file(thumbname, content = "image/jpeg")
+                            elif not self.wait_thumbnails:
+                                # made in the background, sent on a later request
+                                thumbnail.service().request(filename)
+                                self.send_head(http.client.ACCEPTED)
                             else: # thumbnail couldn't be generated
                                 self.send_head(http.client.PARTIAL_CONTENT)
                                 return
@@ -419,17 +718,23 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     frame = job[frame_number]
 
                     if frame:
-                        if not frame.log_path or frame.status in {netrender.model.FRAME_QUEUED, netrender.model.FRAME_DISPATCHED}:
+                        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+                        if not frame.log_path:
+                            self.send_head(http.client.PROCESSING)
+                        elif "tail" in query:
+                            # last lines, also while rendering
+                            lines = self.server.logs.tail(frame.log_path, int(query["tail"][0]))
+                            self.send_data(b"\n".join(lines), content = "text/plain")
+                        elif "offset" in query:
+                            # what was added since the last fetch, also while rendering
+                            self.send_data(self.server.logs.read(frame.log_path, int(query["offset"][0])), content = "text/plain")
+                        elif frame.status in {netrender.model.FRAME_QUEUED, netrender.model.FRAME_DISPATCHED}:
                             self.send_head(http.client.PROCESSING)
                         else:
                             self.server.stats("", "Sending log to client")
-                            f = open(frame.log_path, 'rb')
-
-                            self.send_head(content = "text/plain")
 
-                            shutil.copyfileobj(f, self.wfile)
-
-                            f.close()
+                            self.send_data(self.server.logs.read(frame.log_path), content = "text/plain")
                     else:
                         # no such frame
                         self.send_head(http.client.NO_CONTENT)
@@ -476,23 +781,23 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path == "/job":
-            self.server.balance()
-
             slave_id = self.headers['slave-id']
 
             slave = self.server.getSeenSlave(slave_id)
 
             if slave: # only if slave id is valid
+                slave.updateCacheStats(self.headers)
+                slave.updateTransferStats(self.headers)
+
                 job, frames = self.server.newDispatch(slave)
 
                 if job and frames:
                     for f in frames:
                         print("dispatch", f.number)
-                        f.status = netrender.model.FRAME_DISPATCHED
                         f.slave = slave
+                        f.status = netrender.model.FRAME_DISPATCHED
 
-                    slave.job = job
-                    slave.job_frames = [f.number for f in frames]
+                    slave.dispatch(job, frames)
 
                     self.send_head(headers={"job-id": job.id})
 
@@ -502,8 +807,7 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     self.server.stats("", "Sending job to slave")
                 else:
                     # no job available, return error code
-                    slave.job = None
-                    slave.job_frames = []
+                    slave.dispatch(None, [])
 
                     self.send_head(http.client.ACCEPTED)
             else: # invalid slave id
@@ -530,12 +834,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                     if render_file:
                         self.server.stats("", "Sending file to slave")
-                        f = open(render_file.filepath, 'rb')
 
-                        self.send_head()
-                        shutil.copyfileobj(f, self.wfile)
-
-                        f.close()
+                        self.send_file(render_file.filepath)
                     else:
                         # no such file
                         self.send_head(http.client.NO_CONTENT)
@@ -559,7 +859,10 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         else:
             # hand over the rest to the html section
-            netrender.master_html.get(self)
+            if self.path.startswith("/metrics"):
+                netrender.metrics.get(self)
+            else:
+                netrender.master_html.get(self)
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
     # -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -587,12 +890,15 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
             headers={"job-id": job_id}
 
-            if job.testStart():
-                self.server.stats("", "New job, started")
-                self.send_head(headers=headers, content = None)
-            else:
-                self.server.stats("", "New job, missing files (%i total)" % len(job.files))
-                self.send_head(http.client.ACCEPTED, headers=headers)
+            def started(read):
+                if job.testStart(read):
+                    self.server.stats("", "New job, started")
+                    self.send_head(headers=headers, content = None)
+                else:
+                    self.server.stats("", "New job, missing files (%i total)" % len(job.files))
+                    self.send_head(http.client.ACCEPTED, headers=headers)
+
+            self.offload(readFiles, job.testFiles(), started)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path.startswith("/edit"):
             match = edit_pattern.match(self.path)
@@ -624,6 +930,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 except:
                     pass # invalid type
 
+            self.server.scheduler.invalidate()
+
             self.send_head(content = None)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path == "/balance_enable":
@@ -633,6 +941,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 if rule:
                     rule.enabled = enabled
 
+            self.server.scheduler.invalidate()
+
             self.send_head(content = None)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path.startswith("/cancel"):
@@ -733,7 +1043,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
             slave_id = self.server.addSlave(slave_info)
 
-            self.send_head(headers = {"slave-id": slave_id}, content = None)
+            # slaves can compress their uploads
+            self.send_head(headers = {"slave-id": slave_id, "accept-encoding": "gzip"}, content = None)
         # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
         elif self.path == "/log":
             length = int(self.headers['content-length'])
@@ -749,7 +1060,8 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
 
                 if job:
                     self.server.stats("", "Log announcement")
-                    job.addLog(log_info.frames)
+                    log_path = job.addLog(log_info.frames)
+                    self.server.logs.open(log_path, log_info.frames)
                     self.send_head(content = None)
                 else:
                     # no such job id
@@ -794,17 +1106,21 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                         self.write_file(file_path)
                         
                         rfile.filepath = file_path # set the new path
-                        found = rfile.updateStatus() # make sure we have the right file
-                        
-                        if not found: # checksum mismatch
-                            self.server.stats("", "File upload but checksum mismatch, this shouldn't happen")
-                            self.send_head(http.client.CONFLICT)
-                        elif job.testStart(): # started correctly
-                            self.server.stats("", "File upload, starting job")
-                            self.send_head(content = None)
-                        else:
-                            self.server.stats("", "File upload, dependency files still missing")
-                            self.send_head(http.client.ACCEPTED)
+
+                        def uploaded(read):
+                            found = rfile.updateStatus(read[0].get(file_path)) # make sure we have the right file
+                            
+                            if not found: # checksum mismatch
+                                self.server.stats("", "File upload but checksum mismatch, this shouldn't happen")
+                                self.send_head(http.client.CONFLICT)
+                            elif job.testStart(read): # started correctly
+                                self.server.stats("", "File upload, starting job")
+                                self.send_head(content = None)
+                            else:
+                                self.server.stats("", "File upload, dependency files still missing")
+                                self.send_head(http.client.ACCEPTED)
+
+                        self.offload(readFiles, job.testFiles(rfile), uploaded)
                     else: # invalid file
                         print("file not found", job_id, file_index)
                         self.send_head(http.client.NO_CONTENT)
@@ -845,10 +1161,17 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                             elif job_result == netrender.model.FRAME_ERROR:
                                 # blacklist slave on this job on error
                                 # slaves might already be in blacklist if errors on the whole chunk
-                                if not slave.id in job.blacklist:
-                                    job.blacklist.append(slave.id)
+                                self.server.scheduler.blacklistSlave(job, slave.id)
+                                job.stateChanged()
 
-                        slave.finishedFrame(job_frame)
+                        slave.finishedFrame(job_frame, job)
+
+                        if job_result == netrender.model.FRAME_DONE:
+                            job.updateFrameTime(slave, job_time)
+                            self.server.metrics.frameDone(slave)
+
+                        if frame.log_path:
+                            self.server.logs.frameFinished(frame.log_path, job_frame)
 
                         frame.status = job_result
                         frame.time = job_time
@@ -893,7 +1216,10 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                             
                         if job_finished:
                             job_time = float(self.headers['job-time'])
-                            slave.finishedFrame(job_frame)
+                            slave.finishedFrame(job_frame, job)
+
+                            if frame.log_path:
+                                self.server.logs.frameFinished(frame.log_path, job_frame)
     
                             frame.status = job_result
                             frame.time = job_time
@@ -952,9 +1278,12 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                     frame = job[job_frame]
 
                     if frame and frame.log_path:
-                        self.send_head(content = None)
+                        length = int(self.headers['content-length'])
+                        offset = self.headers.get('log-offset')
 
-                        self.write_file(frame.log_path, 'ab')
+                        received = self.server.logs.write(frame.log_path, job_frame, self.rfile.read(length), int(offset) if offset else None)
+
+                        self.send_head(headers = {"log-offset": str(received)}, content = None)
 
                         self.server.getSeenSlave(self.headers['slave-id'])
 
@@ -966,7 +1295,9 @@ class RenderHandler(http.server.BaseHTTPRequestHandler):
                 self.send_head(http.client.NO_CONTENT)
 
 class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    def __init__(self, address, handler_class, path, force=False, subdir=True):
+    request_queue_size = 128 # pending connections, slaves polling together overflow the default of 5
+
+    def __init__(self, address, handler_class, path, force=False, subdir=True, bind_and_activate=True):
         self.jobs = []
         self.jobs_map = {}
         self.slaves = []
@@ -990,24 +1321,51 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         self.balancer.addException(netrender.balancing.ExcludeSlavesLimit(self.countJobs, self.countSlaves, limit = 0.9))
         self.balancer.addPriority(netrender.balancing.NewJobPriority())
         self.balancer.addPriority(netrender.balancing.MinimumTimeBetweenDispatchPriority(limit = 2))
+        self.balancer.addChunking(netrender.balancing.AdaptiveChunking(self.countSlaves))
+
+        self.scheduler = netrender.scheduling.Scheduler(self.balancer)
+        self.journal = None
+        self.logs = netrender.logs.LogStore()
+        self.metrics = netrender.metrics.MasterMetrics(self.path)
 
-        super().__init__(address, handler_class)
+        super().__init__(address, handler_class, bind_and_activate)
 
     def restore(self, jobs, slaves, balancer = None):
+        if balancer:
+            self.balancer = balancer
+
+        self.scheduler = netrender.scheduling.Scheduler(self.balancer)
+
         self.jobs = jobs
         self.jobs_map = {}
         
         for job in self.jobs:
+            job.reindex()
+            job.logs = self.logs
             self.jobs_map[job.id] = job
+            self.scheduler.addJob(job)
             self.job_id = max(self.job_id, int(job.id))
 
         self.slaves = slaves
         for slave in self.slaves:
+            # saved by older versions
+            if not hasattr(slave, "uploading"):
+                slave.uploading = []
+
             self.slaves_map[slave.id] = slave
-        
-        if balancer:
-            self.balancer = balancer
-        
+
+    def setJournal(self, journal):
+        # start journaling changes from a snapshot of the current state
+        self.journal = journal
+
+        for job in self.jobs:
+            job.journal = journal
+
+        journal.snapshot(self)
+
+    def flushJournal(self):
+        if self.journal:
+            self.journal.flush(self)
 
     def nextJobID(self):
         self.job_id += 1
@@ -1017,12 +1375,20 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         slave = MRenderSlave(slave_info)
         self.slaves.append(slave)
         self.slaves_map[slave.id] = slave
+        self.scheduler.globalChanged({"slaves"})
+
+        if self.journal:
+            self.journal.addSlave(slave)
 
         return slave.id
 
     def removeSlave(self, slave):
         self.slaves.remove(slave)
         self.slaves_map.pop(slave.id)
+        self.scheduler.globalChanged({"slaves"})
+
+        if self.journal:
+            self.journal.removeSlave(slave)
 
     def getSlave(self, slave_id):
         return self.slaves_map.get(slave_id)
@@ -1039,29 +1405,43 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
 
         t = time.time()
 
-        for slave in self.slaves:
-            if (t - slave.last_seen) / 60 > self.slave_timeout:
-                removed.append(slave)
+        with self.scheduler.lock:
+            for slave in self.slaves:
+                if (t - slave.last_seen) / 60 > self.slave_timeout:
+                    removed.append(slave)
 
-                if slave.job:
-                    for f in slave.job_frames:
-                        slave.job[f].status = netrender.model.FRAME_ERROR
+                    for job, f in slave.dispatchedFrames():
+                        frame = job[f]
+                        frame.status = netrender.model.FRAME_ERROR
 
-        for slave in removed:
-            self.removeSlave(slave)
+                        # the slave won't send the rest of the log
+                        if frame.log_path:
+                            self.logs.frameFinished(frame.log_path, f)
+
+            for slave in removed:
+                self.removeSlave(slave)
 
     def updateUsage(self):
         blend = 0.5
-        for job in self.jobs:
-            job.usage *= (1 - blend)
 
-        if self.slaves:
-            slave_usage = blend / self.countSlaves()
+        with self.scheduler.lock:
+            for job in self.jobs:
+                job.usage *= (1 - blend)
 
-            for slave in self.slaves:
-                if slave.job:
-                    slave.job.usage += slave_usage
+            rendering = set()
+            if self.slaves:
+                slave_usage = blend / self.countSlaves()
+
+                for slave in self.slaves:
+                    if slave.job:
+                        slave.job.usage += slave_usage
+                        rendering.add(slave.job)
 
+            # the decay keeps the order of the jobs, only the jobs being rendered are ranked again
+            self.scheduler.usageScaled(1 - blend, rendering)
+
+            # time based rules
+            self.scheduler.globalChanged({"time"})
 
     def clear(self, clear_files = False):
         removed = self.jobs[:]
@@ -1070,18 +1450,16 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
             self.removeJob(job, clear_files)
 
     def balance(self):
-        self.balancer.balance(self.jobs)
+        start = time.time()
+        with self.scheduler.lock:
+            self.balancer.balance(self.jobs)
+        self.metrics.timing("balance", time.time() - start)
 
     def getJobs(self):
         return self.jobs
 
     def countJobs(self, status = netrender.model.JOB_QUEUED):
-        total = 0
-        for j in self.jobs:
-            if j.status == status:
-                total += 1
-
-        return total
+        return self.scheduler.countJobs(status)
 
     def countSlaves(self):
         return len(self.slaves)
@@ -1089,24 +1467,40 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     def removeJob(self, job, clear_files = False):
         self.jobs.remove(job)
         self.jobs_map.pop(job.id)
+        self.scheduler.removeJob(job)
+
+        if self.journal:
+            self.journal.removeJob(job)
+            job.journal = None
+
+        # logs still written to, dropped with the files
+        for log_path in {frame.log_path for frame in job.frames if frame.log_path}:
+            if clear_files:
+                self.logs.discard(log_path)
+            else:
+                self.logs.close(log_path)
+
+        job.logs = None
 
         if clear_files:
             shutil.rmtree(job.save_path)
 
         for slave in self.slaves:
-            if slave.job == job:
-                slave.job = None
-                slave.job_frames = []
+            slave.removeJob(job)
 
     def addJob(self, job):
         self.jobs.append(job)
         self.jobs_map[job.id] = job
+        self.scheduler.addJob(job)
+        job.logs = self.logs
 
         # create job directory
         job.save_path = os.path.join(self.path, "job_" + job.id)
         verifyCreateDir(job.save_path)
 
-        job.save()
+        if self.journal:
+            job.journal = self.journal
+            self.journal.addJob(job)
 
     def getJobID(self, id):
         return self.jobs_map.get(id)
@@ -1116,41 +1510,66 @@ class RenderMasterServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
             yield job
 
     def newDispatch(self, slave):
-        if self.jobs:
-            for job in self.jobs:
-                if (
-                    not self.balancer.applyExceptions(job)      # No exceptions
-                    and slave.id not in job.blacklist           # slave is not blacklisted
-                    and (not slave.tags or job.tags.issubset(slave.tags))  # slave doesn't use tags or slave has all job tags
-                         ):
-                    
-                    return job, job.getFrames()
+        # best job without exceptions, not blacklisting the slave and with tags the slave has
+        start = time.time()
+
+        try:
+            # frames are taken from the job before another thread can dispatch it
+            with self.scheduler.lock:
+                job = self.scheduler.nextJob(slave)
+
+                if job:
+                    return job, job.getFrames(self.balancer.chunkSize(job, slave))
 
-        return None, None
+            return None, None
+        finally:
+            self.metrics.timing("dispatch", time.time() - start)
 
 def clearMaster(path):
     shutil.rmtree(path)
 
-def createMaster(address, clear, force, path):
-    filepath = os.path.join(path, "blender_master.data")
+def createMaster(address, clear, force, path, bind_and_activate=True):
+    filepath = os.path.join(path, "blender_master.data") # saved by older versions
+
+    setSignatureIndexPath(os.path.join(path, "signatures.json"))
+
+    journal = netrender.journal.MasterJournal(path)
+
+    if clear:
+        journal.clear()
+    elif journal.exists():
+        print("recovering master journal:", journal.journal_path)
+        master_path, jobs, slaves = netrender.journal.recover(journal)
+
+        httpd = RenderMasterServer(address, RenderHandler, master_path, force=force, subdir=False, bind_and_activate=bind_and_activate)
+        httpd.restore(jobs, slaves)
+        httpd.setJournal(journal)
 
-    if not clear and os.path.exists(filepath):
+        return httpd
+    elif os.path.exists(filepath):
         print("loading saved master:", filepath)
         with open(filepath, 'rb') as f:
-            path, jobs, slaves = pickle.load(f)
-            
-            httpd = RenderMasterServer(address, RenderHandler, path, force=force, subdir=False)
-            httpd.restore(jobs, slaves)
-            
-            return httpd
+            master_path, jobs, slaves = pickle.load(f)
+
+        httpd = RenderMasterServer(address, RenderHandler, master_path, force=force, subdir=False, bind_and_activate=bind_and_activate)
+        httpd.restore(jobs, slaves)
+        httpd.setJournal(journal)
+
+        # converted to the journal
+        os.remove(filepath)
+
+        return httpd
 
-    return RenderMasterServer(address, RenderHandler, path, force=force)
+    httpd = RenderMasterServer(address, RenderHandler, path, force=force, bind_and_activate=bind_and_activate)
+    httpd.setJournal(journal)
+
+    return httpd
 
 def saveMaster(path, httpd):
-    filepath = os.path.join(path, "blender_master.data")
-    
-    with open(filepath, 'wb') as f:
-        pickle.dump((httpd.path, httpd.jobs, httpd.slaves), f, pickle.HIGHEST_PROTOCOL)
+    # compact the journal, recovering is then only loading the snapshot
+    httpd.flushJournal()
+    httpd.journal.snapshot(httpd)
+    httpd.journal.close()
 
 def runMaster(address, broadcast, clear, force, path, update_stats, test_break,use_ssl=False,cert_path="",key_path=""):
     httpd = createMaster(address, clear, force, path)
@@ -1176,14 +1595,20 @@ def runMaster(address, broadcast, clear, force, path, update_stats, test_break,u
 
             httpd.updateUsage()
 
+            httpd.flushJournal()
+
             if broadcast:
                 print("broadcasting address")
                 s.sendto(bytes("%i" % address[1], encoding='utf8'), 0, ('<broadcast>', 8000))
-                start_time = time.time()
+
+            start_time = time.time()
 
     httpd.server_close()
+    thumbnail.stop()
+
     if clear:
         clearMaster(httpd.path)
+        httpd.journal.clear()
     else:
         saveMaster(path, httpd)
 
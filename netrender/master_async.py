@@ -0,0 +1,442 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Event loop master engine (needs asyncio, python 3.5 or later)
+#
+# Connections are served by asyncio with HTTP/1.1 keep-alive. Request bodies
+# are read (and spooled to disk when big) by the connection task, then the
+# request is handled by the RenderHandler code in the owner task, the only one
+# touching the master state. Files sent by the handler are streamed back by
+# the connection task, so big uploads and downloads don't block other slaves.
+# Blocking steps (decoding compressed uploads, hashing files, reading the file
+# info, zipping results) run on executor threads between owner task calls.
+# Slave timeouts and usage updates are scheduled tasks going through the
+# owner as well.
+
+import sys, os, io, time, socket, shutil, tempfile, traceback, zlib
+import http, http.client, email.utils
+import asyncio
+
+from netrender.utils import *
+import netrender.model
+import netrender.master
+import netrender.transfer
+import netrender.thumbnail as thumbnail
+
+SPOOL_SIZE = 1 << 20 # request bodies bigger than this are spooled to disk
+STREAM_CHUNK = 1 << 16
+KEEP_ALIVE_TIMEOUT = 60 # seconds before closing idle connections
+TICK = 2 # seconds between slave timeouts and usage updates, as in runMaster
+
+class AsyncRenderHandler(netrender.master.RenderHandler):
+    wait_thumbnails = False # would block the owner task
+
+    # BaseHTTPRequestHandler.__init__ serves a socket, only set what the do_* methods use
+    def __init__(self, server, requestline, command, path, request_version, headers, body, client_address):
+        self.server = server
+        self.requestline = requestline
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.client_address = client_address
+
+        self.rfile, self.spool_path = body
+        self.wfile = io.BytesIO()
+
+        self.status = None
+        self.response_headers = []
+        self.stream_path = None
+        self.stream_offset = 0
+        self.stream_size = 0
+
+        self.offloaded = None
+        self.start_time = time.time()
+
+    def handle_command(self):
+        method = getattr(self, "do_" + self.command, None)
+
+        if method:
+            method()
+        else:
+            self.send_head(http.client.NOT_IMPLEMENTED)
+
+        self.handled()
+
+    def offload(self, function, args, then):
+        # function runs on an executor thread, then resumes in the owner task (see AsyncMaster.serveRequest)
+        self.offloaded = (function, args, then)
+
+    def resume(self, then, result):
+        then(result)
+        self.handled()
+
+    def handled(self):
+        if self.offloaded:
+            return
+
+        self.server.metrics.request(self.command, self.path, self.status or http.client.NOT_FOUND, time.time() - self.start_time)
+
+        self.server.flushJournal()
+
+    def send_response(self, code, message = None):
+        self.log_request(code)
+        self.status = code
+
+    def send_header(self, keyword, value):
+        self.response_headers.append((keyword, value))
+
+    def end_headers(self):
+        pass
+
+    def send_file(self, file_path, content = "application/octet-stream"):
+        # streamed by the connection task once the request is handled, which counts the transfer
+        self.stream_offset, self.stream_size = self.send_file_head(file_path, content)
+
+        if self.stream_size:
+            self.stream_path = file_path
+
+    def write_file(self, file_path, mode = 'wb'):
+        # compressed bodies are already decoded to disk (see AsyncMaster.decodeBody)
+        if not self.spool_path:
+            super().write_file(file_path, mode)
+            return
+
+        # big body, already on disk
+        self.rfile.close()
+        start = time.time()
+
+        if mode == 'wb':
+            shutil.move(self.spool_path, file_path)
+        else:
+            with open(self.spool_path, 'rb') as fsrc, open(file_path, mode) as fdst:
+                shutil.copyfileobj(fsrc, fdst)
+            os.remove(self.spool_path)
+
+        self.spool_path = None
+        self.server.metrics.transfer("in", int(self.headers['content-length']), time.time() - start, self.headers.get('slave-id'))
+
+    def close(self):
+        self.rfile.close()
+
+        if self.spool_path:
+            os.remove(self.spool_path)
+            self.spool_path = None
+
+class Spool:
+    # request body kept in memory, moved to a temporary file when too big
+    def __init__(self, directory):
+        self.directory = directory
+        self.file = io.BytesIO()
+        self.path = None
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+        if not self.path and self.size > SPOOL_SIZE:
+            fd, self.path = tempfile.mkstemp(prefix = "upload_", dir = self.directory)
+            spooled = os.fdopen(fd, "w+b")
+            spooled.write(self.file.getvalue())
+            self.file = spooled
+
+        self.file.write(data)
+
+    def finish(self):
+        self.file.seek(0)
+        return self.file, self.path
+
+    def discard(self):
+        self.file.close()
+        if self.path:
+            os.remove(self.path)
+
+class AsyncMaster:
+    def __init__(self, httpd, loop):
+        self.httpd = httpd
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.writers = set()
+
+    def call(self, function, *args):
+        # run function in the owner task, returns a future of its result
+        future = self.loop.create_future()
+        self.queue.put_nowait((function, args, future))
+        return future
+
+    async def owner(self):
+        # the only task using the master state (jobs, slaves, balancer)
+        while True:
+            function, args, future = await self.queue.get()
+
+            if future.cancelled():
+                continue
+
+            try:
+                future.set_result(function(*args))
+            except Exception as err:
+                future.set_exception(err)
+
+    def tick(self):
+        self.httpd.timeoutSlaves()
+        self.httpd.updateUsage()
+        self.httpd.flushJournal()
+
+    async def every(self, interval, function):
+        while True:
+            await asyncio.sleep(interval)
+            await self.call(function)
+
+    async def broadcast(self, port):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+        try:
+            while True:
+                print("broadcasting address")
+                s.sendto(bytes("%i" % port, encoding='utf8'), 0, ('<broadcast>', 8000))
+                await asyncio.sleep(TICK)
+        finally:
+            s.close()
+
+    async def readBody(self, reader, headers):
+        spool = Spool(self.httpd.path)
+
+        try:
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        # skip trailers
+                        while (await reader.readline()) not in {b"\r\n", b"\n", b""}:
+                            pass
+                        break
+
+                    await self.readInto(reader, spool, size)
+                    await reader.readline()
+
+                # handlers use the length of the body
+                del headers["transfer-encoding"]
+                del headers["content-length"]
+                headers["content-length"] = str(spool.size)
+            else:
+                await self.readInto(reader, spool, int(headers.get("content-length", 0) or 0))
+        except:
+            spool.discard()
+            raise
+
+        return spool.finish()
+
+    def decodeBody(self, body, headers):
+        # decode a compressed body to a temporary file, on an executor thread
+        rfile, path = body
+        fd, decoded_path = tempfile.mkstemp(prefix = "upload_", dir = self.httpd.path)
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                netrender.transfer.copyBody(rfile, f, int(headers.get("content-length", 0) or 0), headers["content-encoding"])
+        except:
+            os.remove(decoded_path)
+            raise
+        finally:
+            rfile.close()
+            if path:
+                os.remove(path)
+
+        # content-length stays the transferred size, counted by write_file
+        del headers["content-encoding"]
+
+        return open(decoded_path, "rb"), decoded_path
+
+    async def readInto(self, reader, spool, length):
+        while length > 0:
+            data = await reader.read(min(length, STREAM_CHUNK))
+            if not data:
+                raise ConnectionError("connection closed while reading request body")
+
+            spool.write(data)
+            length -= len(data)
+
+    async def sendResponse(self, writer, handler, keep_alive):
+        status = handler.status or http.client.NOT_FOUND
+        body = handler.wfile.getvalue()
+        length = handler.stream_size if handler.stream_path else len(body)
+
+        lines = ["HTTP/1.1 %i %s" % (status, http.client.responses.get(status, ""))]
+        lines.extend(("%s: %s" % (keyword, value) for keyword, value in handler.response_headers if keyword.lower() != "content-length"))
+        lines.append("Date: %s" % email.utils.formatdate(usegmt = True))
+        lines.append("Content-Length: %i" % length)
+        lines.append("Connection: %s" % ("keep-alive" if keep_alive else "close"))
+
+        writer.write(bytes("\r\n".join(lines) + "\r\n\r\n", encoding = 'latin-1'))
+
+        if handler.command != "HEAD":
+            if handler.stream_path:
+                start = time.time()
+                size = length
+
+                with open(handler.stream_path, 'rb') as f:
+                    f.seek(handler.stream_offset)
+
+                    while length > 0:
+                        data = f.read(min(length, STREAM_CHUNK))
+                        if not data:
+                            break
+
+                        writer.write(data)
+                        length -= len(data)
+                        await writer.drain()
+
+                self.httpd.metrics.transfer("out", size - length, time.time() - start, handler.headers.get('slave-id'))
+            else:
+                writer.write(body)
+
+        await writer.drain()
+
+    async def serveRequest(self, requestline, reader, writer, client_address):
+        requestline = str(requestline, encoding = 'latin-1').rstrip("\r\n")
+
+        try:
+            command, path, request_version = requestline.split()
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return False
+
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            header_lines.append(line)
+            if line in {b"\r\n", b"\n", b""}:
+                break
+
+        headers = http.client.parse_headers(io.BytesIO(b"".join(header_lines)))
+
+        keep_alive = request_version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        body = await self.readBody(reader, headers)
+
+        if headers.get("content-encoding", "identity") != "identity":
+            try:
+                body = await self.loop.run_in_executor(None, self.decodeBody, body, headers)
+            except (ValueError, zlib.error, http.client.IncompleteRead):
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                return False
+
+        handler = AsyncRenderHandler(self.httpd, requestline, command, path, request_version, headers, body, client_address)
+
+        try:
+            await self.call(handler.handle_command)
+
+            while handler.offloaded:
+                function, args, then = handler.offloaded
+                handler.offloaded = None
+
+                result = await self.loop.run_in_executor(None, function, *args)
+                await self.call(handler.resume, then, result)
+        except Exception:
+            traceback.print_exc()
+            handler.status = http.client.INTERNAL_SERVER_ERROR
+            handler.response_headers = []
+            handler.wfile = io.BytesIO()
+            handler.stream_path = None
+        finally:
+            handler.close()
+
+        await self.sendResponse(writer, handler, keep_alive)
+
+        return keep_alive
+
+    async def serve(self, reader, writer):
+        self.writers.add(writer)
+        client_address = writer.get_extra_info("peername")
+
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+
+                if not line:
+                    break
+                elif line in {b"\r\n", b"\n"}:
+                    continue
+
+                keep_alive = await self.serveRequest(line, reader, writer, client_address)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass # closed or invalid connection
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def run(self, address, broadcast, test_break, ssl_context = None):
+        server = await asyncio.start_server(self.serve, address[0] or None, address[1], ssl = ssl_context)
+
+        tasks = [asyncio.ensure_future(self.owner()),
+                 asyncio.ensure_future(self.every(TICK, self.tick))]
+
+        if broadcast:
+            tasks.append(asyncio.ensure_future(self.broadcast(address[1])))
+
+        try:
+            while not test_break():
+                await asyncio.sleep(0.25)
+        finally:
+            server.close()
+
+            for writer in list(self.writers):
+                writer.close()
+
+            await server.wait_closed()
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions = True)
+
+def runMaster(address, broadcast, clear, force, path, update_stats, test_break, use_ssl=False, cert_path="", key_path=""):
+    # same as netrender.master.runMaster, served by an event loop
+    httpd = netrender.master.createMaster(address, clear, force, path, bind_and_activate = False)
+    httpd.stats = update_stats
+
+    ssl_context = None
+    if use_ssl:
+        import ssl
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(cert_path, key_path)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        loop.run_until_complete(AsyncMaster(httpd, loop).run(address, broadcast, test_break, ssl_context))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    httpd.server_close()
+    thumbnail.stop()
+
+    if clear:
+        netrender.master.clearMaster(httpd.path)
+        httpd.journal.clear()
+    else:
+        netrender.master.saveMaster(path, httpd)
@@ -29,8 +29,13 @@ CACHE_FILES=1
 FLUID_FILES=2
 OTHER_FILES=4
 
+LOG_TAIL = 50 # lines shown by the tail links of the logs
+
 src_folder = os.path.split(__file__)[0]
 
+def throughput(size, duration):
+    return "%.1f MB/s" % (size / duration / (1024 * 1024)) if duration else "-"
+
 #function to return counter of different type of files
 # job: the job that contain files
 
@@ -118,12 +123,7 @@ def get(handler):
         output(json.dumps(message,sort_keys=False))
             
     def sendFile(filename,content_type):
-        f = open(os.path.join(src_folder,filename), 'rb')
-
-        handler.send_head(content = content_type)
-        shutil.copyfileobj(f, handler.wfile)
-
-        f.close()
+        handler.send_file(os.path.join(src_folder,filename), content_type)
     # return serialized version of job for html interface
     # job: the base job
     # includeFiles: boolean to indicate if we want file to be serialized too into job 
@@ -204,6 +204,8 @@ def get(handler):
             message.append(rule.serialize())  
          for rule in handler.server.balancer.exceptions:
             message.append(rule.serialize())
+         for rule in handler.server.balancer.chunking:
+            message.append(rule.serialize())
          sendjson(message)
     #return all slaves list     
     elif handler.path == "/html/slaves":
@@ -374,10 +376,10 @@ def get(handler):
         output("<h2>Slaves</h2>")
 
         startTable()
-        headerTable("name", "address", "tags", "last seen", "stats", "job")
+        headerTable("name", "address", "tags", "last seen", "stats", "cache hits", "cache saved", "upload", "download", "latency", "job")
 
         for slave in handler.server.slaves:
-            rowTable(slave.name, slave.address[0], ";".join(sorted(slave.tags)) if slave.tags else "<i>All</i>", time.ctime(slave.last_seen), slave.stats, link(slave.job.name, "/html/job" + slave.job.id) if slave.job else "None")
+            rowTable(slave.name, slave.address[0], ";".join(sorted(slave.tags)) if slave.tags else "<i>All</i>", time.ctime(slave.last_seen), slave.stats, "%i/%i" % (slave.cache_hits, slave.cache_hits + slave.cache_misses), "%.1f MB" % (slave.cache_bytes_saved / (1024 * 1024)), throughput(slave.upload_bytes, slave.upload_time), throughput(slave.download_bytes, slave.download_time), "%.0f ms" % (slave.transfer_latency * 1000), link(slave.job.name, "/html/job" + slave.job.id) if slave.job else "None")
         endTable()
 
         output("<h2>Configuration</h2>")
@@ -419,6 +421,15 @@ def get(handler):
                         """<button title="edit limit" onclick="balance_edit('%s', '%s');">edit</button>""" % (rule.id(), str(rule.limit)) if hasattr(rule, "limit") else "&nbsp;"
                     )
 
+        for rule in handler.server.balancer.chunking:
+            rowTable(
+                        "chunking",
+                        checkbox("", rule.enabled, "balance_enable('%s', '%s')" % (rule.id(), str(not rule.enabled).lower())),
+                        rule,
+                        rule.str_limit() +
+                        """<button title="edit limit" onclick="balance_edit('%s', '%s');">edit</button>""" % (rule.id(), str(rule.limit)) if hasattr(rule, "limit") else "&nbsp;"
+                    )
+
         endTable()
         output("</body></html>")
 
@@ -534,7 +545,7 @@ def get(handler):
                              frame.statusText(),
                              "%.1fs" % frame.time,
                              frame.slave.name if frame.slave else "&nbsp;",
-                             link("view log", logURL(job_id, frame.number)) if frame.log_path else "&nbsp;",
+                             link("view log", logURL(job_id, frame.number)) + " [" + link("tail", logURL(job_id, frame.number) + "?tail=%i" % LOG_TAIL) + "]" if frame.log_path else "&nbsp;",
                              link("view result", renderURL(job_id, frame.number))  + " [" +
                              tag("span", "show", attr="class='thumb' onclick='showThumb(%s, %i)'" % (job.id, frame.number)) + "]" if frame.status == netrender.model.FRAME_DONE else "&nbsp;",
                              "<img name='thumb%i' title='hide thumbnails' src='' class='thumb' onclick='showThumb(%s, %i)'>" % (frame.number, job.id, frame.number)
@@ -548,7 +559,7 @@ def get(handler):
                              frame.statusText(),
                              "%.1fs" % frame.time,
                              frame.slave.name if frame.slave else "&nbsp;",
-                             link("view log", logURL(job_id, frame.number)) if frame.log_path else "&nbsp;"
+                             link("view log", logURL(job_id, frame.number)) + " [" + link("tail", logURL(job_id, frame.number) + "?tail=%i" % LOG_TAIL) + "]" if frame.log_path else "&nbsp;"
                              )
 
             endTable()
@@ -0,0 +1,282 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Metrics of the master
+#
+#   GET /metrics                     all metrics, in the Prometheus text format
+#   GET /metrics/profile?seconds=N   start sampling the master threads for N seconds
+#   GET /metrics/profile             last profile, one line per stack with its
+#                                    sample count (collapsed stacks, for flame graphs)
+#
+# Requests are counted per route (the first word of the path), not per URL.
+
+import sys, os, re, time, threading, collections, traceback
+import http, http.client
+import urllib.parse
+
+from netrender.utils import *
+import netrender.model
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+PROFILE_INTERVAL = 0.01 # seconds between samples
+PROFILE_MAX_TIME = 300
+
+route_pattern = re.compile("/[a-z]*")
+
+def route(path):
+    match = route_pattern.match(path)
+    return match.group() if match else "/"
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels)) + "}"
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+
+        for bound, count in zip(BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            yield "%s_bucket%s %i" % (name, formatLabels(labels + (("le", bound),)), cumulative)
+
+        yield "%s_sum%s %f" % (name, formatLabels(labels), self.total)
+        yield "%s_count%s %i" % (name, formatLabels(labels), self.count)
+
+class Profiler:
+    # samples the stacks of all the threads of the master
+    def __init__(self, path):
+        self.path = path
+        self.thread = None
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration):
+        if self.running():
+            return False
+
+        self.thread = threading.Thread(target = self.run, args = (min(duration, PROFILE_MAX_TIME),))
+        self.thread.daemon = True
+        self.thread.start()
+
+        return True
+
+    def run(self, duration):
+        stacks = collections.Counter()
+        own_id = threading.current_thread().ident
+        end = time.time() + duration
+
+        while time.time() < end:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    stack = traceback.extract_stack(frame)
+                    stacks[";".join(("%s:%s" % (os.path.basename(entry[0]), entry[2]) for entry in stack))] += 1
+
+            time.sleep(PROFILE_INTERVAL)
+
+        with open(self.path + ".tmp", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write("%s %i\n" % (stack, count))
+
+        replaceFile(self.path + ".tmp", self.path)
+
+class MasterMetrics:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+        self.requests = collections.Counter() # (method, route, code) -> count
+        self.request_times = {} # (method, route) -> Histogram
+        self.timings = {} # name -> Histogram, dispatch and balancing
+
+        self.transfer_bytes = collections.Counter() # direction -> bytes
+        self.transfer_time = collections.Counter() # direction -> seconds
+
+        self.slave_frames = collections.Counter() # slave id -> frames done
+        self.slave_bytes = collections.Counter() # (slave id, direction) -> bytes
+        self.slave_first_seen = {}
+
+        self.profiler = Profiler(os.path.join(path, "profile.txt"))
+
+    def request(self, method, path, code, duration):
+        key = (method, route(path))
+
+        with self.lock:
+            self.requests[key + (code,)] += 1
+
+            histogram = self.request_times.get(key)
+            if not histogram:
+                histogram = self.request_times[key] = Histogram()
+
+            histogram.observe(duration)
+
+    def timing(self, name, duration):
+        with self.lock:
+            histogram = self.timings.get(name)
+            if not histogram:
+                histogram = self.timings[name] = Histogram()
+
+            histogram.observe(duration)
+
+    def transfer(self, direction, size, duration, slave_id = None):
+        # direction: "in" for uploads to the master, "out" for downloads
+        with self.lock:
+            self.transfer_bytes[direction] += size
+            self.transfer_time[direction] += duration
+
+            if slave_id:
+                self.slave_bytes[(slave_id, direction)] += size
+
+    def frameDone(self, slave):
+        with self.lock:
+            self.slave_frames[slave.id] += 1
+            self.slave_first_seen.setdefault(slave.id, time.time())
+
+    def lines(self, server):
+        # all metrics, in the Prometheus text format
+        def metric(name, kind, description):
+            yield "# HELP %s %s" % (name, description)
+            yield "# TYPE %s %s" % (name, kind)
+
+        for line in metric("netrender_uptime_seconds", "gauge", "Time since the master started"):
+            yield line
+        yield "netrender_uptime_seconds %f" % (time.time() - self.start_time)
+
+        with self.lock:
+            for line in metric("netrender_requests_total", "counter", "Requests handled, by method, route and status code"):
+                yield line
+            for (method, path, code), count in sorted(self.requests.items()):
+                yield "netrender_requests_total%s %i" % (formatLabels((("method", method), ("route", path), ("code", code))), count)
+
+            for line in metric("netrender_request_seconds", "histogram", "Time to handle requests, by method and route"):
+                yield line
+            for (method, path), histogram in sorted(self.request_times.items()):
+                for line in histogram.lines("netrender_request_seconds", (("method", method), ("route", path))):
+                    yield line
+
+            for line in metric("netrender_operation_seconds", "histogram", "Time of master operations (dispatch, balancing)"):
+                yield line
+            for name, histogram in sorted(self.timings.items()):
+                for line in histogram.lines("netrender_operation_seconds", (("operation", name),)):
+                    yield line
+
+            for line in metric("netrender_transfer_bytes_total", "counter", "Bytes of files received (in) and sent (out) by the master"):
+                yield line
+            for direction, size in sorted(self.transfer_bytes.items()):
+                yield "netrender_transfer_bytes_total%s %i" % (formatLabels((("direction", direction),)), size)
+
+            for line in metric("netrender_transfer_seconds_total", "counter", "Time spent receiving (in) and sending (out) files"):
+                yield line
+            for direction, duration in sorted(self.transfer_time.items()):
+                yield "netrender_transfer_seconds_total%s %f" % (formatLabels((("direction", direction),)), duration)
+
+            slave_frames = dict(self.slave_frames)
+            slave_bytes = dict(self.slave_bytes)
+            slave_first_seen = dict(self.slave_first_seen)
+
+        jobs = collections.Counter()
+        frames = collections.Counter()
+        for job in server.jobs:
+            jobs[job.status] += 1
+            frames.update(job.framesStatus())
+
+        for line in metric("netrender_jobs", "gauge", "Jobs by status"):
+            yield line
+        for status, text in sorted(netrender.model.JOB_STATUS_TEXT.items()):
+            yield "netrender_jobs%s %i" % (formatLabels((("status", text),)), jobs[status])
+
+        for line in metric("netrender_frames", "gauge", "Frames of all jobs by status"):
+            yield line
+        for status, text in sorted(netrender.model.FRAME_STATUS_TEXT.items()):
+            yield "netrender_frames%s %i" % (formatLabels((("status", text),)), frames[status])
+
+        for line in metric("netrender_slaves", "gauge", "Connected slaves"):
+            yield line
+        yield "netrender_slaves %i" % len(server.slaves)
+
+        slave_metrics = (
+                         ("netrender_slave_frames_total", "counter", "Frames done by the slave"),
+                         ("netrender_slave_frames_per_hour", "gauge", "Frames done by the slave per hour since its first frame"),
+                         ("netrender_slave_bytes_total", "counter", "Bytes received from (in) and sent to (out) the slave by the master"),
+                         ("netrender_slave_upload_bytes_per_second", "gauge", "Upload rate measured by the slave"),
+                         ("netrender_slave_download_bytes_per_second", "gauge", "Download rate measured by the slave"),
+                         ("netrender_slave_transfer_latency_seconds", "gauge", "Mean response time of the transfers of the slave"),
+                        )
+
+        for name, kind, description in slave_metrics:
+            for line in metric(name, kind, description):
+                yield line
+
+            for slave in server.slaves:
+                labels = (("slave", slave.id), ("name", slave.name))
+                done = slave_frames.get(slave.id, 0)
+
+                if name == "netrender_slave_frames_total":
+                    yield "%s%s %i" % (name, formatLabels(labels), done)
+                elif name == "netrender_slave_frames_per_hour":
+                    hours = (time.time() - slave_first_seen.get(slave.id, time.time())) / 3600
+                    yield "%s%s %f" % (name, formatLabels(labels), done / hours if hours else 0.0)
+                elif name == "netrender_slave_bytes_total":
+                    for direction in ("in", "out"):
+                        yield "%s%s %i" % (name, formatLabels(labels + (("direction", direction),)), slave_bytes.get((slave.id, direction), 0))
+                elif name == "netrender_slave_upload_bytes_per_second":
+                    yield "%s%s %f" % (name, formatLabels(labels), slave.upload_bytes / slave.upload_time if slave.upload_time else 0.0)
+                elif name == "netrender_slave_download_bytes_per_second":
+                    yield "%s%s %f" % (name, formatLabels(labels), slave.download_bytes / slave.download_time if slave.download_time else 0.0)
+                elif name == "netrender_slave_transfer_latency_seconds":
+                    yield "%s%s %f" % (name, formatLabels(labels), slave.transfer_latency)
+
+def get(handler):
+    metrics = handler.server.metrics
+    url = urllib.parse.urlsplit(handler.path)
+
+    if url.path == "/metrics":
+        data = bytes("\n".join(metrics.lines(handler.server)) + "\n", encoding='utf8')
+        handler.send_data(data, content = "text/plain; version=0.0.4")
+    elif url.path == "/metrics/profile":
+        query = urllib.parse.parse_qs(url.query)
+
+        if "seconds" in query:
+            if metrics.profiler.start(float(query["seconds"][0])):
+                handler.send_head(http.client.ACCEPTED)
+            else: # already running
+                handler.send_head(http.client.CONFLICT)
+        elif os.path.exists(metrics.profiler.path):
+            handler.send_file(metrics.profiler.path, content = "text/plain")
+        else:
+            handler.send_head(http.client.NO_CONTENT)
+    else:
+        handler.send_head(http.client.NOT_FOUND)
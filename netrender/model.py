@@ -121,6 +121,18 @@ class RenderSlave:
         self.total_done = 0
         self.total_error = 0
         self.last_seen = 0.0
+
+        # shared file cache statistics of the slave
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_bytes_saved = 0
+
+        # transfer statistics of the slave
+        self.upload_bytes = 0
+        self.upload_time = 0.0
+        self.download_bytes = 0
+        self.download_time = 0.0
+        self.transfer_latency = 0.0
         
         if info:
             self.name = info.name
@@ -142,7 +154,15 @@ class RenderSlave:
                             "total_done": self.total_done,
                             "total_error": self.total_error,
                             "last_seen": self.last_seen,
-                            "tags": tuple(self.tags)
+                            "tags": tuple(self.tags),
+                            "cache_hits": self.cache_hits,
+                            "cache_misses": self.cache_misses,
+                            "cache_bytes_saved": self.cache_bytes_saved,
+                            "upload_bytes": self.upload_bytes,
+                            "upload_time": self.upload_time,
+                            "download_bytes": self.download_bytes,
+                            "download_time": self.download_time,
+                            "transfer_latency": self.transfer_latency
                         }
 
     @staticmethod
@@ -164,6 +184,14 @@ class RenderSlave:
         slave.total_error = data["total_error"]
         slave.last_seen = data["last_seen"]
         slave.tags = set(data["tags"])
+        slave.cache_hits = data.get("cache_hits", 0)
+        slave.cache_misses = data.get("cache_misses", 0)
+        slave.cache_bytes_saved = data.get("cache_bytes_saved", 0)
+        slave.upload_bytes = data.get("upload_bytes", 0)
+        slave.upload_time = data.get("upload_time", 0.0)
+        slave.download_bytes = data.get("download_bytes", 0)
+        slave.download_time = data.get("download_time", 0.0)
+        slave.transfer_latency = data.get("transfer_latency", 0.0)
 
         if cache:
             RenderSlave._slave_map[slave_id] = slave
@@ -266,6 +294,7 @@ class RenderJob:
         self.last_dispatched = 0.0
         self.frames = []
         self.transitions = []
+        self.unsigned_files = [] # files added but not hashed yet, see signFiles
         
         self._status = None
         
@@ -348,11 +377,20 @@ class RenderJob:
             
             
         if isFileInFrames(): 
+            rfile = RenderFile(file_path, len(self.files), start, end, None)
+            self.files.append(rfile)
+
+            # hashed all at once by signFiles
             if signed:
-                signature = hashFile(file_path)
-            else:
-                signature = None
-            self.files.append(RenderFile(file_path, len(self.files), start, end, signature))
+                self.unsigned_files.append(rfile)
+
+    def signFiles(self):
+        signatures = hashFiles([rfile.filepath for rfile in self.unsigned_files])
+
+        for rfile, signature in zip(self.unsigned_files, signatures):
+            rfile.signature = signature
+
+        self.unsigned_files = []
 
     def addFrame(self, frame_number, command = ""):
         frame = RenderFrame(frame_number, command)
@@ -0,0 +1,212 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import heapq
+import itertools
+import threading
+
+import netrender.model
+import netrender.balancing
+
+# Indexed job dispatching for the master
+#
+# Jobs that are queued and have queued frames are kept in heaps (one per set
+# of job tags) ordered by the balancer sort key. Heaps are rebuilt only when
+# the balancer invalidates all its keys (rule edit), otherwise only the jobs
+# whose rank or eligibility changed since the last dispatch are pushed again.
+#
+# Heap entries are never removed directly, an entry is only valid while it is
+# the current entry of its job in eligible, stale ones are dropped when popped.
+#
+# Request handlers run in several threads: all the scheduler state, the frame
+# indexes of the jobs and the balancer keys are changed with the lock held
+# (dispatching a job and taking its frames is done under it as well, see
+# RenderMasterServer.newDispatch).
+
+class Scheduler:
+    def __init__(self, balancer):
+        self.balancer = balancer
+        self.lock = threading.RLock()
+
+        self.jobs = {}
+        self.job_counts = dict.fromkeys(netrender.model.JOB_STATUS_TEXT, 0)
+
+        self.eligible = {} # job id -> current heap entry
+        self.heaps = {} # frozenset of job tags -> heap of [key, order, job]
+        self.blacklists = {} # slave id -> set of job ids
+        self.changed = set() # ids of jobs to update before the next dispatch
+
+        self.order = itertools.count()
+        self.generation = None # balancer generation of the heaps
+
+    def addJob(self, job):
+        with self.lock:
+            job.scheduler = self
+            self.jobs[job.id] = job
+            self.job_counts[job.status] += 1
+
+            for slave_id in job.blacklist:
+                self.blacklists.setdefault(slave_id, set()).add(job.id)
+
+            self.jobChanged(job, netrender.balancing.JOB_FIELDS)
+            self.globalChanged({"slaves"})
+
+    def removeJob(self, job):
+        with self.lock:
+            job.scheduler = None
+            del self.jobs[job.id]
+            self.job_counts[job.status] -= 1
+
+            self.eligible.pop(job.id, None)
+
+            for slave_id in job.blacklist:
+                self.blacklists.get(slave_id, set()).discard(job.id)
+
+            # ranks the other jobs of its category again, the removed job itself is skipped by update
+            self.jobChanged(job, netrender.balancing.JOB_FIELDS)
+            self.globalChanged({"slaves"})
+
+    def jobStatusChanged(self, job, old_status, new_status):
+        with self.lock:
+            if old_status is not None:
+                self.job_counts[old_status] -= 1
+            self.job_counts[new_status] += 1
+
+            # number of queued jobs is used by rules
+            self.globalChanged({"slaves"})
+            self.jobChanged(job, {"status"})
+
+    def jobChanged(self, job, fields):
+        with self.lock:
+            # eligibility depends on status and frames, rank on the balancer rules
+            for ranked in self.balancer.jobChanged(job, fields):
+                self.changed.add(ranked.id)
+
+            if not fields.isdisjoint({"status", "frames"}):
+                self.changed.add(job.id)
+
+    def globalChanged(self, fields):
+        # number of jobs or slaves, time
+        with self.lock:
+            for job in self.balancer.globalChanged(fields, self.jobs.values()):
+                self.changed.add(job.id)
+
+    def invalidate(self):
+        # rules edited, all jobs are ranked again at the next dispatch
+        with self.lock:
+            self.balancer.invalidate()
+
+    def usageScaled(self, factor, jobs):
+        # usage of all jobs multiplied by factor, then increased for jobs (the jobs being rendered)
+        with self.lock:
+            if self.balancer.usageScaled(factor):
+                # same order, the keys of the heap entries are scaled in place (stale ones too, for the heap invariant)
+                for heap in self.heaps.values():
+                    for entry in heap:
+                        key = entry[0]
+                        entry[0] = key[:-1] + (key[-1] * factor,)
+
+            for job in jobs:
+                self.jobChanged(job, {"usage"})
+
+    def countJobs(self, status = netrender.model.JOB_QUEUED):
+        return self.job_counts.get(status, 0)
+
+    def blacklistSlave(self, job, slave_id):
+        with self.lock:
+            if slave_id not in job.blacklist:
+                job.blacklist.append(slave_id)
+
+            self.blacklists.setdefault(slave_id, set()).add(job.id)
+
+    def isEligible(self, job):
+        return job.status == netrender.model.JOB_QUEUED and job.countFrames(status = netrender.model.FRAME_QUEUED) > 0
+
+    def push(self, job):
+        entry = [self.balancer.sortKey(job), next(self.order), job]
+        self.eligible[job.id] = entry
+        heapq.heappush(self.heaps.setdefault(frozenset(job.tags), []), entry)
+
+    def refresh(self, job):
+        if self.isEligible(job):
+            self.push(job)
+        else:
+            self.eligible.pop(job.id, None)
+
+    def balance(self):
+        self.eligible = {}
+        self.heaps = {}
+        self.changed = set()
+
+        for job in self.jobs.values():
+            if self.isEligible(job):
+                entry = [self.balancer.sortKey(job), next(self.order), job]
+                self.eligible[job.id] = entry
+                self.heaps.setdefault(frozenset(job.tags), []).append(entry)
+
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+        self.generation = self.balancer.generation
+
+    def update(self):
+        with self.lock:
+            if self.generation != self.balancer.generation or not self.balancer.incremental:
+                self.balance()
+            elif self.changed:
+                for job_id in self.changed:
+                    job = self.jobs.get(job_id)
+                    if job:
+                        self.refresh(job)
+
+                self.changed = set()
+
+    def nextJob(self, slave):
+        with self.lock:
+            self.update()
+
+            blacklisted = self.blacklists.get(slave.id, ())
+
+            # only look at the jobs with tags this slave has (or all if it doesn't use tags)
+            candidates = [heap for tags, heap in self.heaps.items() if heap and (not slave.tags or tags.issubset(slave.tags))]
+
+            skipped = []
+            found = None
+
+            while candidates and not found:
+                heap = min(candidates, key = lambda heap: heap[0])
+                entry = heapq.heappop(heap)
+                job = entry[2]
+
+                if self.eligible.get(job.id) is entry: # not stale
+                    skipped.append((heap, entry))
+
+                    if job.id not in blacklisted and not self.balancer.applyExceptions(job):
+                        found = job
+
+                if not heap:
+                    candidates = [heap for heap in candidates if heap]
+
+            # put back the valid entries, including the dispatched job until it gets refreshed
+            for heap, entry in skipped:
+                heapq.heappush(heap, entry)
+
+            if found:
+                self.changed.add(found.id)
+
+            return found
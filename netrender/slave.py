@@ -27,6 +27,9 @@ from netrender.utils import *
 import netrender.model
 import netrender.repath
 import netrender.baking
+import netrender.cache
+import netrender.transfer
+import netrender.worker
 import netrender.thumbnail as thumbnail
 
 BLENDER_PATH = sys.argv[0]
@@ -65,7 +68,7 @@ def testCancel(conn, job_id, frame_number):
         else:
             return False
 
-def testFile(conn, job_id, slave_id, rfile, job_prefix, main_path=None):
+def testFile(conn, job_id, slave_id, rfile, job_prefix, main_path=None, cache=None, stats=None):
     job_full_path = createLocalPath(rfile, job_prefix, main_path, rfile.force)
     
     found = os.path.exists(job_full_path)
@@ -81,30 +84,39 @@ def testFile(conn, job_id, slave_id, rfile, job_prefix, main_path=None):
     if not found:
         # Force prefix path if not found
         job_full_path = createLocalPath(rfile, job_prefix, main_path, True)
-        print("Downloading", job_full_path)
-        temp_path = os.path.join(job_prefix, "slave.temp")
-        with ConnectionContext():
-            conn.request("GET", fileURL(job_id, rfile.index), headers={"slave-id":slave_id})
-        response = conn.getresponse()
 
-        if response.status != http.client.OK:
-            return None # file for job not returned by server, need to return an error code to server
+        use_cache = cache and rfile.signature
 
-        f = open(temp_path, "wb")
-        buf = response.read(1024)
-
-        while buf:
-            f.write(buf)
-            buf = response.read(1024)
+        if use_cache and cache.fetch(rfile.signature, job_full_path):
+            print("Found in cache", job_full_path)
+        else:
+            print("Downloading", job_full_path)
+            # one temp file per job file, an interrupted download resumes from it
+            temp_path = os.path.join(job_prefix, "slave_%i.temp" % rfile.index)
+            status = netrender.transfer.downloadFile(conn, fileURL(job_id, rfile.index), {"slave-id":slave_id}, temp_path, stats)
 
-        f.close()
+            if status != http.client.OK:
+                return None # file for job not returned by server, need to return an error code to server
 
-        os.renames(temp_path, job_full_path)
+            if use_cache:
+                cache.store(rfile.signature, temp_path, job_full_path)
+            else:
+                os.renames(temp_path, job_full_path)
         
     rfile.filepath = job_full_path
 
     return job_full_path
 
+def sendLog(conn, job_id, frame_number, headers, data, offset):
+    # new output of the render, at offset in the log of this dispatch
+    headers = dict(headers)
+    headers["log-offset"] = str(offset)
+
+    with ConnectionContext():
+        conn.request("PUT", logURL(job_id, frame_number), data, headers=headers)
+
+    return responseStatus(conn)
+
 def breakable_timeout(timeout):
     for i in range(timeout):
         time.sleep(1)
@@ -150,14 +162,37 @@ def render_slave(engine, netsettings, threads):
 
         slave_id = response.getheader("slave-id")
 
+        # results are uploaded in the background while the next job renders
+        compress = netsettings.use_slave_compress and "gzip" in (response.getheader("accept-encoding") or "")
+        transfer_stats = netrender.transfer.TransferStats()
+        uploader = netrender.transfer.UploadQueue(conn, transfer_stats, compress)
+
+        if netsettings.use_slave_worker:
+            workers = netrender.worker.WorkerSlot(netsettings.slave_worker_memory * 1024 * 1024)
+        else:
+            workers = None
+
         NODE_PREFIX = os.path.join(slave_path, "slave_" + slave_id)
         verifyCreateDir(NODE_PREFIX)
 
+        # shared by all slaves using the same path
+        setSignatureIndexPath(os.path.join(slave_path, "signatures.json"))
+
+        if netsettings.use_slave_cache:
+            cache = netrender.cache.AssetCache(os.path.join(slave_path, "cache"), netsettings.slave_cache_size * 1024 * 1024)
+        else:
+            cache = None
+
         engine.update_stats("", "Network render connected to master, waiting for jobs")
 
         while not engine.test_break():
+            headers = {"slave-id":slave_id}
+            if cache:
+                headers.update(cache.statsHeaders())
+            headers.update(transfer_stats.statsHeaders())
+
             with ConnectionContext():
-                conn.request("GET", "/job", headers={"slave-id":slave_id})
+                conn.request("GET", "/job", headers=headers)
             response = conn.getresponse()
 
             if response.status == http.client.OK:
@@ -178,13 +213,19 @@ def render_slave(engine, netsettings, threads):
                     job_path = job.files[0].original_path # original path of the first file
                     main_path, main_file = os.path.split(job_path)
 
-                    job_full_path = testFile(conn, job.id, slave_id, job.files[0], job_prefix)
+                    # hash the files already on this node in parallel, testFile then uses the signature index
+                    local_paths = [createLocalPath(rfile, job_prefix, main_path if rfile != job.files[0] else None, rfile.force) for rfile in job.files if rfile.signature != None]
+                    hashFiles([local_path for local_path in local_paths if os.path.exists(local_path)])
+
+                    job_full_path = testFile(conn, job.id, slave_id, job.files[0], job_prefix, cache=cache, stats=transfer_stats)
                     print("Fullpath", job_full_path)
                     print("File:", main_file, "and %i other files" % (len(job.files) - 1,))
 
                     for rfile in job.files[1:]:
-                        testFile(conn, job.id, slave_id, rfile, job_prefix, main_path)
+                        testFile(conn, job.id, slave_id, rfile, job_prefix, main_path, cache, transfer_stats)
                         print("\t", rfile.filepath)
+
+                    saveSignatureIndex()
                         
                     netrender.repath.update(job)
 
@@ -217,7 +258,15 @@ def render_slave(engine, netsettings, threads):
                 # start render
                 start_t = time.time()
 
-                if job.rendersWithBlender():
+                if job.rendersWithBlender() and workers:
+                    for frame in job.frames:
+                        print("frame", frame.number)
+
+                    # rendered by the worker kept from the previous dispatch when it's for the same job file
+                    with NoErrorDialogContext():
+                        process = workers.render(job, job_full_path, os.path.join(job_prefix, "######"), threads, [frame.number for frame in job.frames])
+
+                elif job.rendersWithBlender():
                     frame_args = []
 
                     for frame in job.frames:
@@ -250,6 +299,7 @@ def render_slave(engine, netsettings, threads):
                     def __init__(self):
                         self.lock = threading.Lock()
                         self.stdout = bytes()
+                        self.log_offset = 0 # output already sent to the master
                         self.cancelled = False
                         self.start_time = time.time()
                         self.last_time = time.time()
@@ -279,9 +329,8 @@ def render_slave(engine, netsettings, threads):
                         # update logs if needed
                         if data.stdout:
                             # (only need to update on one frame, they are linked
-                            with ConnectionContext():
-                                conn.request("PUT", logURL(job.id, first_frame), data.stdout, headers=headers)
-                            responseStatus(conn)
+                            sendLog(conn, job.id, first_frame, headers, data.stdout, data.log_offset)
+                            data.log_offset += len(data.stdout)
                             
                             stdout_text = str(data.stdout, encoding='utf8')
                             
@@ -336,10 +385,7 @@ def render_slave(engine, netsettings, threads):
                         results.extend(netrender.baking.resultsFromOuput(lines))
 
                     # (only need to update on one frame, they are linked
-                    with ConnectionContext():
-                        conn.request("PUT", logURL(job.id, first_frame), data.stdout, headers=headers)
-                    
-                    if responseStatus(conn) == http.client.NO_CONTENT:
+                    if sendLog(conn, job.id, first_frame, headers, data.stdout, data.log_offset) == http.client.NO_CONTENT:
                         continue
 
                 total_t = time.time() - data.start_time
@@ -362,23 +408,15 @@ def render_slave(engine, netsettings, threads):
 
                             filename = os.path.join(job_prefix, "%06d.exr" % frame.number)
 
-                            # thumbnail first
+                            uploader.put("/render", headers, filename)
+
+                            # uploaded once made, doesn't hold the result upload back
                             if netsettings.use_slave_thumb:
-                                thumbname = thumbnail.generate(filename)
-                                
-                                if thumbname:
-                                    f = open(thumbname, 'rb')
-                                    with ConnectionContext():
-                                        conn.request("PUT", "/thumb", f, headers=headers)
-                                    f.close()
-                                    responseStatus(conn)
-
-                            f = open(filename, 'rb')
-                            with ConnectionContext():
-                                conn.request("PUT", "/render", f, headers=headers)
-                            f.close()
-                            if responseStatus(conn) == http.client.NO_CONTENT:
-                                continue
+                                def thumbDone(thumbname, headers = dict(headers)):
+                                    if thumbname:
+                                        uploader.put("/thumb", headers, thumbname)
+
+                                thumbnail.service().request(filename, thumbDone)
 
                         elif job.subtype == netrender.model.JOB_SUB_BAKING:
                             index = job.frames.index(frame)
@@ -389,33 +427,30 @@ def render_slave(engine, netsettings, threads):
                                 result_path, result_filename = os.path.split(result_filepath)
                                 headers["result-filename"] = result_filename
                                 headers["job-finished"] = str(result_filepath == frame_results[-1])
-                                    
-                                f = open(result_filepath, 'rb')
-                                with ConnectionContext():
-                                    conn.request("PUT", "/result", f, headers=headers)
-                                f.close()
-                                if responseStatus(conn) == http.client.NO_CONTENT:
-                                    continue
+
+                                uploader.put("/result", headers, result_filepath)
                             
                         elif job.type == netrender.model.JOB_PROCESS:
-                            with ConnectionContext():
-                                conn.request("PUT", "/render", headers=headers)
-                            if responseStatus(conn) == http.client.NO_CONTENT:
-                                continue
+                            uploader.put("/render", headers)
                 else:
                     headers["job-result"] = str(netrender.model.FRAME_ERROR)
                     for frame in job.frames:
                         headers["job-frame"] = str(frame.number)
-                        # send error result back to server
-                        with ConnectionContext():
-                            conn.request("PUT", "/render", headers=headers)
-                        if responseStatus(conn) == http.client.NO_CONTENT:
-                            continue
+                        # send error result back to server, after the results already queued
+                        uploader.put("/render", headers)
 
                 engine.update_stats("", "Network render connected to master, waiting for jobs")
             else:
                 bisleep.sleep()
 
+        if workers:
+            workers.stop()
+
+        # thumbnails are uploaded too
+        thumbnail.stop()
+
+        # finish sending the results before removing them
+        uploader.stop()
         conn.close()
 
         if netsettings.use_slave_clear:
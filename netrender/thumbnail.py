@@ -16,22 +16,45 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
+# Thumbnails of render results
+#
+# Thumbnails are made by one long-lived helper Blender process (this file run
+# with -P, see serve) reading the paths of the results on its stdin, instead
+# of a new Blender process per frame. Requests are queued and sent to the
+# helper in batches by a background thread, callers either wait for the
+# thumbnail (generate) or get called back when it's done (ThumbnailService.request).
+# Thumbnails are cached next to the results and made again only when the
+# result is newer.
+
 import sys, os
-import subprocess
+import subprocess, threading, queue
+
+try:
+    import bpy
+except ImportError:
+    bpy = None # master running outside of Blender, see loadtest.py
 
-import bpy
+THUMB_SIZE = 300
+DONE_MARKER = "NETRENDER_THUMB"
 
 def generate(filename, external=True):
     if external:
-        process = subprocess.Popen([sys.argv[0],"-b", "-noaudio", "-P", __file__, "--", filename], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        while process.poll() is None:
-            process.stdout.read(1024) # empty buffer to be sure
-        process.stdout.read()
-        
-        return _thumbname(filename)
+        return service().generate(filename)
     else:
         return _internal(filename)
 
+def cached(filename):
+    # thumbnail of filename if it exists and is up to date, None otherwise
+    thumbname = _thumbname(filename)
+
+    try:
+        if os.path.getmtime(thumbname) >= os.path.getmtime(filename):
+            return thumbname
+    except OSError:
+        pass
+
+    return None
+
 def _thumbname(filename):
     root = os.path.splitext(filename)[0]
     return root + ".jpg"
@@ -40,14 +63,11 @@ def _internal(filename):
     imagename = os.path.split(filename)[1]
     thumbname = _thumbname(filename)
 
-    if os.path.exists(thumbname):
-        return thumbname
-
     if bpy:
         scene = bpy.data.scenes[0] # FIXME, this is dodgy!
         scene.render.image_settings.file_format = "JPEG"
         scene.render.image_settings.quality = 90
-        
+
         # remove existing image, if there's a leftover (otherwise open changes the name)
         if imagename in bpy.data.images:
             img = bpy.data.images[imagename]
@@ -55,26 +75,192 @@ def _internal(filename):
 
         bpy.ops.image.open(filepath=filename)
         img = bpy.data.images[imagename]
-            
+
         img.save_render(thumbname, scene=scene)
-        
+
         img.user_clear()
         bpy.data.images.remove(img)
 
+        # downsample the saved jpeg, it's a plain image unlike multilayer results
+        thumb = bpy.data.images.load(thumbname)
+        width, height = thumb.size
+        factor = THUMB_SIZE / max(width, height, 1)
+
+        if factor < 1:
+            thumb.scale(max(int(width * factor), 1), max(int(height * factor), 1))
+            thumb.save()
+
+        thumb.user_clear()
+        bpy.data.images.remove(thumb)
+
+        return thumbname
+
+    return None
+
+class ThumbnailService:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.process = None
+
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, filename, callback = None):
+        # callback(thumbname) is called by the service thread, with None when the thumbnail couldn't be made
+        thumbname = cached(filename)
+
+        if thumbname:
+            if callback:
+                callback(thumbname)
+        else:
+            self.queue.put((filename, callback))
+
+    def generate(self, filename):
+        done = threading.Event()
+        result = []
+
+        def callback(thumbname):
+            result.append(thumbname)
+            done.set()
+
+        self.request(filename, callback)
+        done.wait()
+
+        return result[0]
+
+    def stop(self):
+        # thumbnails already requested are made first
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        running = True
+
+        while running:
+            batch = [self.queue.get()]
+
+            # everything requested while the last batch was made
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                running = False
+                batch = [task for task in batch if task is not None]
+
+            if batch:
+                results = self.makeBatch([filename for filename, callback in batch])
+
+                for filename, callback in batch:
+                    if callback:
+                        callback(results.get(filename))
+
+        self.stopHelper()
+
+    def startHelper(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen([sys.argv[0], "-b", "-noaudio", "-P", __file__, "--", "--serve"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def stopHelper(self):
+        if self.process and self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait()
+            except (IOError, OSError):
+                pass
+
+        self.process = None
+
+    def makeBatch(self, filenames):
+        # filename -> thumbnail, for the thumbnails made
+        results = {}
+        pending = set()
+
+        for filename in filenames:
+            thumbname = cached(filename) # requested more than once
+            if thumbname:
+                results[filename] = thumbname
+            else:
+                pending.add(filename)
+
+        if not pending:
+            return results
+
         try:
-            process = subprocess.Popen(["convert", thumbname, "-resize", "300x300", thumbname])
-            process.wait()
-            return thumbname
+            self.startHelper()
+            self.process.stdin.write(bytes("".join((filename + "\n" for filename in pending)), encoding='utf8'))
+            self.process.stdin.flush()
+
+            while pending:
+                line = self.process.stdout.readline()
+
+                if not line: # helper died, restarted with the next batch
+                    break
+
+                line = str(line, encoding='utf8', errors='replace').rstrip("\r\n")
+
+                if line.startswith(DONE_MARKER):
+                    marker, status, filename = line.split(" ", 2)
+                    pending.discard(filename)
+
+                    if status == "0":
+                        results[filename] = _thumbname(filename)
+        except (IOError, OSError) as err:
+            print("Error while generating thumbnails")
+            print(err)
+
+            self.stopHelper()
+
+        return results
+
+_service = None
+_service_lock = threading.Lock()
+
+def service():
+    global _service
+
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService()
+
+        return _service
+
+def stop():
+    global _service
+
+    with _service_lock:
+        if _service:
+            _service.stop()
+            _service = None
+
+def serve():
+    for line in sys.stdin:
+        filename = line.rstrip("\r\n")
+
+        if not filename:
+            continue
+
+        try:
+            status = 0 if _internal(filename) else 1
         except Exception as exp:
             print("Error while generating thumbnail")
             print(exp)
+            status = 1
 
-    return None
+        print("%s %i %s" % (DONE_MARKER, status, filename))
+        sys.stdout.flush()
 
 if __name__ == "__main__":
     try:
         start = sys.argv.index("--") + 1
     except ValueError:
         start = 0
-    for filename in sys.argv[start:]:
-        generate(filename, external=False)
+
+    if sys.argv[start:start + 1] == ["--serve"]:
+        serve()
+    else:
+        for filename in sys.argv[start:]:
+            generate(filename, external=False)
@@ -0,0 +1,274 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# File transfers between slaves and master
+#
+# Bodies are copied in chunks, never read whole in memory. Interrupted
+# downloads resume from the partial file with a Range request. Results are
+# uploaded by a background queue with its own connection, so the slave renders
+# the next job while the results of the previous one are sent. Uploads are gzip
+# compressed when the slave asks for it and the master accepts it (the
+# accept-encoding header of the slave registration). Slaves report their
+# transfer statistics to the master with the job requests.
+
+import os, re, time, queue, threading, tempfile, gzip, shutil, zlib
+import http, http.client
+
+from netrender.utils import *
+import netrender.model
+
+TRANSFER_CHUNK = 1 << 16
+UPLOAD_QUEUE_SIZE = 64 # uploads waiting before the slave blocks
+MAX_RETRY = 5
+RETRY_DELAY = 2 # seconds
+COMPRESS_LEVEL = 3
+
+range_pattern = re.compile("bytes=([0-9]*)-([0-9]*)$")
+
+def parseRange(value, size):
+    # (start, end) of a single byte range, end included, None for the whole file
+    # start is after end when the range can't be satisfied
+    if not value:
+        return None
+
+    match = range_pattern.match(value.strip())
+    if not match:
+        return None
+
+    start, end = match.groups()
+
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    elif end: # suffix range, last bytes of the file
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        return None
+
+    return start, end
+
+def copyLength(fsrc, fdst, length):
+    while length > 0:
+        data = fsrc.read(min(length, TRANSFER_CHUNK))
+        if not data:
+            raise http.client.IncompleteRead(b"", length)
+
+        fdst.write(data)
+        length -= len(data)
+
+def copyBody(fsrc, fdst, length, encoding = None):
+    # copy a request body of length bytes, decoding it if needed
+    if not encoding or encoding == "identity":
+        copyLength(fsrc, fdst, length)
+    elif encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        while length > 0:
+            data = fsrc.read(min(length, TRANSFER_CHUNK))
+            if not data:
+                raise http.client.IncompleteRead(b"", length)
+
+            fdst.write(decompressor.decompress(data))
+            length -= len(data)
+
+        fdst.write(decompressor.flush())
+    else:
+        raise ValueError("Unsupported content encoding " + encoding)
+
+def compressFile(filepath):
+    # gzip copy of the file next to it, to upload with a known length
+    fd, compressed_path = tempfile.mkstemp(suffix = ".gz", dir = os.path.dirname(filepath))
+
+    with open(filepath, "rb") as fsrc, os.fdopen(fd, "wb") as fdst:
+        with gzip.GzipFile(fileobj = fdst, mode = "wb", compresslevel = COMPRESS_LEVEL) as fzip:
+            shutil.copyfileobj(fsrc, fzip, TRANSFER_CHUNK)
+
+    return compressed_path
+
+class TransferStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.upload_bytes = 0
+        self.upload_time = 0.0
+        self.download_bytes = 0
+        self.download_time = 0.0
+        self.requests = 0
+        self.latency = 0.0 # total time waiting for responses
+
+    def addUpload(self, size, duration, latency):
+        with self.lock:
+            self.upload_bytes += size
+            self.upload_time += duration
+            self.requests += 1
+            self.latency += latency
+
+    def addDownload(self, size, duration, latency):
+        with self.lock:
+            self.download_bytes += size
+            self.download_time += duration
+            self.requests += 1
+            self.latency += latency
+
+    def statsHeaders(self):
+        with self.lock:
+            return {
+                    "transfer-upload-bytes": str(self.upload_bytes),
+                    "transfer-upload-time": str(self.upload_time),
+                    "transfer-download-bytes": str(self.download_bytes),
+                    "transfer-download-time": str(self.download_time),
+                    "transfer-latency": str(self.latency / self.requests if self.requests else 0.0)
+                    }
+
+def downloadFile(conn, url, headers, file_path, stats = None):
+    # download url to file_path, resuming from what is already in the file
+    # returns the status of the response, None if all tries failed
+    for attempt in range(MAX_RETRY):
+        offset = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+        request_headers = dict(headers)
+        if offset:
+            request_headers["range"] = "bytes=%i-" % offset
+
+        try:
+            start = time.time()
+            with ConnectionContext():
+                conn.request("GET", url, headers = request_headers)
+            response = conn.getresponse()
+            latency = time.time() - start
+
+            if response.status == http.client.PARTIAL_CONTENT:
+                mode = "ab"
+            elif response.status == http.client.OK:
+                mode = "wb"
+            elif response.status == http.client.REQUESTED_RANGE_NOT_SATISFIABLE:
+                # partial file isn't from the file on the master, start over
+                response.read()
+                os.remove(file_path)
+                continue
+            else:
+                response.read()
+                return response.status
+
+            with open(file_path, mode) as f:
+                length = int(response.getheader("content-length"))
+                copyLength(response, f, length)
+
+            if stats:
+                stats.addDownload(length, time.time() - start, latency)
+
+            return http.client.OK
+        except (IOError, OSError, http.client.HTTPException) as err:
+            print("Download of %s interrupted (%s), resuming" % (url, err))
+            conn.close() # reopened by the next request
+            time.sleep(RETRY_DELAY)
+
+    return None
+
+class UploadQueue:
+    def __init__(self, conn, stats, compress = False):
+        # same master as conn, on another connection
+        self.conn = conn.__class__(conn.host, conn.port, timeout = conn.timeout)
+        self.stats = stats
+        self.compress = compress
+
+        self.queue = queue.Queue(UPLOAD_QUEUE_SIZE)
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, url, headers, filepath = None):
+        self.queue.put((url, dict(headers), filepath))
+
+    def join(self):
+        self.queue.join()
+
+    def stop(self):
+        # sends the remaining uploads first
+        self.queue.put(None)
+        self.thread.join()
+        self.conn.close()
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+
+            try:
+                if task is None:
+                    break
+
+                self.upload(*task)
+            except Exception as err:
+                print("Upload of %s failed: %s" % (task[0], err))
+            finally:
+                self.queue.task_done()
+
+    def upload(self, url, headers, filepath):
+        status = self.send(url, headers, filepath)
+
+        if status is None and url in ("/render", "/result") and headers.get("job-result") == str(netrender.model.FRAME_DONE):
+            # result lost, report the frame as failed so the master doesn't wait for it
+            # (thumbnails are optional)
+            print("Reporting frame %s of job %s as failed" % (headers.get("job-frame"), headers.get("job-id")))
+
+            error_headers = {key: value for key, value in headers.items() if key in ("job-id", "job-frame", "job-time", "slave-id")}
+            error_headers["job-result"] = str(netrender.model.FRAME_ERROR)
+
+            status = self.send("/render", error_headers, None)
+
+        return status
+
+    def send(self, url, headers, filepath):
+        # PUT the file to url, returns the status of the response, None if all tries failed
+        upload_path = filepath
+
+        if filepath and self.compress:
+            upload_path = compressFile(filepath)
+            headers["content-encoding"] = "gzip"
+
+        try:
+            for attempt in range(MAX_RETRY):
+                try:
+                    start = time.time()
+
+                    if upload_path:
+                        size = os.path.getsize(upload_path)
+                        headers["content-length"] = str(size)
+                        with open(upload_path, "rb") as f:
+                            with ConnectionContext():
+                                self.conn.request("PUT", url, f, headers = headers)
+                    else:
+                        size = 0
+                        with ConnectionContext():
+                            self.conn.request("PUT", url, headers = headers)
+
+                    sent = time.time()
+                    status = responseStatus(self.conn)
+
+                    self.stats.addUpload(size, time.time() - start, time.time() - sent)
+
+                    return status
+                except (IOError, OSError, http.client.HTTPException) as err:
+                    print("Upload of %s interrupted (%s), retrying" % (url, err))
+                    self.conn.close()
+                    time.sleep(RETRY_DELAY)
+        finally:
+            if upload_path != filepath:
+                os.remove(upload_path)
+
+        return None
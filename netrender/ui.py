@@ -167,6 +167,17 @@ class RENDER_PT_network_slave_settings(NetRenderButtonsPanel, bpy.types.Panel):
         layout.prop(netsettings, "slave_render")
         layout.prop(netsettings, "slave_bake")
         layout.prop(netsettings, "use_slave_clear")
+        row = layout.row()
+        row.prop(netsettings, "use_slave_cache")
+        sub = row.row()
+        sub.active = netsettings.use_slave_cache
+        sub.prop(netsettings, "slave_cache_size")
+        layout.prop(netsettings, "use_slave_compress")
+        row = layout.row()
+        row.prop(netsettings, "use_slave_worker")
+        sub = row.row()
+        sub.active = netsettings.use_slave_worker
+        sub.prop(netsettings, "slave_worker_memory")
         layout.prop(netsettings, "use_slave_thumb")
         layout.prop(netsettings, "use_slave_output_log")
         layout.label(text="Threads:")
@@ -193,6 +204,7 @@ class RENDER_PT_network_master_settings(NetRenderButtonsPanel, bpy.types.Panel):
         layout.prop(netsettings, "use_master_broadcast")
         layout.prop(netsettings, "use_master_force_upload")
         layout.prop(netsettings, "use_master_clear")
+        layout.prop(netsettings, "use_master_async")
 
 class RENDER_PT_network_job(NetRenderButtonsPanel, bpy.types.Panel):
     bl_label = "Job Settings"
@@ -438,6 +450,33 @@ class NetRenderSettings(bpy.types.PropertyGroup):
                         description="delete downloaded files on exit",
                         default = True)
         
+        NetRenderSettings.use_slave_cache = BoolProperty(
+                        name="Shared file cache",
+                        description="Keep downloaded job files in a cache shared by all jobs and slaves using the same path",
+                        default = True)
+
+        NetRenderSettings.slave_cache_size = IntProperty(
+                        name="Cache size (MB)",
+                        description="Maximum size of the shared file cache, least recently used files are removed first (0 for no limit)",
+                        default = 10240,
+                        min = 0)
+
+        NetRenderSettings.use_slave_compress = BoolProperty(
+                        name="Compress uploads",
+                        description="Compress results sent to the master (gzip), for slow networks",
+                        default = False)
+
+        NetRenderSettings.use_slave_worker = BoolProperty(
+                        name="Persistent render process",
+                        description="Keep the file of a job loaded in a render process between dispatches instead of starting Blender for each one",
+                        default = False)
+
+        NetRenderSettings.slave_worker_memory = IntProperty(
+                        name="Memory growth (MB)",
+                        description="Restart the render process when its memory grows by more than this since its first render (0 for no limit)",
+                        default = 2048,
+                        min = 0)
+
         NetRenderSettings.use_slave_thumb = BoolProperty(
                         name="Generate thumbnails",
                         description="Generate thumbnails on slaves instead of master",
@@ -473,6 +512,11 @@ class NetRenderSettings(bpy.types.PropertyGroup):
                         name="Force Dependency Upload",
                         description="Force client to upload dependency files to master",
                         default = False)
+
+        NetRenderSettings.use_master_async = BoolProperty(
+                        name="Event Loop Server",
+                        description="Serve slaves and clients from an event loop with persistent connections (needs Python 3.5 or later)",
+                        default = False)
         
         default_path = os.environ.get("TEMP")
         
@@ -18,7 +18,7 @@
 
 import sys, os, re, platform
 import http, http.client, http.server, socket
-import subprocess, time, hashlib
+import subprocess, time, hashlib, json, threading, tempfile
 
 import netrender, netrender.model
 
@@ -231,17 +231,153 @@ def renderURL(job_id, frame_number):
 def cancelURL(job_id):
     return "/cancel_%s" % (job_id)
 
-def hashFile(path):
-    f = open(path, "rb")
-    value = hashData(f.read())
-    f.close()
-    return value
+HASH_CHUNK = 1 << 20
+HASH_THREADS = 4
+
+# Signatures of files already hashed, keyed on (path, size, mtime, inode) so
+# unchanged files aren't read again. Saved as json and shared by the processes
+# using the same index path.
+class SignatureIndex:
+    MAX_ENTRIES = 100000
+    RACY_DELAY = 2 # seconds, files modified more recently than that aren't indexed
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None # path -> [size, mtime, inode, signature, last used]
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def setPath(self, path):
+        with self.lock:
+            if path != self.path:
+                self.path = path
+                self.entries = None
+                self.dirty = False
+
+    def read(self):
+        try:
+            with open(self.path, "r", encoding="utf8") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self):
+        if self.entries is None:
+            self.entries = self.read()
+
+    def key(self, path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime, stat.st_ino
+
+    def lookup(self, path):
+        abs_path, size, mtime, inode = self.key(path)
+
+        with self.lock:
+            self.load()
+            entry = self.entries.get(abs_path)
+            if entry and entry[:3] == [size, mtime, inode]:
+                entry[4] = time.time()
+                return entry[3]
+
+        return None
+
+    def record(self, path, signature, key):
+        abs_path, size, mtime, inode = key
+
+        # don't trust the mtime of files that might still be written to
+        if mtime > time.time() - self.RACY_DELAY:
+            return
+
+        with self.lock:
+            self.load()
+            self.entries[abs_path] = [size, mtime, inode, signature, time.time()]
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            # keep what other processes saved in the meantime
+            entries = self.read()
+            entries.update(self.entries)
+
+            if len(entries) > self.MAX_ENTRIES:
+                newest = sorted(entries.items(), key=lambda item: item[1][4])[-self.MAX_ENTRIES:]
+                entries = dict(newest)
+
+            self.entries = entries
+
+            temp_path = "%s.%i.tmp" % (self.path, os.getpid())
+            try:
+                with open(temp_path, "w", encoding="utf8") as f:
+                    json.dump(entries, f)
+                replaceFile(temp_path, self.path)
+                self.dirty = False
+            except (IOError, OSError) as err:
+                print("Couldn't save signature index:", err)
+
+signature_index = SignatureIndex(os.path.join(tempfile.gettempdir(), "netrender_signatures.json"))
+
+def setSignatureIndexPath(path):
+    signature_index.setPath(path)
+
+def saveSignatureIndex():
+    # once per batch of files, saving rewrites the whole index
+    signature_index.save()
+
+def hashFile(path, save = False):
+    signature = signature_index.lookup(path)
+
+    if signature is None:
+        key = signature_index.key(path)
+
+        m = hashlib.md5()
+        with open(path, "rb") as f:
+            buf = f.read(HASH_CHUNK)
+            while buf:
+                m.update(buf)
+                buf = f.read(HASH_CHUNK)
+
+        signature = m.hexdigest()
+
+        signature_index.record(path, signature, key)
+
+        if save:
+            signature_index.save()
+
+    return signature
+
+def hashFiles(paths):
+    # hash independent files on a thread pool, signatures in the same order
+    if len(paths) <= 1:
+        signatures = [hashFile(path) for path in paths]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(HASH_THREADS) as pool:
+            signatures = list(pool.map(hashFile, paths))
+
+    saveSignatureIndex()
+
+    return signatures
     
 def hashData(data):
     m = hashlib.md5()
     m.update(data)
     return m.hexdigest()
 
+def replaceFile(src_path, dst_path):
+    # os.replace needs Python 3.3 and rename doesn't overwrite on Windows,
+    # remove the old file and rename again there
+    try:
+        os.rename(src_path, dst_path)
+    except OSError:
+        if not os.path.exists(dst_path):
+            raise
+        os.remove(dst_path)
+        os.rename(src_path, dst_path)
+
 def verifyCreateDir(directory_path):
     original_path = directory_path
     directory_path = os.path.expanduser(directory_path)
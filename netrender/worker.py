@@ -0,0 +1,209 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Persistent render workers on slaves
+#
+# A worker is a Blender process that keeps the file of a job loaded and
+# renders the frames it reads on its stdin, one "frame <number>" command per
+# line. The render output is sent on stdout like a normal render, followed by
+# a marker line once a frame is done. Slaves keep one worker and send it the
+# frames of all the dispatches of the same job file, so Blender startup and
+# scene loading are paid once per job instead of once per dispatch.
+#
+# Run by Blender as a script (-P worker.py -- output engine), see serve.
+
+import sys, os, time
+import subprocess
+
+BLENDER_PATH = sys.argv[0]
+
+DONE_MARKER = b"NETRENDER_FRAME_DONE"
+STOP_TIMEOUT = 10 # seconds
+STOP_POLL = 0.1 # seconds
+
+def memoryUsage(pid):
+    # resident memory of a process in bytes, None when it can't be measured
+    try:
+        with open("/proc/%i/statm" % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class WorkerChunk:
+    # frames of a dispatch rendered by a worker, used like the subprocess of a dispatch
+    def __init__(self, worker, frames):
+        self.worker = worker
+        self.stdout = self
+        self.remaining = set(frames)
+        self.failed = False
+        self.returncode = None
+
+        for frame in frames:
+            worker.send("frame %i" % frame)
+
+    def poll(self):
+        return self.returncode
+
+    def read(self, size = -1):
+        # one line of render output, markers are removed
+        # everything before the last marker has been read already, leftovers are empty
+        if size < 0 or self.returncode is not None:
+            return bytes()
+
+        line = self.worker.process.stdout.readline()
+
+        if not line: # worker died
+            self.returncode = self.worker.process.poll() or 1
+            return bytes()
+
+        if line.startswith(DONE_MARKER):
+            frame, status = line.split()[1:3]
+            self.remaining.discard(int(frame))
+            self.failed = self.failed or status != b"0"
+
+            if not self.remaining:
+                self.returncode = 1 if self.failed else 0
+
+            return bytes()
+
+        return line
+
+    def terminate(self):
+        self.worker.stop(force = True)
+
+class Worker:
+    def __init__(self, key, job_full_path, output_path, engine, threads):
+        self.key = key
+        self.base_memory = None
+
+        self.process = subprocess.Popen([BLENDER_PATH, "-b", "-noaudio", job_full_path, "-t", str(threads), "-P", __file__, "--", output_path, engine], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def memoryGrowth(self):
+        # memory used since the first test, after the file is loaded and rendered once
+        memory = memoryUsage(self.process.pid)
+
+        if memory is None:
+            return 0
+
+        if self.base_memory is None:
+            self.base_memory = memory
+
+        return memory - self.base_memory
+
+    def send(self, command):
+        self.process.stdin.write(bytes(command + "\n", encoding='utf8'))
+        self.process.stdin.flush()
+
+    def render(self, frames):
+        return WorkerChunk(self, frames)
+
+    def stop(self, force = False):
+        if not self.alive():
+            return
+
+        if not force:
+            try:
+                self.send("quit")
+            except (IOError, OSError):
+                pass
+            else:
+                # wait with a timeout needs Python 3.3, poll until the deadline
+                deadline = time.time() + STOP_TIMEOUT
+                while time.time() < deadline:
+                    if self.process.poll() is not None:
+                        return
+                    time.sleep(STOP_POLL)
+
+        try:
+            self.process.terminate()
+            self.process.wait()
+        except (IOError, OSError):
+            pass
+
+class WorkerSlot:
+    # the worker of a slave, replaced on job or file switch and when its memory grows too much
+    def __init__(self, memory_growth_limit = 0):
+        self.worker = None
+        self.memory_growth_limit = memory_growth_limit
+
+    def render(self, job, job_full_path, output_path, threads, frames):
+        key = (job.id, job_full_path)
+
+        if self.worker:
+            if self.worker.key != key:
+                print("Job switch, stopping render worker")
+                self.stop()
+            elif not self.worker.alive():
+                self.stop()
+            elif self.memory_growth_limit and self.worker.memoryGrowth() > self.memory_growth_limit:
+                print("Render worker memory grew over the limit, restarting it")
+                self.stop()
+
+        if not self.worker:
+            self.worker = Worker(key, job_full_path, output_path, job.render, threads)
+
+        return self.worker.render(frames)
+
+    def stop(self):
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
+
+def serve(output_path, engine):
+    import bpy
+
+    scene = bpy.context.scene
+    scene.render.filepath = output_path
+    scene.render.engine = engine
+    scene.render.image_settings.file_format = 'MULTILAYER'
+
+    for line in sys.stdin:
+        command = line.split()
+
+        if not command:
+            continue
+        elif command[0] == "quit":
+            break
+        elif command[0] == "frame":
+            frame = int(command[1])
+
+            try:
+                scene.frame_set(frame)
+                bpy.ops.render.render(write_still=True)
+                status = 0
+            except Exception as err:
+                print("Error rendering frame %i: %s" % (frame, err))
+                status = 1
+
+            sys.stdout.flush()
+            print("%s %i %i" % (str(DONE_MARKER, encoding='utf8'), frame, status))
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    try:
+        i = sys.argv.index("--")
+    except:
+        i = 0
+
+    if i:
+        output_path, engine = sys.argv[i+1:i+3]
+
+        serve(output_path, engine)